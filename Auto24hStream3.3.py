@@ -1,25 +1,29 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext, Menu
+from tkinter import ttk, filedialog, messagebox, scrolledtext, simpledialog, Menu
 import subprocess
-import threading
 import os
-import glob
 import time
-import sys
 import webbrowser
+import sqlite3
+import threading
+
+from media_library import LibraryStats, MediaIndex, find_video_files
+from ffmpeg_tools import MAX_FILE_FAILURES, STALL_WINDOW_SECONDS, STATE_IDLE, STATE_STOPPING
+from streamer_engine import (DEFAULT_LANG, FFMPEG_DEFAULT_PATH, MESSAGES, SHUTDOWN_TIMEOUT_SECONDS, StreamSettings,
+                             StreamerEngine)
+from control_client import REMOTE_ERRORS, RemoteEngine
+from control_server import CONTROL_HOST, DEFAULT_CONTROL_PORT
 
-VIDEO_EXTENSIONS = ["*.webm", "*.mp4", "*.mkv", "*.mov", "*.avi", "*.flv"]
-FFMPEG_DEFAULT_PATH = "ffmpeg"  # Assume ffmpeg is in PATH
-DEFAULT_LANG = "zh_CN"
 VERSION = '3.3 FE' # Version updated
+STATS_REFRESH_MS = 5000 # How often an open statistics window picks up index changes
+
 
-# --- Main Application Class ---
 class StreamerApp:
     def __init__(self, root):
         self.root = root
         self.setup_language()  # MUST be first
         self.root.title(self.get_translation('app_title'))
-        self.root.geometry("450x500") # Adjusted width slightly for new button
+        self.root.geometry("450x635") # Adjusted height for persistent connection / stream copy / cache / verify / restart options
         self.themes = {
             "默认 (Default)": {"bg": "#F0F0F0", "fg": "black", "widget_bg": "#FFFFFF", "widget_fg": "black",
                                 "button_bg": "#E0E0E0", "button_fg": "black", "disabled_fg": "#A0A0A0",
@@ -57,12 +61,21 @@ class StreamerApp:
         self.add_watermark = tk.BooleanVar()
         self.video_encoder = tk.StringVar(value="libx264 (CPU)")
         self.audio_handling = tk.StringVar(value="aac (Re-encode)")
-
-        self.streaming_active = False # Overall streaming state (controls loop)
-        self.stop_requested = False   # Explicit stop requested by user
-        self.switch_video_event = threading.Event() # Event to signal video switch
-        self.stream_thread = None
-        self.current_ffmpeg_process = None
+        self.persistent_publisher = tk.BooleanVar(value=False)
+        self.stream_copy_enabled = tk.BooleanVar(value=True)
+        self.cache_enabled = tk.BooleanVar(value=False)
+        self.cache_limit_gb = tk.StringVar(value="50")
+        self.verify_enabled = tk.BooleanVar(value=True)
+        self.max_file_failures = tk.StringVar(value=str(MAX_FILE_FAILURES))
+        self.stall_window = tk.StringVar(value=f"{STALL_WINDOW_SECONDS:g}")
+
+        # All streaming runs in the engine; this window only configures it and shows its output.
+        # While attached to a streamer in another process, self.engine is a RemoteEngine instead.
+        self.local_engine = self.engine = StreamerEngine(language=self.current_lang.get(), on_log=self.log,
+                                                         on_status=lambda fields: self._update_status(**fields),
+                                                         on_transition=self._on_engine_transition)
+        self.status_var = tk.StringVar(value="")
+        self._status_fields = {}
 
         # --- GUI Setup ---
         self.create_menu()  # Creates menu structure
@@ -103,47 +116,43 @@ class StreamerApp:
                 "watermark_invalid_msg": "请选择一个有效的水印图片文件。",
                 "stream_already_running_msg": "推流已经在运行中。",
                 "stream_not_running_msg": "推流尚未开始。",
-                "starting_stream_msg": "开始启动推流循环...",
-                "stopping_stream_msg": "正在尝试停止推流...",
-                "switching_video_msg": "正在请求切换到下一个视频...",
-                "terminating_ffmpeg_msg": "正在终止当前的 FFmpeg 进程 (PID: {pid})...",
-                "terminating_ffmpeg_for_switch_msg": "为切换视频，正在终止 FFmpeg 进程 (PID: {pid})...",
-                "ffmpeg_terminated_msg": "FFmpeg 进程已正常终止。",
-                "ffmpeg_terminate_failed_msg": "FFmpeg 进程未能正常终止，强制结束...",
-                "ffmpeg_killed_msg": "FFmpeg 进程已被强制结束。",
-                "ffmpeg_terminate_exception_msg": "无法终止 FFmpeg 进程: {error}",
                 "stream_thread_still_active_warn": "推流线程在停止请求后仍然活跃。",
                 "user_stop_completed_msg": "用户请求停止推流完成。",
                 "user_switch_initiated_msg": "用户请求切换视频。",
-                "no_videos_found_error": "在指定文件夹 '{folder}' 未找到视频文件 ({exts})。",
-                "found_videos_msg": "找到 {count} 个视频文件。开始循环播放。",
-                "loop_complete_msg": "完成一轮播放，从头开始下一轮。",
-                "starting_file_msg": "--- 开始推流: {filename} ---",
-                "copying_audio_info": "尝试直接复制音频流。如果源音频与目标不兼容可能会失败。",
-                "executing_command_msg": "执行命令: {command}",
-                "ffmpeg_output_log": "FFMPEG: {line}",
-                "stop_detected_ffmpeg_output_msg": "在 FFmpeg 输出期间检测到停止请求。",
-                "switch_detected_ffmpeg_output_msg": "在 FFmpeg 输出期间检测到切换视频请求。",
-                "stop_detected_after_file_msg": "推流 {filename} 在结束后检测到停止信号。",
-                "switch_detected_after_file_msg": "推流 {filename} 在结束后检测到切换信号，准备播放下一个。",
-                "stream_finished_success_msg": "--- 完成推流: {filename} (成功) ---",
-                "ffmpeg_error_exit_msg": "--- FFmpeg 错误退出 (代码 {code}) 对于: {filename} ---",
-                "ffmpeg_error_context_msg": "FFmpeg 可能的错误信息:\n{context}",
-                "continuing_after_error_warn": "检测到错误，将尝试播放列表中的下一个文件。",
-                "ffmpeg_command_not_found_fatal": "FATAL ERROR: '{path}' 命令未找到。请检查 FFmpeg 路径设置。",
-                "ffmpeg_unexpected_error_fatal": "FATAL ERROR: 运行 FFmpeg 时发生意外错误: {error}",
-                "exiting_loop_after_file_msg": "在文件处理完成后退出推流循环。",
-                "switching_to_next_video_msg": "--- 切换到下一个视频 ---",
-                "loop_terminated_unexpectedly_warn": "WARN: 推流循环意外终止。",
+                "stall_window_label": "停滞多少秒后重启 (0 = 关闭):",
+                "stall_window_invalid_msg": "停滞时间必须是不小于 0 的数字 (秒)。",
+                "max_failures_label": "文件失败几次后跳过:",
+                "max_failures_invalid_msg": "失败次数必须是大于 0 的整数。",
                 "buttons_reset_after_error_warn": "WARN: 推流循环已终止 (可能由于错误)。按钮已重置。",
-                "stream_thread_finished_msg": "INFO: 推流线程结束。",
                 "confirm_exit_msg": "推流正在进行中。\n您确定要停止推流并退出吗？",
-                "nvenc_driver_warning": "WARN: 检测到 NVENC 编码器。请确保您的 NVIDIA 驱动版本 >= 570.0 以获得最佳兼容性，否则可能出错。",
-                "amd_amf_warning": "WARN: 使用 h264_amf, 请确保驱动和 FFmpeg 支持良好。参数可能需调整。",
-                "intel_qsv_warning": "WARN: 使用 h264_qsv, 请确保驱动和 FFmpeg 支持良好。参数可能需调整。",
                 "ffmpeg_verified_msg": "INFO: 成功找到并验证 FFmpeg。",
-                "search_video_error_msg": "ERROR: 搜索视频文件时出错: {error} (路径: {folder})",
-                "filename_encoding_error": "[文件名编码错误 {index}]",
+                "persistent_publisher_check": "单连接持续推流 (切换文件不断流)",
+                "stream_copy_check": "符合推流规格的文件直接复制 (不重新编码)",
+                "cache_check": "后台预转码缓存 (上限 GB):",
+                "verify_check": "后台检查损坏文件并隔离 (低优先级解码)",
+                "library_stats_menu": "媒体库统计...",
+                "attach_menu": "连接到后台推流...",
+                "detach_menu": "断开连接 (推流继续)",
+                "attach_prompt_msg": "后台推流的控制地址 (streamer_cli.py --control-port):",
+                "attach_failed_msg": "无法连接到 {address}: {error}",
+                "attach_while_streaming_msg": "本窗口正在推流，请先停止再连接到后台推流。",
+                "attached_msg": "INFO: 已连接到 {address} 的推流，开始/停止/切换按钮现在控制它 (使用其自身设置)。关闭窗口不会停止它。",
+                "detached_msg": "INFO: 已断开与 {address} 的连接，推流在后台继续。",
+                "remote_lost_msg": "WARN: 与 {address} 的连接已断开: {error}",
+                "stats_window_title": "媒体库统计",
+                "stats_not_indexed_line": "注意: {count} 个文件尚未分析，开始推流后会在后台补全",
+                "stats_loading_line": "正在读取媒体库...",
+                "stats_files_line": "文件数: {files} (已隔离 {quarantined})",
+                "stats_duration_line": "总时长: {seconds:.0f} 秒，共 {hours:.2f} 小时",
+                "stats_size_line": "总大小: {gib:.2f} GiB",
+                "stats_bitrate_line": "平均码率: {kbps}",
+                "stats_copy_line": "可直接复制推流: 视频 {video}，音视频 {both}",
+                "stats_video_codecs_line": "视频编码: {codecs}",
+                "stats_audio_codecs_line": "音频编码: {codecs}",
+                "stats_histogram_title": "码率分布 (kb/s):",
+                "stats_folders_title": "按文件夹:",
+                "stats_folder_line": "{folder}: {files} 个文件，{hours:.2f} 小时，{gib:.2f} GiB",
+                "cache_limit_invalid_msg": "缓存上限必须是大于 0 的数字 (GB)。",
             },
             "en_US": {
                 "app_title": "AutoVideoStreamerGUI" + VERSION,
@@ -175,49 +184,47 @@ class StreamerApp:
                 "watermark_invalid_msg": "Please select a valid watermark image file.",
                 "stream_already_running_msg": "Streaming is already in progress.",
                 "stream_not_running_msg": "Streaming has not started yet.",
-                "starting_stream_msg": "Starting stream loop...",
-                "stopping_stream_msg": "Attempting to stop streaming...",
-                "switching_video_msg": "Requesting switch to next video...",
-                "terminating_ffmpeg_msg": "Terminating current FFmpeg process (PID: {pid})...",
-                "terminating_ffmpeg_for_switch_msg": "Terminating FFmpeg process for video switch (PID: {pid})...",
-                "ffmpeg_terminated_msg": "FFmpeg process terminated gracefully.",
-                "ffmpeg_terminate_failed_msg": "FFmpeg process did not terminate gracefully, killing...",
-                "ffmpeg_killed_msg": "FFmpeg process killed.",
-                "ffmpeg_terminate_exception_msg": "Could not terminate FFmpeg process: {error}",
                 "stream_thread_still_active_warn": "Stream thread still active after stop request.",
                 "user_stop_completed_msg": "Streaming stop requested by user completed.",
                 "user_switch_initiated_msg": "Video switch requested by user.",
-                "no_videos_found_error": "ERROR: No video files found in the specified folder '{folder}' ({exts}).",
-                "found_videos_msg": "INFO: Found {count} video files. Starting loop.",
-                "loop_complete_msg": "INFO: Completed one cycle, starting next loop.",
-                "starting_file_msg": "--- Starting stream for: {filename} ---",
-                "copying_audio_info": "INFO: Attempting to copy audio stream. May fail if incompatible.",
-                "executing_command_msg": "Executing: {command}",
-                "ffmpeg_output_log": "FFMPEG: {line}",
-                "stop_detected_ffmpeg_output_msg": "INFO: Stop requested detected during FFmpeg output.",
-                "switch_detected_ffmpeg_output_msg": "INFO: Switch video request detected during FFmpeg output.",
-                "stop_detected_after_file_msg": "INFO: Stop signal detected after processing {filename}.",
-                "switch_detected_after_file_msg": "INFO: Switch signal detected after processing {filename}, preparing next video.",
-                "stream_finished_success_msg": "--- Finished streaming: {filename} (Success) ---",
-                "ffmpeg_error_exit_msg": "--- FFmpeg exited with error (code {code}) for: {filename} ---",
-                "ffmpeg_error_context_msg": "FFmpeg potential error context:\n{context}",
-                "continuing_after_error_warn": "WARN: Error detected, attempting next file in playlist.",
-                "ffmpeg_command_not_found_fatal": "FATAL ERROR: '{path}' command not found. Check FFmpeg path setting.",
-                "ffmpeg_unexpected_error_fatal": "FATAL ERROR: An unexpected error occurred running FFmpeg: {error}",
-                "exiting_loop_after_file_msg": "INFO: Exiting stream loop after file completion due to stop request.",
-                "switching_to_next_video_msg": "--- Switching to next video ---",
-                "loop_terminated_unexpectedly_warn": "WARN: Stream loop terminated unexpectedly.",
+                "stall_window_label": "Restart when stalled for (s, 0 = off):",
+                "stall_window_invalid_msg": "Stall time must be a number of seconds, 0 or more.",
+                "max_failures_label": "Skip a file after failures:",
+                "max_failures_invalid_msg": "Failure count must be a whole number greater than 0.",
                 "buttons_reset_after_error_warn": "WARN: Stream loop terminated (possibly due to error). Buttons reset.",
-                "stream_thread_finished_msg": "INFO: Stream thread finished.",
                 "confirm_exit_msg": "Streaming is in progress.\nAre you sure you want to stop streaming and exit?",
-                "nvenc_driver_warning": "WARN: NVENC encoder selected. Ensure your NVIDIA driver version is >= 570.0 for best compatibility, otherwise errors may occur.",
-                "amd_amf_warning": "WARN: Using h264_amf, ensure drivers and FFmpeg support are correct. Parameters might need tuning.",
-                "intel_qsv_warning": "WARN: Using h264_qsv, ensure drivers and FFmpeg support are correct. Parameters might need tuning.",
                 "ffmpeg_verified_msg": "INFO: Found and verified FFmpeg successfully.",
-                "search_video_error_msg": "ERROR: Error searching for video files: {error} (Path: {folder})",
-                "filename_encoding_error": "[Filename Encoding Error {index}]",
+                "persistent_publisher_check": "Persistent connection (no reconnect between files)",
+                "stream_copy_check": "Stream-copy files that already meet the ingest profile",
+                "cache_check": "Background pre-transcode cache (limit GB):",
+                "verify_check": "Check files for corruption in background and quarantine them",
+                "library_stats_menu": "Library statistics...",
+                "attach_menu": "Attach to running streamer...",
+                "detach_menu": "Detach (stream continues)",
+                "attach_prompt_msg": "Control address of the running streamer (streamer_cli.py --control-port):",
+                "attach_failed_msg": "Cannot attach to {address}: {error}",
+                "attach_while_streaming_msg": "This window is streaming; stop it before attaching to another streamer.",
+                "attached_msg": "INFO: Attached to the streamer at {address}; Start/Stop/Switch now control it (with its own settings). Closing this window leaves it running.",
+                "detached_msg": "INFO: Detached from {address}; the stream goes on.",
+                "remote_lost_msg": "WARN: Lost the connection to {address}: {error}",
+                "stats_window_title": "Library statistics",
+                "stats_not_indexed_line": "Note: {count} files are not analysed yet; they are indexed in the background while streaming",
+                "stats_loading_line": "Reading the library...",
+                "stats_files_line": "Files: {files} ({quarantined} quarantined)",
+                "stats_duration_line": "Total duration: {seconds:.0f} s ({hours:.2f} h)",
+                "stats_size_line": "Total size: {gib:.2f} GiB",
+                "stats_bitrate_line": "Average bitrate: {kbps}",
+                "stats_copy_line": "Stream-copy ready: video {video}, video+audio {both}",
+                "stats_video_codecs_line": "Video codecs: {codecs}",
+                "stats_audio_codecs_line": "Audio codecs: {codecs}",
+                "stats_histogram_title": "Bitrate distribution (kb/s):",
+                "stats_folders_title": "Per folder:",
+                "stats_folder_line": "{folder}: {files} files, {hours:.2f} h, {gib:.2f} GiB",
+                "cache_limit_invalid_msg": "Cache limit must be a number greater than 0 (GB).",
             }
         }
+        for lang, messages in MESSAGES.items(): # Log and status texts come from the engine
+            self.translations[lang] = dict(messages, **self.translations[lang])
 
     def get_translation(self, key, **kwargs):
         lang = self.current_lang.get()
@@ -246,12 +253,24 @@ class StreamerApp:
         for theme_name in self.themes:
             self.theme_menu.add_radiobutton(label=theme_name, variable=self.selected_theme, command=self.apply_theme)
 
+        # 工具菜单（标题固定）
+        self.tools_menu = Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="工具(Tools)", menu=self.tools_menu)
+        self.tools_menu.add_command(label=self.get_translation('library_stats_menu'), command=self.show_library_stats)
+        self.tools_menu.add_command(label=self.get_translation('attach_menu'), command=self.attach_to_engine)
+        self.tools_menu.add_command(label=self.get_translation('detach_menu'), command=self.detach_from_engine,
+                                    state=tk.DISABLED)
+
     def switch_language(self):
+        self.local_engine.language = self.current_lang.get()
         # 更新窗口标题和菜单项标签
         self.root.title(self.get_translation('app_title'))
         try:
             self.lang_menu.entryconfig(0, label=self.get_translation('lang_chinese'))
             self.lang_menu.entryconfig(1, label=self.get_translation('lang_english'))
+            self.tools_menu.entryconfig(0, label=self.get_translation('library_stats_menu'))
+            self.tools_menu.entryconfig(1, label=self.get_translation('attach_menu'))
+            self.tools_menu.entryconfig(2, label=self.get_translation('detach_menu'))
         except Exception as e:
             print(f"语言菜单更新错误: {e}")
 
@@ -267,6 +286,12 @@ class StreamerApp:
             self.watermark_browse_btn.config(text=self.get_translation('browse_button'))
             self.video_encoder_label.config(text=self.get_translation('video_encoder_label'))
             self.audio_handling_label.config(text=self.get_translation('audio_handling_label'))
+            self.persistent_check.config(text=self.get_translation('persistent_publisher_check'))
+            self.stream_copy_check.config(text=self.get_translation('stream_copy_check'))
+            self.cache_check.config(text=self.get_translation('cache_check'))
+            self.verify_check.config(text=self.get_translation('verify_check'))
+            self.max_failures_label.config(text=self.get_translation('max_failures_label'))
+            self.stall_window_label.config(text=self.get_translation('stall_window_label'))
             self.start_button.config(text=self.get_translation('start_button'))
             self.stop_button.config(text=self.get_translation('stop_button'))
             self.switch_video_button.config(text=self.get_translation('switch_video_button'))
@@ -391,6 +416,29 @@ class StreamerApp:
                                                  state="readonly")
         self.audio_handling_combo.grid(row=6, column=1, columnspan=2, padx=5, pady=1, sticky=tk.EW)
 
+        self.persistent_check = ttk.Checkbutton(self.input_frame, text=self.get_translation('persistent_publisher_check'),
+                                                variable=self.persistent_publisher)
+        self.persistent_check.grid(row=7, column=0, columnspan=3, padx=5, pady=1, sticky=tk.W)
+        self.stream_copy_check = ttk.Checkbutton(self.input_frame, text=self.get_translation('stream_copy_check'),
+                                                 variable=self.stream_copy_enabled)
+        self.stream_copy_check.grid(row=8, column=0, columnspan=3, padx=5, pady=1, sticky=tk.W)
+        self.cache_check = ttk.Checkbutton(self.input_frame, text=self.get_translation('cache_check'),
+                                           variable=self.cache_enabled)
+        self.cache_check.grid(row=9, column=0, columnspan=2, padx=5, pady=1, sticky=tk.W)
+        self.cache_limit_entry = ttk.Entry(self.input_frame, textvariable=self.cache_limit_gb, width=8)
+        self.cache_limit_entry.grid(row=9, column=2, padx=5, pady=1, sticky=tk.EW)
+        self.verify_check = ttk.Checkbutton(self.input_frame, text=self.get_translation('verify_check'),
+                                            variable=self.verify_enabled)
+        self.verify_check.grid(row=10, column=0, columnspan=3, padx=5, pady=1, sticky=tk.W)
+        self.max_failures_label = ttk.Label(self.input_frame, text=self.get_translation('max_failures_label'))
+        self.max_failures_label.grid(row=11, column=0, columnspan=2, padx=5, pady=1, sticky=tk.W)
+        self.max_failures_entry = ttk.Entry(self.input_frame, textvariable=self.max_file_failures, width=8)
+        self.max_failures_entry.grid(row=11, column=2, padx=5, pady=1, sticky=tk.EW)
+        self.stall_window_label = ttk.Label(self.input_frame, text=self.get_translation('stall_window_label'))
+        self.stall_window_label.grid(row=12, column=0, columnspan=2, padx=5, pady=1, sticky=tk.W)
+        self.stall_window_entry = ttk.Entry(self.input_frame, textvariable=self.stall_window, width=8)
+        self.stall_window_entry.grid(row=12, column=2, padx=5, pady=1, sticky=tk.EW)
+
         self.input_frame.columnconfigure(1, weight=1)
 
         # --- Control Frame ---
@@ -412,6 +460,9 @@ class StreamerApp:
         self.github_button.pack(side=tk.LEFT, padx=5, pady=1)
 
 
+        self.status_label = ttk.Label(self.root, textvariable=self.status_var, anchor=tk.W)
+        self.status_label.pack(padx=10, fill=tk.X)
+
         # --- Log Output Frame ---
         self.log_frame = ttk.LabelFrame(self.root, text=self.get_translation('log_output_label'), padding="10")
         self.log_frame.pack(pady=3, padx=5, fill=tk.BOTH, expand=True)
@@ -419,6 +470,82 @@ class StreamerApp:
                                                   maxundo=100, undo=True, autoseparators=True, blockcursor=False)
         self.log_area.pack(fill=tk.BOTH, expand=True)
 
+    def show_library_stats(self):
+        """Opens a window with statistics of the video folder, read from the media index."""
+        folder = self.video_folder.get()
+        if self.local_engine.media_index is None:
+            try:
+                self.local_engine.media_index = MediaIndex()
+            except (OSError, sqlite3.Error) as e:
+                messagebox.showerror(self.get_translation('error_title'), str(e))
+                return
+        media_index = self.local_engine.media_index
+        not_indexed = 0
+        stats = LibraryStats(folder or None)
+
+        window = tk.Toplevel(self.root)
+        window.title(self.get_translation('stats_window_title'))
+        text = scrolledtext.ScrolledText(window, wrap=tk.WORD, width=70, height=24, state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+
+        def show(lines):
+            text.config(state=tk.NORMAL)
+            text.delete('1.0', tk.END)
+            text.insert(tk.END, "\n".join(lines))
+            text.config(state=tk.DISABLED)
+
+        def render():
+            summary = stats.summary()
+            files = summary["files"]
+            share = lambda n: f"{n} ({n * 100 / files:.0f}%)" if files else "0"
+            mix = lambda counter: ", ".join(f"{codec} {n}" for codec, n in counter.most_common()) or "-"
+            avg = summary["avg_bitrate_kbps"]
+            lines = []
+            if not_indexed:
+                lines.extend([self.get_translation('stats_not_indexed_line', count=not_indexed), ""])
+            lines.extend([
+                self.get_translation('stats_files_line', files=files, quarantined=summary["quarantined"]),
+                self.get_translation('stats_duration_line', seconds=summary["duration"], hours=summary["duration"] / 3600),
+                self.get_translation('stats_size_line', gib=summary["size"] / 1024 ** 3),
+                self.get_translation('stats_bitrate_line', kbps=f"{avg:.0f} kb/s" if avg else "-"),
+                self.get_translation('stats_copy_line', video=share(summary["copy_video"]), both=share(summary["copy_all"])),
+                self.get_translation('stats_video_codecs_line', codecs=mix(summary["video_codecs"])),
+                self.get_translation('stats_audio_codecs_line', codecs=mix(summary["audio_codecs"])),
+                "", self.get_translation('stats_histogram_title')])
+            lines.extend(f"  {label:>11}  {n}" for label, n in summary["bitrate_histogram"].items())
+            lines.extend(["", self.get_translation('stats_folders_title')])
+            lines.extend("  " + self.get_translation('stats_folder_line', folder=name, files=totals["files"],
+                                                     hours=totals["duration"] / 3600, gib=totals["size"] / 1024 ** 3)
+                         for name, totals in summary["folders"].items())
+            show(lines)
+
+        def refresh():
+            # Only rows that changed since the last refresh are re-read
+            if not window.winfo_exists():
+                return
+            if stats.refresh(media_index):
+                render()
+            window.after(STATS_REFRESH_MS, refresh)
+
+        def loaded(count):
+            nonlocal not_indexed
+            if not window.winfo_exists():
+                return
+            not_indexed = count
+            render()
+            window.after(STATS_REFRESH_MS, refresh)
+
+        def load():
+            # The folder walk and the first full read take seconds on a large library; keep the window responsive
+            count = 0
+            if folder and os.path.isdir(folder):
+                count = len(media_index.stale_paths(find_video_files(folder)))
+            stats.refresh(media_index)
+            self.root.after(0, loaded, count)
+
+        show([self.get_translation('stats_loading_line')])
+        threading.Thread(target=load, daemon=True).start()
+
     def log(self, message):
         def _log_on_main_thread():
             # Avoid logging if root is already destroyed
@@ -458,6 +585,19 @@ class StreamerApp:
              print(f"Log suppressed (root destroyed): {message}")
 
 
+    def _update_status(self, **fields):
+        """Merges status fields (None removes one) and redraws the status line."""
+        def _render():
+            for key, value in fields.items():
+                if value is None:
+                    self._status_fields.pop(key, None)
+                else:
+                    self._status_fields[key] = value
+            parts = [self.get_translation(key, **kwargs) for key, kwargs in self._status_fields.items()]
+            self.status_var.set(" | ".join(parts))
+        if self.root and self.root.winfo_exists():
+            self.root.after(0, _render)
+
     def browse_ffmpeg(self):
         path = filedialog.askopenfilename(title="Select ffmpeg.exe", filetypes=[("Executable", "*.exe"), ("All Files", "*.*")])
         if path:
@@ -490,7 +630,7 @@ class StreamerApp:
         if not hasattr(self, 'start_button') or not self.start_button.winfo_exists():
             return
 
-        if self.streaming_active:
+        if self.engine.running():
             self.start_button.config(state=tk.DISABLED)
             self.stop_button.config(state=tk.NORMAL)
             self.switch_video_button.config(state=tk.NORMAL) # Enable switch button
@@ -503,6 +643,13 @@ class StreamerApp:
             self.folder_entry.config(state=tk.DISABLED)
             self.folder_browse_btn.config(state=tk.DISABLED)
             self.watermark_check.config(state=tk.DISABLED)
+            self.persistent_check.config(state=tk.DISABLED)
+            self.stream_copy_check.config(state=tk.DISABLED)
+            self.cache_check.config(state=tk.DISABLED)
+            self.cache_limit_entry.config(state=tk.DISABLED)
+            self.verify_check.config(state=tk.DISABLED)
+            self.max_failures_entry.config(state=tk.DISABLED)
+            self.stall_window_entry.config(state=tk.DISABLED)
             # Use toggle_watermark_entry to handle watermark state correctly
             self.toggle_watermark_entry()
             # Ensure watermark controls are disabled if add_watermark is false during streaming (shouldn't happen but safe)
@@ -523,6 +670,13 @@ class StreamerApp:
             self.folder_entry.config(state=tk.NORMAL)
             self.folder_browse_btn.config(state=tk.NORMAL)
             self.watermark_check.config(state=tk.NORMAL)
+            self.persistent_check.config(state=tk.NORMAL)
+            self.stream_copy_check.config(state=tk.NORMAL)
+            self.cache_check.config(state=tk.NORMAL)
+            self.cache_limit_entry.config(state=tk.NORMAL)
+            self.verify_check.config(state=tk.NORMAL)
+            self.max_failures_entry.config(state=tk.NORMAL)
+            self.stall_window_entry.config(state=tk.NORMAL)
             self.toggle_watermark_entry() # Make sure watermark entry state is correct
 
     def validate_inputs(self):
@@ -570,84 +724,74 @@ class StreamerApp:
             if not watermark_path_val or not os.path.isfile(watermark_path_val):
                 messagebox.showerror(self.get_translation('error_title'), self.get_translation('watermark_invalid_msg'))
                 return False
+        if self.cache_enabled.get():
+            try:
+                limit_ok = float(self.cache_limit_gb.get()) > 0
+            except ValueError:
+                limit_ok = False
+            if not limit_ok:
+                messagebox.showerror(self.get_translation('error_title'), self.get_translation('cache_limit_invalid_msg'))
+                return False
+        try:
+            failures_ok = int(self.max_file_failures.get()) > 0
+        except ValueError:
+            failures_ok = False
+        if not failures_ok:
+            messagebox.showerror(self.get_translation('error_title'), self.get_translation('max_failures_invalid_msg'))
+            return False
+        try:
+            stall_ok = float(self.stall_window.get()) >= 0
+        except ValueError:
+            stall_ok = False
+        if not stall_ok:
+            messagebox.showerror(self.get_translation('error_title'), self.get_translation('stall_window_invalid_msg'))
+            return False
         return True
 
+    def _stream_settings(self):
+        """The engine settings from the (validated) input widgets."""
+        return StreamSettings(
+            ffmpeg_path=self.ffmpeg_path.get(),
+            rtmp_url=self.rtmp_url.get(),
+            stream_key=self.stream_key.get(),
+            video_folder=self.video_folder.get(),
+            video_encoder=self.video_encoder.get().split(" ")[0],
+            audio=self.audio_handling.get().split(" ")[0],
+            watermark=(self.watermark_path.get() or None) if self.add_watermark.get() else None,
+            persistent=self.persistent_publisher.get(),
+            stream_copy=self.stream_copy_enabled.get(),
+            cache=self.cache_enabled.get(),
+            cache_limit_gb=float(self.cache_limit_gb.get()) if self.cache_enabled.get() else 0.0,
+            verify=self.verify_enabled.get(),
+            max_file_failures=int(self.max_file_failures.get()),
+            stall_window=float(self.stall_window.get()))
+
     def start_streaming(self):
-        if not self.validate_inputs():
+        if self.engine is not self.local_engine:
+            settings = None # The attached streamer starts with its own settings
+        elif not self.validate_inputs():
             return
-        if self.streaming_active:
+        else:
+            settings = self._stream_settings()
+        if not self.engine.start(settings):
             self.log(self.get_translation('stream_already_running_msg'))
             return
-
-        self.streaming_active = True
-        self.stop_requested = False # Ensure stop flag is reset
-        self.switch_video_event.clear() # Ensure switch event is reset
         self.update_control_states()
-        self.log(self.get_translation('starting_stream_msg'))
-        self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
-        self.stream_thread.start()
-
-    def _request_ffmpeg_termination(self, reason="stop"):
-        """Requests termination of the current ffmpeg process without waiting."""
-        # Renamed from _terminate_ffmpeg_process to clarify it only sends signals
-        process_to_terminate = self.current_ffmpeg_process # Capture current process locally
-        if process_to_terminate and process_to_terminate.poll() is None:
-            pid = process_to_terminate.pid
-            log_msg_key = 'terminating_ffmpeg_for_switch_msg' if reason == "switch" else 'terminating_ffmpeg_msg'
-            self.log(self.get_translation(log_msg_key, pid=pid))
-            try:
-                # Try graceful termination first
-                process_to_terminate.terminate()
-                # Start a separate thread to handle kill if terminate fails after timeout
-                # This avoids blocking the UI thread or the stream_loop's signal handling
-                threading.Thread(target=self._ensure_ffmpeg_killed, args=(process_to_terminate, pid), daemon=True).start()
-
-            except Exception as e:
-                # Log error if initial terminate call fails
-                self.log(self.get_translation('ffmpeg_terminate_exception_msg', error=e))
-        # DO NOT set self.current_ffmpeg_process = None here. Let the main loop handle it.
-
-    def _ensure_ffmpeg_killed(self, process, expected_pid):
-        """Waits briefly for terminate, then kills if necessary."""
-        try:
-            process.wait(timeout=2) # Wait for terminate to work
-            self.log(self.get_translation('ffmpeg_terminated_msg') + f" (PID: {expected_pid})")
-        except subprocess.TimeoutExpired:
-            if process.poll() is None: # Check if it's still running
-                self.log(self.get_translation('ffmpeg_terminate_failed_msg') + f" (PID: {expected_pid})")
-                try:
-                    process.kill()
-                    process.wait(timeout=1) # Short wait after kill
-                    self.log(self.get_translation('ffmpeg_killed_msg') + f" (PID: {expected_pid})")
-                except Exception as kill_e:
-                    self.log(f"Error killing FFmpeg process (PID: {expected_pid}): {kill_e}")
-        except Exception as wait_e:
-             self.log(f"Error waiting for FFmpeg process termination (PID: {expected_pid}): {wait_e}")
-
 
     def stop_streaming(self):
-        if not self.streaming_active:
+        if not self.engine.stop():
             self.log(self.get_translation('stream_not_running_msg'))
             return
 
-        self.log(self.get_translation('stopping_stream_msg'))
-        self.stop_requested = True      # Signal the loop to stop
-        self.streaming_active = False   # Prevent new loops/videos
-        self.switch_video_event.set() # Also set switch event to interrupt ffmpeg read quickly
-
-        self._request_ffmpeg_termination(reason="stop") # Request termination
-
         # Schedule the UI update and final log message
         def _finalize_stop():
             # Wait briefly for thread to potentially finish processing the stop signal
-            if self.stream_thread and self.stream_thread.is_alive():
-                 self.stream_thread.join(timeout=1.0) # Slightly longer timeout for stop
-                 if self.stream_thread.is_alive():
-                     self.log(self.get_translation('stream_thread_still_active_warn'))
+            if not self.engine.wait(timeout=1.0): # Slightly longer timeout for stop
+                self.log(self.get_translation('stream_thread_still_active_warn'))
             # Ensure UI updates happen even if thread join times out
             if self.root and self.root.winfo_exists(): # Check root validity
-                # Update states only if the stream is not marked as active anymore
-                if not self.streaming_active:
+                # Update states only if the stream thread has finished
+                if not self.engine.running():
                      self.update_control_states()
                 self.log(self.get_translation('user_stop_completed_msg'))
             else:
@@ -659,317 +803,103 @@ class StreamerApp:
         else:
              print("Root destroyed before scheduling finalize_stop.")
 
-
     def switch_video(self):
-        if not self.streaming_active:
+        if not self.engine.switch():
             self.log(self.get_translation('stream_not_running_msg'))
             return
 
-        self.log(self.get_translation('switching_video_msg'))
-        self.switch_video_event.set() # Signal the loop to switch
-
-        # Request termination of the *current* ffmpeg process
-        self._request_ffmpeg_termination(reason="switch")
-
         self.log(self.get_translation('user_switch_initiated_msg'))
 
-
-    def stream_loop(self):
-        folder = self.video_folder.get()
-        video_files = []
-        try:
-            safe_folder = folder
-            # Attempt to handle potential encoding issues on Windows more robustly
-            if os.name == 'nt':
-                 try:
-                      # Try decoding from filesystem encoding, re-encoding to UTF-8
-                      safe_folder_bytes = safe_folder.encode(sys.getfilesystemencoding(), 'surrogateescape')
-                      safe_folder = safe_folder_bytes.decode('utf-8', 'replace')
-                 except Exception as enc_err:
-                      self.log(f"WARN: Could not fully normalize folder path encoding: {folder}. Error: {enc_err}")
-            for ext in VIDEO_EXTENSIONS:
-                # Use os.path.join for cross-platform compatibility
-                pattern = os.path.join(safe_folder, ext)
-                video_files.extend(glob.iglob(pattern))
-        except Exception as e:
-            self.log(self.get_translation('search_video_error_msg', error=e, folder=folder))
-            # Schedule UI reset from the main thread
-            if self.root and self.root.winfo_exists():
-                 self.root.after(100, self.reset_controls_after_error)
-            return
-
-        video_files = list(video_files) # Ensure it's a list
-        if not video_files:
-            self.log(self.get_translation('no_videos_found_error', folder=folder, exts=', '.join(VIDEO_EXTENSIONS)))
-            if self.root and self.root.winfo_exists():
-                self.root.after(100, self.reset_controls_after_error)
+    def _on_engine_transition(self, transition):
+        """Called on engine threads; refreshes the controls when streaming winds down."""
+        if not self.root or not self.root.winfo_exists():
             return
-
-        self.log(self.get_translation('found_videos_msg', count=len(video_files)))
-        file_index = 0
-        base_rtmp_url = self.rtmp_url.get().strip().rstrip('/')
-        stream_key = self.stream_key.get().strip()
-        full_rtmp_url = f"{base_rtmp_url}/{stream_key}"
-
-        # Main loop: continues as long as streaming is active and not explicitly stopped
-        while self.streaming_active and not self.stop_requested:
-            # --- Loop/Index Management ---
-            if file_index >= len(video_files):
-                file_index = 0 # Wrap around
-                if not self.streaming_active or self.stop_requested: break # Check flags before logging loop completion
-                self.log(self.get_translation('loop_complete_msg'))
-
-            current_file = video_files[file_index]
-            try:
-                # Use safer basename handling
-                base_name = os.path.basename(current_file)
-            except Exception:
-                 # Provide a more informative error message
-                base_name = self.get_translation('filename_encoding_error', index=file_index+1)
-            self.log(self.get_translation('starting_file_msg', filename=base_name))
-
-            # --- Clear switch flag for the new video ---
-            self.switch_video_event.clear()
-
-            # --- Build FFmpeg Command ---
-            # (Command building logic remains the same as v3.3)
-            cmd = [self.ffmpeg_path.get(), "-re", "-i", current_file]
-            filter_complex_parts = []
-            if self.add_watermark.get() and self.watermark_path.get(): # Check if path is set
-                cmd.extend(["-i", self.watermark_path.get()])
-                filter_complex_parts.append("[0:v][1:v]overlay=main_w-overlay_w-10:10")
-            if filter_complex_parts:
-                cmd.extend(["-filter_complex", ";".join(filter_complex_parts)])
-
-            v_enc_full = self.video_encoder.get()
-            v_enc = v_enc_full.split(" ")[0]
-            cmd.extend(["-c:v", v_enc])
-            common_params = ["-g", "60", "-pix_fmt", "yuv420p", "-max_muxing_queue_size", "1024"]
-            if v_enc == "libx264":
-                cmd.extend(["-preset", "veryfast", "-crf", "23", "-maxrate", "3500k", "-bufsize", "7000k"] + common_params)
-            elif v_enc == "h264_nvenc":
-                self.log(self.get_translation('nvenc_driver_warning'))
-                cmd.extend(["-preset", "p5", "-tune", "hq", "-rc", "cbr", "-b:v", "3500k", "-maxrate", "4000k", "-bufsize", "7000k"] + common_params)
-            elif v_enc == "h264_amf":
-                self.log(self.get_translation('amd_amf_warning'))
-                cmd.extend(["-quality", "balanced", "-rc", "cbr", "-b:v", "3500k", "-maxrate", "4000k", "-bufsize", "7000k"] + common_params)
-            elif v_enc == "h264_qsv":
-                self.log(self.get_translation('intel_qsv_warning'))
-                cmd.extend(["-preset", "medium", "-look_ahead", "1", "-rc_mode", "CBR", "-b:v", "3500k", "-max_bitrate", "4000k", "-bufsize", "7000k"] + common_params)
-            else: # Fallback to libx264 if unknown
-                cmd.extend(["-c:v", "libx264"])
-                cmd.extend(["-preset", "veryfast", "-crf", "23", "-maxrate", "3500k", "-bufsize", "7000k"] + common_params)
-            a_enc_full = self.audio_handling.get()
-            a_enc = a_enc_full.split(" ")[0]
-            cmd.extend(["-c:a", a_enc])
-            if a_enc == "aac":
-                cmd.extend(["-b:a", "128k", "-ar", "44100", "-strict", "-2"])
-            elif a_enc == "copy":
-                self.log(self.get_translation('copying_audio_info'))
-            cmd.extend(["-f", "flv", full_rtmp_url])
-            self.log(self.get_translation('executing_command_msg', command=' '.join(cmd)))
-
-            # --- Execute FFmpeg and Handle Output/Signals ---
-            process_finished_normally = False
-            ffmpeg_process_started = False # Flag to track if Popen was successful
-            stderr_lines = [] # Store recent stderr lines for error context
-            try:
-                creationflags = 0
-                if os.name == 'nt':
-                    creationflags = subprocess.CREATE_NO_WINDOW # Hide console window on Windows
-                # *** Critical: Set self.current_ffmpeg_process *only* after Popen succeeds ***
-                local_process = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
-                    encoding='utf-8', errors='replace', creationflags=creationflags
-                )
-                self.current_ffmpeg_process = local_process # Assign to instance variable
-                ffmpeg_process_started = True
-
-                # Read stderr line by line without blocking indefinitely
-                while self.streaming_active: # Check streaming_active frequently
-
-                    # *** Check for signals FIRST before accessing the process object ***
-                    if self.stop_requested:
-                        self.log(self.get_translation('stop_detected_ffmpeg_output_msg'))
-                        # Request termination if process is still running
-                        if self.current_ffmpeg_process and self.current_ffmpeg_process.poll() is None:
-                           self._request_ffmpeg_termination("stop")
-                        break # Exit inner stderr reading loop
-
-                    if self.switch_video_event.is_set():
-                        self.log(self.get_translation('switch_detected_ffmpeg_output_msg'))
-                         # Request termination if process is still running
-                        if self.current_ffmpeg_process and self.current_ffmpeg_process.poll() is None:
-                            self._request_ffmpeg_termination("switch")
-                        break # Exit inner stderr reading loop
-
-                    # *** Check if process ended on its own *before* reading ***
-                    # Ensure process object exists before polling
-                    if self.current_ffmpeg_process and self.current_ffmpeg_process.poll() is not None:
-                         break # Process finished
-
-                    # *** Read stderr only if process exists and hasn't finished ***
-                    if self.current_ffmpeg_process:
-                         try:
-                             line = self.current_ffmpeg_process.stderr.readline()
-                             if not line: # End of stream
-                                 break
-                             line = line.strip()
-                             if line:
-                                 self.log(self.get_translation('ffmpeg_output_log', line=line))
-                                 stderr_lines.append(line)
-                                 if len(stderr_lines) > 20: # Keep only last 20 lines
-                                     stderr_lines.pop(0)
-                         except Exception as read_err:
-                             # Check if the error is due to the process being terminated AFTER the poll check above
-                             if not self.current_ffmpeg_process or self.current_ffmpeg_process.poll() is not None:
-                                 self.log(f"INFO: FFmpeg stderr read ended as process terminated.")
-                             else:
-                                 self.log(f"WARN: Error reading FFmpeg stderr: {read_err}")
-                             break # Exit read loop on error or termination
-                    else:
-                         # Process became None unexpectedly or due to signal handling race condition (should be rare now)
-                         self.log("INFO: FFmpeg process became None during stderr read, exiting loop.")
-                         break
-
-                # --- Post-Process Handling (after stderr loop) ---
-                # Ensure cleanup happens even if stderr loop breaks early
-                return_code = None
-                if self.current_ffmpeg_process:
-                    # Wait for the process to finish if it hasn't already (e.g., due to signal break)
-                    try:
-                         # Use a timeout to avoid blocking indefinitely if termination fails unexpectedly
-                        self.current_ffmpeg_process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                         self.log(f"WARN: Timeout waiting for FFmpeg process (PID: {self.current_ffmpeg_process.pid}) to exit after loop.")
-                    except Exception as wait_err:
-                         self.log(f"WARN: Error during final FFmpeg process wait: {wait_err}")
-                    # Get final return code
-                    return_code = self.current_ffmpeg_process.poll()
-
-
-                # Check signals *again* after process finished/was terminated/waited upon
-                if self.stop_requested:
-                    self.log(self.get_translation('stop_detected_after_file_msg', filename=base_name))
-                    break # Exit the main 'while self.streaming_active' loop
-
-                if self.switch_video_event.is_set():
-                    self.log(self.get_translation('switch_detected_after_file_msg', filename=base_name))
-                    # Don't break the main loop, just continue to the next video
-                    file_index += 1
-                    self.log(self.get_translation('switching_to_next_video_msg'))
-                    continue # Go to the next iteration of the main while loop
-
-                # --- Handle Normal Exit / Errors ---
-                if return_code == 0:
-                    self.log(self.get_translation('stream_finished_success_msg', filename=base_name))
-                    process_finished_normally = True
-                # Check if process actually started before logging errors
-                elif ffmpeg_process_started:
-                     # Handle potential negative exit codes on Windows more gracefully
-                    effective_code = return_code if return_code is not None else "N/A"
-                    if os.name == 'nt' and return_code is not None and return_code < 0:
-                         effective_code = return_code & 0xFFFFFFFF # Treat as unsigned 32-bit
-                         self.log(f"WARN: FFmpeg exited with negative code {return_code}, interpreted as {effective_code}")
-
-                    # Log error only if it wasn't due to a user stop/switch signal detected *before* the error
-                    # (return_code might be non-zero due to termination signal)
-                    if not self.stop_requested and not self.switch_video_event.is_set():
-                         self.log(self.get_translation('ffmpeg_error_exit_msg', code=f"{return_code} ({effective_code})", filename=base_name))
-                         error_context = "\n".join(stderr_lines) # Use captured stderr
-                         self.log(self.get_translation('ffmpeg_error_context_msg', context=error_context))
-                         self.log(self.get_translation('continuing_after_error_warn'))
-                         time.sleep(3) # Pause briefly after an error before next file
-                    else:
-                         # Logged as stopped/switched, non-zero exit code is expected/acceptable
-                         self.log(f"INFO: FFmpeg exited with code {return_code} after stop/switch request for {base_name}.")
-
-
-            except FileNotFoundError:
-                self.log(self.get_translation('ffmpeg_command_not_found_fatal', path=self.ffmpeg_path.get()))
-                self.streaming_active = False # Stop loop on fatal error
-                self.stop_requested = True    # Ensure loop exit condition met
-            except Exception as e:
-                self.log(self.get_translation('ffmpeg_unexpected_error_fatal', error=e))
-                import traceback
-                self.log(traceback.format_exc())
-                self.streaming_active = False # Stop loop on fatal error
-                self.stop_requested = True    # Ensure loop exit condition met
-            finally:
-                 # *** This is the primary place to set process handle to None ***
-                 # Ensure it's cleared after wait()/poll() and error handling
-                 self.current_ffmpeg_process = None
-                 # Clear the switch flag here too, ready for the next potential video
-                 # Although cleared at the start of the loop, clearing here adds safety
-                 # self.switch_video_event.clear() # Decided against clearing here, start of loop is better
-
-            # --- Loop Increment / Exit Check ---
-            if not self.streaming_active or self.stop_requested:
-                 # Check again in case flags changed during error handling/sleep
-                 break
-            elif process_finished_normally:
-                 # Increment index only if the process finished without stop/switch/error request interrupting it mid-stream
-                 file_index += 1
-            # else: If process failed or was switched, loop continues without incrementing index (unless switched, then 'continue' was used)
-
-
-        # --- Loop Exit Logging ---
-        if self.stop_requested:
-            self.log(self.get_translation('exiting_loop_after_file_msg'))
-        elif self.streaming_active:
-            # If loop exits while streaming_active is true and stop wasn't requested, it was unexpected
-            self.log(self.get_translation('loop_terminated_unexpectedly_warn'))
-            if self.root and self.root.winfo_exists(): # Schedule UI reset
-                 self.root.after(100, self.reset_controls_after_error)
-
-        self.log(self.get_translation('stream_thread_finished_msg'))
-        # Final check to reset controls if the thread ends but stop wasn't explicitly called (e.g., error)
-        if not self.stop_requested and self.root and self.root.winfo_exists():
-             # Use after_idle to ensure this runs after any pending events
-             self.root.after_idle(self.reset_controls_if_needed)
-
-
-    def reset_controls_after_error(self):
-        """Resets controls specifically after an error terminates the loop."""
+        if transition.target == STATE_STOPPING:
+            self.root.after(0, self.update_control_states)
+        elif transition.target == STATE_IDLE:
+            self.root.after(0, self.reset_controls_after_stop)
+        elif transition.source == STATE_IDLE: # Started by another client of an attached streamer
+            self.root.after(0, self.update_control_states)
+
+    def reset_controls_after_stop(self):
+        """Re-enables the inputs once the engine is idle; warns if it stopped without the user asking."""
         if self.root and self.root.winfo_exists(): # Check root
-            # Only reset if streaming is not supposed to be active anymore
-            # Check both flags for robustness
-            if self.streaming_active or self.stop_requested:
-                self.streaming_active = False
-                self.stop_requested = False # Reset stop flag
-            self.switch_video_event.clear() # Reset switch flag
             self.update_control_states()
-            self.log(self.get_translation('buttons_reset_after_error_warn'))
+            if self.engine.stop_reason != "stop":
+                self.log(self.get_translation('buttons_reset_after_error_warn'))
 
-    def reset_controls_if_needed(self):
-        """Called after stream thread ends to reset UI if stop wasn't requested."""
-        if self.root and self.root.winfo_exists():
-             # If streaming_active is still True here, it means the loop ended without stop_requested
-             # This usually indicates an error condition that wasn't caught properly or list exhaustion
-             if self.streaming_active and not self.stop_requested:
-                  self.log("WARN: reset_controls_if_needed called while streaming_active=True and stop_requested=False. Resetting UI.")
-                  self.reset_controls_after_error() # Treat as error state
-             elif not self.streaming_active and not self.stop_requested:
-                 # If streaming stopped naturally (e.g. loop ended without error but wasn't explicitly stopped by user)
-                 # Ensure the UI reflects the non-streaming state.
-                 self.update_control_states()
+    def attach_to_engine(self):
+        """Asks for the control address of a streamer_cli.py and follows that stream instead of this window's."""
+        if self.local_engine.running():
+            messagebox.showerror(self.get_translation('error_title'), self.get_translation('attach_while_streaming_msg'))
+            return
+        address = simpledialog.askstring(self.get_translation('attach_menu'), self.get_translation('attach_prompt_msg'),
+                                         initialvalue=f"{CONTROL_HOST}:{DEFAULT_CONTROL_PORT}", parent=self.root)
+        if not address:
+            return
+        host, _, port = address.strip().rpartition(":")
+        try:
+            self._attach(host or CONTROL_HOST, int(port))
+        except REMOTE_ERRORS as e: # Includes a port that is not a number
+            messagebox.showerror(self.get_translation('error_title'),
+                                 self.get_translation('attach_failed_msg', address=address, error=e))
+
+    def _attach(self, host, port):
+        remote = RemoteEngine(host, port, on_log=self.log, on_status=lambda fields: self._update_status(**fields),
+                              on_transition=self._on_engine_transition,
+                              on_lost=lambda error: self.root.after(0, self._on_remote_lost, remote, error))
+        self._update_status(**{key: None for key in self._status_fields}) # The remote sends its own
+        remote.attach()
+        if self.engine is not self.local_engine:
+            self.engine.detach()
+        self.engine = remote
+        self.tools_menu.entryconfig(2, state=tk.NORMAL)
+        self.log(self.get_translation('attached_msg', address=f"{host}:{port}"))
+        self.update_control_states()
 
+    def detach_from_engine(self):
+        """Stops following the attached streamer, which keeps streaming, and returns to this window's engine."""
+        remote = self.engine
+        if remote is self.local_engine:
+            return
+        remote.detach()
+        self._use_local_engine()
+        self.log(self.get_translation('detached_msg', address=f"{remote.host}:{remote.port}"))
+
+    def _on_remote_lost(self, remote, error):
+        if self.engine is remote:
+            self._use_local_engine()
+            self.log(self.get_translation('remote_lost_msg', address=f"{remote.host}:{remote.port}", error=error))
+
+    def _use_local_engine(self):
+        self.engine = self.local_engine
+        self.tools_menu.entryconfig(2, state=tk.DISABLED)
+        self._update_status(**{key: None for key in self._status_fields})
+        self.update_control_states()
 
     def on_closing(self):
-        if self.streaming_active:
+        if self.engine is not self.local_engine:
+            self.engine.detach() # Only this window goes away; the attached streamer keeps running
+            self.root.destroy()
+            return
+        if self.engine.running():
             if messagebox.askyesno(self.get_translation('confirm_exit_title'), self.get_translation('confirm_exit_msg')):
                 self.stop_streaming()
-                # Give stop_streaming a moment to act before destroying root
-                self.root.after(500, self.root.destroy)
+                # Let ffmpeg flush and exit before the window (and with it the process) goes away
+                self._destroy_when_stopped(time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS + 1)
             # else: Do nothing if user selects 'No'
         else:
-            # Ensure thread cleanup even if not streaming but thread somehow exists
-            if self.stream_thread and self.stream_thread.is_alive():
+            # Give the stream thread a very short time to exit if it's stuck somehow
+            if not self.engine.wait(timeout=0.2):
                 self.log("WARN: Closing window with inactive stream thread.")
-                # Give it a very short time to exit if it's stuck somehow
-                self.stream_thread.join(timeout=0.2)
             self.root.destroy()
 
+    def _destroy_when_stopped(self, deadline):
+        if not self.engine.wait(timeout=0) and time.monotonic() < deadline:
+            self.root.after(100, self._destroy_when_stopped, deadline)
+            return
+        self.root.destroy()
+
 # --- Run the application ---
 if __name__ == "__main__":
     main_root = tk.Tk()
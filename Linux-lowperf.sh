@@ -15,8 +15,19 @@ FONT_RESET='\033[0m'
 # Supported video extensions
 VIDEO_EXTENSIONS=("mp4" "mkv" "webm" "avi" "mov" "flv" "ts" "mpg" "mpeg" "wmv")
 
+# Records the PID of the running stream loop so "Stop" ends exactly that loop
+STREAM_PIDFILE="${TMPDIR:-/tmp}/$(basename "$0").$(id -u).pid"
+
 command_exists() { command -v "$1" >/dev/null 2>&1; }
 
+descendant_pids() {
+    local child
+    for child in $(pgrep -P "$1" || true); do
+        echo "$child"
+        descendant_pids "$child"
+    done
+}
+
 ffmpeg_check_install() {
     if command_exists ffmpeg; then
         echo -e "${GREEN}FFmpeg is already installed.${FONT_RESET}"
@@ -121,6 +132,7 @@ stream_start() {
         fi
     done
     echo -e "${BLUE}Starting infinite streaming loop. Press Ctrl+C to stop.${FONT_RESET}"
+    echo "$$" > "$STREAM_PIDFILE"
     while true; do
         echo -e "${GREEN}Searching and shuffling videos in '$video_folder'...${FONT_RESET}"
         local find_options_str=""
@@ -160,30 +172,36 @@ stream_start() {
 }
 
 stream_stop() {
-    echo -e "${YELLOW}Stopping FFmpeg processes...${FONT_RESET}"
-    local killed_processes=false
-    if pgrep -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" > /dev/null; then
-        echo -e "${BLUE}Attempting graceful stop (SIGTERM)...${FONT_RESET}"
-        pkill -SIGTERM -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" && sleep 2
-        if pgrep -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" > /dev/null; then
-            echo -e "${YELLOW}Forceful stop (SIGKILL)...${FONT_RESET}"
-            pkill -SIGKILL -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://"
-        fi
-        echo -e "${GREEN}Targeted FFmpeg processes stopped.${FONT_RESET}"
-        killed_processes=true
-    fi
-    if ! $killed_processes; then
-        if pgrep ffmpeg > /dev/null; then
-            echo -e "${YELLOW}No stream processes found. Trying 'killall ffmpeg'...${FONT_RESET}"
-            if killall ffmpeg > /dev/null 2>&1; then
-                echo -e "${GREEN}All FFmpeg processes stopped.${FONT_RESET}"
-            else
-                echo -e "${RED}killall ffmpeg failed or no processes found.${FONT_RESET}"
-            fi
+    # Only the loop this script started (see STREAM_PIDFILE) is stopped; other channels and
+    # ffmpeg processes on the machine are not ours to kill
+    if [ -n "${AVS_CONTROL_PORT:-}" ]; then
+        # Set by the user for a streamer_cli.py channel they run with --control-port
+        local control_url="http://127.0.0.1:${AVS_CONTROL_PORT}/stop"
+        if command_exists curl && curl -fsS -m 15 -X POST "$control_url" > /dev/null 2>&1; then
+            echo -e "${GREEN}streamer_cli.py stopped through the control API (${control_url}).${FONT_RESET}"
         else
-            echo -e "${GREEN}No FFmpeg processes running.${FONT_RESET}"
+            echo -e "${RED}Control API at ${control_url} did not answer.${FONT_RESET}"
         fi
     fi
+    local loop_pid
+    loop_pid=$(cat "$STREAM_PIDFILE" 2>/dev/null || true)
+    if [ -z "$loop_pid" ] || ! ps -p "$loop_pid" -o args= 2>/dev/null | grep -q "$(basename "$0")"; then
+        rm -f "$STREAM_PIDFILE"
+        echo -e "${GREEN}No stream loop of this script running.${FONT_RESET}"
+        return 0
+    fi
+    echo -e "${YELLOW}Stopping the stream loop (PID ${loop_pid}) and its FFmpeg...${FONT_RESET}"
+    local pids
+    pids="$loop_pid $(descendant_pids "$loop_pid")"
+    echo -e "${BLUE}Attempting graceful stop (SIGTERM)...${FONT_RESET}"
+    kill -TERM $pids 2>/dev/null || true
+    sleep 2
+    if kill -0 $pids 2>/dev/null; then
+        echo -e "${YELLOW}Forceful stop (SIGKILL)...${FONT_RESET}"
+        kill -KILL $pids 2>/dev/null || true
+    fi
+    rm -f "$STREAM_PIDFILE"
+    echo -e "${GREEN}Stream loop stopped.${FONT_RESET}"
     echo -e "${YELLOW}If using screen/tmux, manually terminate the session as well.${FONT_RESET}"
 }
 
@@ -0,0 +1,145 @@
+import http.client
+import json
+import threading
+import time
+
+from ffmpeg_tools import STATE_IDLE, Transition
+
+REMOTE_POLL_SECONDS = 10.0 # Long-poll wait on /logs; changes arrive at once, this only bounds an idle request
+REMOTE_TIMEOUT_SECONDS = 5.0 # Connect and answer time allowed on top of that, and for each command
+REMOTE_ERRORS = (OSError, ValueError, http.client.HTTPException) # Unreachable, dropped or garbled
+
+
+class RemoteEngine:
+    """Client of a control_server.ControlServer that stands in for a StreamerEngine.
+
+    start(), stop() and switch() become commands to the remote engine. A background
+    thread long-polls /logs and turns what comes back into the same on_log, on_status
+    and on_transition callbacks a local engine makes, so the GUI can show a stream that
+    runs in another process (streamer_cli.py --control-port). detach() only ends the
+    polling; the remote stream goes on. on_lost(error) is called if the connection
+    breaks while attached.
+    """
+
+    def __init__(self, host, port, on_log=None, on_status=None, on_transition=None, on_lost=None):
+        self.host = host
+        self.port = port
+        self.on_log = on_log
+        self.on_status = on_status
+        self.on_transition = on_transition
+        self.on_lost = on_lost
+        self.language = None # Set like on a local engine; remote log lines arrive already translated
+        self.state = STATE_IDLE # As last reported by the remote engine
+        self.stop_reason = None
+        self.settings = None # Remote StreamSettings as a dict, stream key hidden
+        self.status_fields = {}
+        self._revision = 0
+        self._changed = threading.Condition()
+        self._attached = False
+
+    def attach(self):
+        """Loads the remote state and log backlog and starts following it.
+
+        Raises one of REMOTE_ERRORS if the control API cannot be reached.
+        """
+        status, reply = self._request("GET", "/logs?since=0")
+        if status != 200:
+            raise ValueError(reply.get("error", f"HTTP {status}"))
+        self._apply(reply)
+        self._attached = True
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def detach(self):
+        self._attached = False # The follower thread ends after its current long poll
+
+    def attached(self):
+        return self._attached
+
+    def running(self):
+        return self.state != STATE_IDLE
+
+    def start(self, settings=None):
+        """Starts the remote engine with its own settings; settings of this side are not sent."""
+        return self._command("/start")
+
+    def stop(self):
+        return self._command("/stop")
+
+    def switch(self):
+        return self._command("/switch")
+
+    def wait(self, timeout=None):
+        """Blocks until the remote engine is reported idle; False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.state == STATE_IDLE, timeout)
+
+    def _request(self, method, path, body=None, connection=None, timeout=REMOTE_TIMEOUT_SECONDS):
+        own_connection = connection is None
+        if own_connection:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            data = json.dumps(body).encode('utf-8') if body is not None else None
+            connection.request(method, path, body=data, headers={"Content-Type": "application/json"} if data else {})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            if own_connection:
+                connection.close()
+
+    def _command(self, path):
+        try:
+            status, reply = self._request("POST", path, {})
+        except REMOTE_ERRORS as e:
+            self._log(f"WARN: Control API request {path} failed: {e}")
+            return False
+        return status == 200 # The new state arrives through the follower, which alone sets it
+
+    def _follow(self):
+        # One kept-alive connection; the server answers as soon as anything changes
+        connection = http.client.HTTPConnection(self.host, self.port,
+                                                timeout=REMOTE_POLL_SECONDS + REMOTE_TIMEOUT_SECONDS)
+        try:
+            while self._attached:
+                try:
+                    status, reply = self._request("GET", f"/logs?since={self._revision}&wait={REMOTE_POLL_SECONDS:g}",
+                                                  connection=connection)
+                    if status != 200:
+                        raise ValueError(reply.get("error", f"HTTP {status}"))
+                except REMOTE_ERRORS as e:
+                    if self._attached:
+                        self._attached = False
+                        self._set_state(STATE_IDLE, "connection lost")
+                        if self.on_lost is not None:
+                            self.on_lost(e)
+                    return
+                if self._attached:
+                    self._apply(reply)
+        finally:
+            connection.close()
+
+    def _apply(self, reply):
+        for revision, wall, message in reply["lines"]:
+            self._log(message)
+        self._revision = reply["revision"]
+        fields = reply.get("status_fields") or {}
+        changes = {key: None for key in self.status_fields if key not in fields}
+        changes.update((key, value) for key, value in fields.items() if self.status_fields.get(key) != value)
+        self.status_fields = fields
+        if changes and self.on_status is not None:
+            self.on_status(changes)
+        self.stop_reason = reply.get("stop_reason")
+        self.settings = reply.get("settings")
+        self._set_state(reply["state"], "remote")
+
+    def _set_state(self, state, reason):
+        with self._changed:
+            source, self.state = self.state, state
+            self._changed.notify_all()
+        if source != state and self.on_transition is not None:
+            self.on_transition(Transition(time.monotonic(), time.time(), source, state, reason, None))
+
+    def _log(self, message):
+        if self.on_log is not None:
+            self.on_log(message)
+        else:
+            print(message, flush=True)
@@ -0,0 +1,324 @@
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ffmpeg_tools import ENGINE_STATES, FAILURE_CLASSES, STATE_STOPPING
+from streamer_engine import SHUTDOWN_TIMEOUT_SECONDS
+
+CONTROL_HOST = "127.0.0.1" # Loopback only: the API has no authentication
+DEFAULT_CONTROL_PORT = 8765
+LOCAL_HOST_NAMES = ("127.0.0.1", "localhost") # Accepted in the Host header; anything else may be DNS rebinding
+# Settings a /start body may override. Not the ffmpeg path (runs a program), the ingest URL or
+# key (would send the key elsewhere), nor file paths ffmpeg reads, such as the watermark.
+START_OVERRIDES = {"video_folder": str, "persistent": bool, "stream_copy": bool}
+COMMAND_ACK_SECONDS = 2.0 # How long a command waits for the engine to act on it before answering anyway
+RESTART_TIMEOUT_SECONDS = 2 * SHUTDOWN_TIMEOUT_SECONDS # For the old run to end on /reload
+CONTROL_POLL_SECONDS = 1.0 # How often the idle serving thread checks whether close() was called
+LOGS_MAX_WAIT_SECONDS = 30.0 # Longest long-poll /logs accepts
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8" # Prometheus text exposition format
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def engine_status(engine):
+    """What /status reports: a JSON-ready snapshot of the engine."""
+    settings = engine.settings
+    return {
+        "state": engine.state,
+        "seconds_in_state": round(engine.state_machine.time_in_state(), 3),
+        "stop_reason": engine.stop_reason,
+        "file": engine.current_file,
+        "position": round(engine.position, 3) if engine.current_file else None,
+        "playlist_size": len(engine.playlist),
+        "failures": dict(engine.failure_counts),
+        "stall_seconds": round(engine.stall_seconds, 3),
+        "status_fields": engine.status_snapshot(),
+        "settings": dict(settings._asdict(), stream_key="***") if settings is not None else None,
+    }
+
+
+def process_usage(pid):
+    """(CPU seconds, resident bytes) of a process, from /proc/<pid>/stat; None without /proc
+    (Windows, macOS) or once it has exited."""
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            fields = f.read().rsplit(b")", 1)[1].split() # The command name may contain spaces
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE # utime, stime, rss
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def engine_metrics(engine):
+    """What /metrics reports: the engine's counters and gauges in Prometheus text format.
+
+    Everything comes from values the supervision keeps anyway (latest progress samples,
+    counters, histograms) plus one /proc read per ffmpeg process, so a scrape every second
+    costs well under a millisecond.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    def histogram(name, help_text, hist):
+        counts, total = hist.snapshot()
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for le, count in zip([f"{bound:g}" for bound in hist.bounds] + ["+Inf"], counts):
+            lines.append(f'{name}_bucket{{le="{le}"}} {count}')
+        lines.append(f"{name}_sum {round(total, 6)}")
+        lines.append(f"{name}_count {counts[-1]}")
+
+    state = engine.state
+    metric("avs_engine_state", "gauge", "1 for the state the engine is in.",
+           [((("state", s),), int(s == state)) for s in ENGINE_STATES])
+    metric("avs_engine_state_seconds", "gauge", "Time spent in the current state.",
+           [((), round(engine.state_machine.time_in_state(), 3))])
+    metric("avs_playlist_files", "gauge", "Files in the playlist of the current run.", [((), len(engine.playlist))])
+    if engine.current_file:
+        metric("avs_current_file_info", "gauge", "The file being streamed.", [((("file", engine.current_file),), 1)])
+        metric("avs_position_seconds", "gauge", "Position in the current file.", [((), round(engine.position, 3))])
+
+    now = time.monotonic()
+    latest = [(channel, engine.telemetry.latest(channel)) for channel in sorted(engine.telemetry.channels())]
+    latest = [(channel, sample) for channel, sample in latest if sample is not None]
+    for name, help_text, read in (
+            ("avs_ffmpeg_fps", "Encode (or copy) rate of the latest progress sample, frames per second.",
+             lambda s: s.fps),
+            ("avs_ffmpeg_speed_ratio", "Media time per wall-clock time of the latest sample; 1.0 is realtime.",
+             lambda s: s.speed),
+            ("avs_ffmpeg_bitrate_bits_per_second", "Output bitrate of the latest sample.",
+             lambda s: None if s.bitrate_kbps is None else s.bitrate_kbps * 1000),
+            ("avs_ffmpeg_progress_age_seconds", "Time since the latest progress sample.",
+             lambda s: round(now - s.at, 3))):
+        samples = [((("channel", channel),), read(sample)) for channel, sample in latest]
+        metric(name, "gauge", help_text, [(labels, value) for labels, value in samples if value is not None])
+    channels = sorted({channel for channel, _ in engine.frame_totals})
+    metric("avs_ffmpeg_frames_dropped_total", "counter", "Frames ffmpeg dropped, over all its processes.",
+           [((("channel", channel),), engine.frame_totals[channel, "dropped"]) for channel in channels])
+    metric("avs_ffmpeg_frames_duplicated_total", "counter", "Frames ffmpeg duplicated, over all its processes.",
+           [((("channel", channel),), engine.frame_totals[channel, "duplicated"]) for channel in channels])
+
+    metric("avs_ffmpeg_failures_total", "counter", "Failed ffmpeg runs by cause; each one is retried or skipped.",
+           [((("cause", cause),), engine.failure_counts[cause]) for cause in FAILURE_CLASSES])
+    metric("avs_stall_seconds_total", "counter", "Time lost to stalls, from detection window start to resumed progress.",
+           [((), round(engine.stall_seconds, 3))])
+    histogram("avs_switch_latency_seconds", "From a switch command until the next file's media flows.",
+              engine.switch_latency)
+    histogram("avs_file_gap_seconds", "Time without media between two files.", engine.file_gap)
+
+    usage = []
+    for role, process in (("stream", engine.current_ffmpeg_process), ("publisher", engine.publisher_process)):
+        measured = process_usage(process.pid) if process is not None else None
+        if measured is not None:
+            usage.append((role, measured))
+    metric("avs_ffmpeg_cpu_seconds_total", "counter", "CPU time of the running ffmpeg process (Linux only).",
+           [((("process", role),), round(cpu, 2)) for role, (cpu, _) in usage])
+    metric("avs_ffmpeg_resident_memory_bytes", "gauge", "Resident memory of the running ffmpeg process (Linux only).",
+           [((("process", role),), rss) for role, (_, rss) in usage])
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _transition_json(transition):
+    return {"source": transition.source, "target": transition.target, "reason": transition.reason,
+            "latency_ms": None if transition.latency is None else round(transition.latency * 1000, 3)}
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive: clients polling /status do not reconnect each time
+    server_version = "AutoVideoStream"
+    disable_nagle_algorithm = True # Headers and body go out in two writes; Nagle would hold the body ~40 ms
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        control = self.server.control
+        path, _, query = self.path.partition("?")
+        path = path.rstrip("/") or "/"
+        route = control.routes.get((method, path))
+        refusal = self._refusal(control)
+        if refusal is not None:
+            self.close_connection = True # The body, if any, is not read
+            self._reply(403, {"ok": False, "error": refusal})
+            return
+        try:
+            body = self._read_json()
+            if query: # GET parameters, e.g. /logs?since=120&wait=10
+                body = dict(urllib.parse.parse_qsl(query), **body)
+            if route is None:
+                status, payload = 404, {"ok": False, "error": f"No such endpoint: {method} {path}"}
+            else:
+                status, payload = route(body)
+        except ValueError as e: # Also bad JSON
+            status, payload = 400, {"ok": False, "error": str(e)}
+        except Exception as e:
+            control.engine.log(control.engine.get_translation('control_error_msg', method=method, path=path, error=e))
+            status, payload = 500, {"ok": False, "error": str(e)}
+        self._reply(status, payload)
+
+    def _refusal(self, control):
+        """Why a request is not served, or None. Local programs such as curl are served; web pages
+        are not: a browser sends Origin with a cross-site POST, and a rebound DNS name in Host."""
+        allowed = {f"{name}:{control.port}" for name in LOCAL_HOST_NAMES + (control.host,)}
+        if self.headers.get("Host", "").lower() not in allowed:
+            return f"Host must be one of {', '.join(sorted(allowed))}"
+        origin = self.headers.get("Origin")
+        if origin is not None and origin.lower() not in {f"http://{host}" for host in allowed}:
+            return "Cross-origin requests are not accepted"
+        return None
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json": # Also keeps out text/plain forms, which need no preflight
+            self.close_connection = True # The body is not read
+            raise ValueError("Request body must be sent as application/json")
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def _reply(self, status, payload):
+        if isinstance(payload, str): # /metrics
+            data, content_type = payload.encode('utf-8'), METRICS_CONTENT_TYPE
+        else:
+            data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            content_type = "application/json; charset=utf-8"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # A line per status poll would drown the stream log
+
+
+class ControlServer:
+    """Loopback HTTP control API for one StreamerEngine, JSON in and out:
+
+        GET  /status    state, current file and position, failure counts, settings (key hidden)
+        GET  /metrics   Prometheus text format, see engine_metrics()
+        GET  /logs      ?since=REVISION&wait=SECONDS: log lines after REVISION plus /status,
+                        answered as soon as anything changes (long poll)
+        POST /start     start; the body may override the START_OVERRIDES settings, e.g. {"video_folder": ...}
+        POST /stop      graceful stop
+        POST /switch    next file
+        POST /skip-to   {"path": ...}, absolute or relative to the video folder
+        POST /reload    restart: folder read again, playback continues where it was
+
+    Commands answer once the engine has acted on them, with the transition they caused
+    and its latency, so scripts need no polling. One engine is one channel; run several
+    channels on several ports. Requests must name 127.0.0.1 or localhost in Host and may
+    not come from a web page (Origin), and bodies must be application/json.
+    """
+
+    def __init__(self, engine, settings=None, host=CONTROL_HOST, port=DEFAULT_CONTROL_PORT):
+        self.engine = engine
+        self.settings = settings # For /start before the engine has run
+        self.host = host
+        self.port = port
+        self.routes = {
+            ("GET", "/status"): self._status,
+            ("GET", "/metrics"): lambda body: (200, engine_metrics(self.engine)),
+            ("GET", "/logs"): self._logs,
+            ("POST", "/start"): self._start,
+            ("POST", "/stop"): lambda body: self._command(self.engine.stop),
+            ("POST", "/switch"): lambda body: self._command(self.engine.switch),
+            ("POST", "/skip-to"): self._skip_to,
+            ("POST", "/reload"): self._reload,
+        }
+        self._server = None
+
+    def start(self):
+        """Binds and serves on a background thread; raises OSError if the port is taken."""
+        server = ThreadingHTTPServer((self.host, self.port), _ControlHandler)
+        server.daemon_threads = True
+        server.control = self
+        self.port = server.server_address[1] # The real one if port 0 was asked for
+        self._server = server
+        threading.Thread(target=server.serve_forever, args=(CONTROL_POLL_SECONDS,), daemon=True).start()
+        self.engine.log(self.engine.get_translation('control_listening_msg', host=self.host, port=self.port))
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def _status(self, body):
+        return 200, dict(engine_status(self.engine), ok=True)
+
+    def _logs(self, body):
+        since = int(body.get("since", 0))
+        wait = min(max(float(body.get("wait", 0)), 0.0), LOGS_MAX_WAIT_SECONDS)
+        revision, lines = self.engine.changes_since(since, wait)
+        return 200, dict(engine_status(self.engine), ok=True, revision=revision, lines=lines)
+
+    def _start(self, body):
+        settings = self.engine.settings or self.settings
+        if settings is None:
+            raise ValueError("No settings to start with")
+        refused = sorted(set(body) - set(START_OVERRIDES))
+        if refused:
+            raise ValueError(f"Settings that cannot be changed through the API: {', '.join(refused)}")
+        for field, value in body.items():
+            if not isinstance(value, START_OVERRIDES[field]):
+                raise ValueError(f"{field} must be a {START_OVERRIDES[field].__name__}")
+        settings = settings._replace(**body)
+        if not settings.video_folder or not os.path.isdir(settings.video_folder):
+            raise ValueError(f"Not a directory: {settings.video_folder}")
+        if not self.engine.start(settings):
+            return 409, {"ok": False, "error": "Already streaming", "state": self.engine.state}
+        return 200, {"ok": True, "state": self.engine.state}
+
+    def _command(self, post):
+        posted_at = time.monotonic()
+        was_stopping = self.engine.state == STATE_STOPPING
+        if not post():
+            return 409, {"ok": False, "error": "Not streaming", "state": self.engine.state}
+        reply = {"ok": True}
+        if not was_stopping: # A stopping engine ignores commands; there is nothing to wait for
+            transition = self.engine.state_machine.wait_transition(posted_at, COMMAND_ACK_SECONDS)
+            if transition is not None:
+                reply["transition"] = _transition_json(transition)
+        reply["state"] = self.engine.state
+        return 200, reply
+
+    def _skip_to(self, body):
+        path = body.get("path")
+        if not isinstance(path, str) or not path:
+            raise ValueError('Expected {"path": ...}')
+        settings = self.engine.settings
+        if settings is not None and not os.path.isabs(path):
+            path = os.path.join(settings.video_folder, path)
+        playlist = {os.path.normpath(p): p for p in list(self.engine.playlist)}
+        target = playlist.get(os.path.normpath(path))
+        if target is None:
+            return 404, {"ok": False, "error": f"Not in the playlist: {path}", "state": self.engine.state}
+        return self._command(lambda: self.engine.skip_to(target))
+
+    def _reload(self, body):
+        if not self.engine.running():
+            return 409, {"ok": False, "error": "Not streaming", "state": self.engine.state}
+        if not self.engine.restart(timeout=RESTART_TIMEOUT_SECONDS):
+            return 503, {"ok": False, "error": "Restart failed: the old run did not end in time or another run started", "state": self.engine.state}
+        return 200, {"ok": True, "state": self.engine.state}
@@ -0,0 +1,665 @@
+import bisect
+import collections
+import io
+import math
+import queue
+import random
+import re
+import threading
+import time
+
+# Appended to every ffmpeg command whose progress we track: key=value blocks on stderr
+# (interleaved with ordinary log lines) instead of the human-oriented "frame= ... speed=" line
+PROGRESS_ARGS = ["-progress", "pipe:2", "-nostats"]
+PROGRESS_HISTORY = 600 # Samples kept per channel; ffmpeg reports about twice a second, so ~5 minutes
+# Histogram upper bounds for switch latency and the gap between files, in seconds
+HANDOVER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+RESTART_BASE_DELAY = 1.0 # Seconds before the first retry after a failed ffmpeg run
+RESTART_MAX_DELAY = 60.0
+RESTART_JITTER = 0.5 # Each delay is drawn from [delay * (1 - jitter), delay]
+MAX_FILE_FAILURES = 3 # Failed runs of one file before it is skipped
+
+# Failure classes of classify_failure(), each with its own restart strategy in the stream loop
+FAILURE_INPUT = "input" # The file itself: corrupt, truncated, unsupported codec -> skip it
+FAILURE_ENCODER = "encoder" # Hardware encoder could not start -> fall back to another encoder
+FAILURE_OUTPUT = "output" # Ingest refused or dropped the connection -> reconnect, same file and offset
+FAILURE_STALL = "stall" # Still running but no longer progressing (StallWatchdog) -> restart at the same offset
+FAILURE_UNKNOWN = "unknown"
+FAILURE_CLASSES = (FAILURE_INPUT, FAILURE_ENCODER, FAILURE_OUTPUT, FAILURE_STALL, FAILURE_UNKNOWN)
+
+REAPER_TICK_SECONDS = 0.05 # Resolution of the reaper's timer wheel
+QUIT_TIMEOUT_SECONDS = 2.0 # After "q" (or EOF) on stdin, before SIGTERM
+TERM_TIMEOUT_SECONDS = 2.0 # After SIGTERM, before SIGKILL
+
+STALL_WINDOW_SECONDS = 20.0 # How long progress may stall before the watchdog restarts ffmpeg
+STALL_MIN_SPEED = 0.8 # Realtime factor below which output falls behind a live audience
+
+# States of EngineStateMachine
+STATE_IDLE = "idle"
+STATE_STARTING = "starting" # Launching ffmpeg for a file; no media flowing yet
+STATE_PLAYING = "playing"
+STATE_SWITCHING = "switching" # Switch accepted; lasts until the next file's media flows
+STATE_BACKOFF = "backoff" # Waiting out a restart delay
+STATE_STOPPING = "stopping"
+ENGINE_STATES = (STATE_IDLE, STATE_STARTING, STATE_PLAYING, STATE_SWITCHING, STATE_BACKOFF, STATE_STOPPING)
+ENGINE_COMMANDS = ("stop", "switch")
+ENGINE_HISTORY = 500 # Transitions kept for latency analysis
+
+# Checked in this order against ffmpeg's error lines; the first class with a match wins.
+# Encoder messages come first because "Error while opening encoder" also names the output stream.
+# Lines prefixed with the output URL are treated as output errors before the remaining patterns.
+_FAILURE_PATTERNS = (
+    (FAILURE_ENCODER, re.compile(
+        r"^\[(?:h264|hevc)_(?:nvenc|amf|qsv) @|OpenEncodeSessionEx|No NVENC capable|"
+        r"Cannot load (?:nvcuda|libcuda|nvEncodeAPI)|AMF failed|\bMFX\b|libmfx|"
+        r"Error while opening encoder|Could not open encoder|"
+        r"Unknown encoder|Encoder not found|Error setting up the encoder", re.IGNORECASE)),
+    (FAILURE_OUTPUT, re.compile(
+        r"Connection refused|Connection reset|Connection timed out|Broken pipe|Network is unreachable|"
+        r"No route to host|Cannot open connection|Failed to connect|RTMP_Connect|Server error|"
+        r"Unauthorized|Forbidden|authentication|NetStream\.Publish\.(?:BadName|Rejected)|"
+        r"av_interleaved_write_frame|Error writing trailer|Error muxing a packet|"
+        r"Failed to update header", re.IGNORECASE)),
+    (FAILURE_INPUT, re.compile(
+        r"Invalid data found when processing input|moov atom not found|No such file or directory|"
+        r"could not find codec parameters|Decoder \(codec .*\) not found|Unsupported codec|"
+        r"Error while decoding|Invalid NAL unit|Header missing|corrupt|truncated|"
+        r"Error opening input", re.IGNORECASE)),
+)
+# Negative AVERROR codes as they appear in exit statuses (Windows passes them through unchanged)
+_AVERROR_CLASSES = {-1094995529: FAILURE_INPUT, # AVERROR_INVALIDDATA
+                    -1128613112: FAILURE_INPUT, # AVERROR_DECODER_NOT_FOUND
+                    -1129203192: FAILURE_ENCODER, # AVERROR_ENCODER_NOT_FOUND
+                    -32: FAILURE_OUTPUT} # AVERROR(EPIPE)
+
+# One -progress block. at is time.monotonic(), out_time is in seconds; fields ffmpeg
+# reported as N/A (e.g. bitrate before the first packet) are None
+ProgressSample = collections.namedtuple(
+    "ProgressSample", "at frame fps bitrate_kbps total_size out_time speed dup_frames drop_frames")
+
+_PROGRESS_KEYS = {"frame", "fps", "bitrate", "total_size", "out_time_us", "out_time_ms", "out_time",
+                  "dup_frames", "drop_frames", "speed", "progress"}
+
+
+def _number(value, cast=float, suffix=""):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return cast(value)
+    except ValueError:
+        return None # "N/A"
+
+
+class ProgressParser:
+    """Turns the key=value lines of `ffmpeg -progress` into ProgressSample tuples.
+
+    Lines that are not progress keys (warnings, errors, the input banner) are left to
+    the caller, so one stderr stream can carry both.
+    """
+
+    def __init__(self):
+        self._block = {}
+
+    @staticmethod
+    def is_progress_line(line):
+        key, sep, _ = line.partition("=")
+        return bool(sep) and (key in _PROGRESS_KEYS or key.startswith("stream_"))
+
+    def feed(self, line):
+        """Consumes one stripped line. Returns (is_progress, sample); sample is set when the line
+        ends a block (progress=continue/end)."""
+        if not self.is_progress_line(line):
+            return False, None
+        key, _, value = line.partition("=")
+        if key != "progress":
+            self._block[key] = value
+            return True, None
+        block, self._block = self._block, {}
+        out_time_us = _number(block.get("out_time_us", "N/A"), int)
+        sample = ProgressSample(
+            at=time.monotonic(),
+            frame=_number(block.get("frame", "N/A"), int),
+            fps=_number(block.get("fps", "N/A")),
+            bitrate_kbps=_number(block.get("bitrate", "N/A"), suffix="kbits/s"),
+            total_size=_number(block.get("total_size", "N/A"), int),
+            out_time=out_time_us / 1e6 if out_time_us is not None and out_time_us >= 0 else None,
+            speed=_number(block.get("speed", "N/A"), suffix="x"),
+            dup_frames=_number(block.get("dup_frames", "N/A"), int),
+            drop_frames=_number(block.get("drop_frames", "N/A"), int))
+        return True, sample
+
+
+class ProgressHistory:
+    """Bounded in-memory ring buffer of ProgressSample per channel (e.g. "stream", "publisher")."""
+
+    def __init__(self, maxlen=PROGRESS_HISTORY):
+        self.maxlen = maxlen
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def record(self, channel, sample):
+        with self._lock:
+            samples = self._channels.get(channel)
+            if samples is None:
+                samples = self._channels[channel] = collections.deque(maxlen=self.maxlen)
+            samples.append(sample)
+
+    def latest(self, channel):
+        with self._lock:
+            samples = self._channels.get(channel)
+            return samples[-1] if samples else None
+
+    def samples(self, channel, since=None):
+        """Samples of channel, oldest first; only those taken after since (monotonic) if given."""
+        with self._lock:
+            samples = list(self._channels.get(channel, ()))
+        if since is not None:
+            samples = [s for s in samples if s.at > since]
+        return samples
+
+    def channels(self):
+        with self._lock:
+            return list(self._channels)
+
+    def clear(self, channel=None):
+        with self._lock:
+            if channel is None:
+                self._channels.clear()
+            else:
+                self._channels.pop(channel, None)
+
+
+class Histogram:
+    """Counts of observed values per upper bound, plus their sum, as in a Prometheus histogram."""
+
+    def __init__(self, bounds=HANDOVER_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1) # The last one is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """(cumulative counts per bound with +Inf last, sum); the +Inf count is the total."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+        return counts, total
+
+
+def format_progress(sample):
+    """Short one-line rendering of a sample for logs and the status line."""
+    parts = []
+    if sample.out_time is not None:
+        seconds = int(sample.out_time)
+        parts.append(f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}")
+    if sample.fps is not None:
+        parts.append(f"{sample.fps:.1f} fps")
+    if sample.bitrate_kbps is not None:
+        parts.append(f"{sample.bitrate_kbps:.0f} kb/s")
+    if sample.speed is not None:
+        parts.append(f"{sample.speed:.2f}x")
+    if sample.drop_frames or sample.dup_frames:
+        parts.append(f"drop {sample.drop_frames or 0} / dup {sample.dup_frames or 0}")
+    return " | ".join(parts)
+
+
+# Outcome of RestartPolicy.record_failure: wait delay seconds, then retry the file or
+# (skip_file) move on to the next one
+RestartDecision = collections.namedtuple("RestartDecision", "delay skip_file failures file_failures")
+
+
+class RestartPolicy:
+    """Decides how long to wait after a failed ffmpeg run and when to give up on a file.
+
+    Consecutive failures back off exponentially with jitter, so an ingest outage costs one
+    spawn per delay instead of a tight retry loop; any successful run resets the delay.
+    Output failures and stalls never count against the file, input failures skip it at once, and
+    anything else skips it after max_file_failures failed runs. Whether it was the file's fault
+    is only known afterwards: if the next file streams fine the skipped one is returned by
+    record_success() to be flagged, if the next file fails too the output is the problem
+    and the skipped file is forgiven.
+    """
+
+    def __init__(self, base_delay=RESTART_BASE_DELAY, max_delay=RESTART_MAX_DELAY, jitter=RESTART_JITTER,
+                 max_file_failures=MAX_FILE_FAILURES):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_file_failures = max_file_failures
+        self.failures = 0 # Consecutive failed runs, across files
+        self.delay = 0.0 # Last delay handed out
+        self._file_failures = collections.Counter()
+        self._suspects = [] # Skipped files waiting for the next run to tell whose fault it was
+        self._lock = threading.Lock()
+
+    def record_failure(self, path, failure=FAILURE_UNKNOWN):
+        with self._lock:
+            if self._suspects and path not in self._suspects:
+                # Another file fails right after the skip: blame the output, not the files
+                for suspect in self._suspects:
+                    self._file_failures.pop(suspect, None)
+                self._suspects = []
+            self.failures += 1
+            if failure not in (FAILURE_OUTPUT, FAILURE_STALL):
+                self._file_failures[path] += 1
+            file_failures = self._file_failures[path]
+            skip_file = failure == FAILURE_INPUT or file_failures >= self.max_file_failures
+            if skip_file and path not in self._suspects:
+                self._suspects.append(path)
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+            self.delay = random.uniform(delay * (1 - self.jitter), delay)
+            return RestartDecision(self.delay, skip_file, self.failures, file_failures)
+
+    def record_success(self, path):
+        """Resets the backoff; returns the skipped files now known to be broken themselves."""
+        with self._lock:
+            self.failures = 0
+            self.delay = 0.0
+            self._file_failures.pop(path, None)
+            confirmed = [suspect for suspect in self._suspects if suspect != path]
+            for suspect in confirmed:
+                self._file_failures.pop(suspect, None)
+            self._suspects = []
+            return confirmed
+
+    def state(self):
+        """Snapshot for status output."""
+        with self._lock:
+            return {"failures": self.failures, "delay": self.delay, "max_file_failures": self.max_file_failures,
+                    "failing_files": len(self._file_failures), "suspects": list(self._suspects)}
+
+
+def classify_failure(return_code, stderr_lines, input_path=None, output_url=None):
+    """Maps a failed run to one of FAILURE_CLASSES from its exit code and last stderr lines.
+
+    ffmpeg prefixes I/O errors with the URL they concern, so a line starting with
+    output_url is an output error and, failing any known message, one starting with
+    input_path an input error.
+    """
+    encoder_pattern = _FAILURE_PATTERNS[0][1]
+    if any(encoder_pattern.search(line) for line in stderr_lines):
+        return FAILURE_ENCODER
+    if output_url and any(line.startswith(output_url) for line in stderr_lines):
+        return FAILURE_OUTPUT
+    for failure, pattern in _FAILURE_PATTERNS[1:]:
+        if any(pattern.search(line) for line in stderr_lines):
+            return failure
+    if input_path and any(line.startswith(input_path) for line in stderr_lines):
+        return FAILURE_INPUT
+    if return_code is not None:
+        if return_code > 2 ** 31:
+            return_code -= 2 ** 32 # Windows reports the unsigned value
+        return _AVERROR_CLASSES.get(return_code, FAILURE_UNKNOWN)
+    return FAILURE_UNKNOWN
+
+
+# Why StallWatchdog.check() gave up: reason is "no progress", "frozen" or "slow", since is the
+# monotonic time progress was last healthy, speed the realtime factor over the window
+Stall = collections.namedtuple("Stall", "reason since speed")
+
+
+class StallWatchdog:
+    """Notices an ffmpeg that is still running but no longer streaming.
+
+    Speed is measured over the last window seconds of out_time rather than taken from
+    ffmpeg's own speed= field, which averages over the whole run and would take hours
+    to reflect a collapse late in a long file. Time counts from creation, so a process
+    that never produces a sample stalls too. A window of 0 disables the watchdog.
+    """
+
+    def __init__(self, window=STALL_WINDOW_SECONDS, min_speed=STALL_MIN_SPEED):
+        self.window = window
+        self.min_speed = min_speed
+        now = time.monotonic()
+        self._last_sample = now
+        self._last_advance = now
+        self._points = collections.deque() # (at, out_time), spanning a little more than window
+
+    def observe(self, sample):
+        self._last_sample = sample.at
+        if sample.out_time is None:
+            return
+        if not self._points or sample.out_time > self._points[-1][1]:
+            self._last_advance = sample.at
+        self._points.append((sample.at, sample.out_time))
+        while len(self._points) > 2 and self._points[1][0] <= sample.at - self.window:
+            self._points.popleft()
+
+    def check(self, now=None):
+        """Returns a Stall once progress has been unhealthy for window seconds, else None."""
+        if not self.window:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if now - self._last_sample >= self.window:
+            return Stall("no progress", self._last_sample, 0.0)
+        if now - self._last_advance >= self.window:
+            return Stall("frozen", self._last_advance, 0.0)
+        if len(self._points) >= 2:
+            (start_at, start_out), (end_at, end_out) = self._points[0], self._points[-1]
+            if end_at - start_at >= self.window:
+                speed = (end_out - start_out) / (end_at - start_at)
+                if speed < self.min_speed:
+                    return Stall("slow", start_at, speed)
+        return None
+
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) scheduling and per-tick expiry for many short timeouts.
+
+    Time is counted in ticks; advance() is called once per tick by its owner.
+    """
+
+    def __init__(self, tick=REAPER_TICK_SECONDS, slots=64):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._now = 0
+
+    def schedule(self, delay, item):
+        expiry = self._now + max(1, math.ceil(delay / self.tick))
+        self._slots[expiry % len(self._slots)].append((expiry, item))
+
+    def advance(self):
+        """Moves on by one tick and returns the items that expired."""
+        self._now += 1
+        slot = self._slots[self._now % len(self._slots)]
+        due = [item for expiry, item in slot if expiry <= self._now]
+        if due:
+            slot[:] = [(expiry, item) for expiry, item in slot if expiry > self._now]
+        return due
+
+
+# Report of ProcessReaper: method is the last step taken ("quit", "eof", "terminate", "kill",
+# or "exited" if it was gone before any), elapsed the seconds from hand-over to exit
+ReapedProcess = collections.namedtuple("ReapedProcess", "pid label returncode method elapsed")
+
+
+class _Reaping:
+    __slots__ = ("process", "label", "started", "method")
+
+    def __init__(self, process, label):
+        self.process = process
+        self.label = label
+        self.started = time.monotonic()
+        self.method = None
+
+
+class ProcessReaper:
+    """Stops child processes on one thread: "q" on stdin, then SIGTERM, then SIGKILL.
+
+    Asking ffmpeg to quit in-band lets it flush the muxer (FLV trailer, RTMP close)
+    instead of dropping the session; signals are only the fallback. reap() hands a
+    process over and returns at once; escalation deadlines live on a TimerWheel and
+    exits are noticed by polling every tick, so any number of pending terminations
+    costs no extra threads. Handing over the same process twice (e.g. Stop pressed
+    while the loop is already terminating) is a no-op. The thread sleeps while there
+    is nothing to reap. Time-to-exit is kept per method (exit_time_stats) so the
+    timeouts can be tuned from what ffmpeg actually needs.
+    """
+
+    def __init__(self, on_reaped=None, quit_timeout=QUIT_TIMEOUT_SECONDS, term_timeout=TERM_TIMEOUT_SECONDS,
+                 tick=REAPER_TICK_SECONDS):
+        self.on_reaped = on_reaped
+        self.quit_timeout = quit_timeout
+        self.term_timeout = term_timeout
+        self.reaped = collections.deque(maxlen=100) # Most recent ReapedProcess reports
+        self._exit_times = collections.defaultdict(lambda: collections.deque(maxlen=500))
+        self._exit_counts = collections.Counter()
+        self._wheel = TimerWheel(tick)
+        self._pending = {} # pid -> _Reaping
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def reap(self, process, label=None, graceful=True, eof=False):
+        """Takes over stopping process.
+
+        graceful sends "q" first when its stdin is a pipe we still hold; eof closes that
+        pipe instead, for processes (like the publisher) that read their input from it.
+        """
+        with self._cond:
+            if process.pid in self._pending:
+                return
+            entry = _Reaping(process, label)
+            self._pending[process.pid] = entry
+            stdin = process.stdin
+            if graceful and stdin is not None and not stdin.closed and self._ask_to_quit(stdin, eof):
+                entry.method = "eof" if eof else "quit"
+                self._wheel.schedule(self.quit_timeout, entry)
+            else:
+                self._signal(entry, "terminate")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ffmpeg-reaper", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every handed-over process has exited; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def exit_time_stats(self):
+        """{method: {"count", "mean", "p95", "max"}} of time-to-exit, over the last 500 exits per method."""
+        with self._cond:
+            samples = {method: sorted(times) for method, times in self._exit_times.items() if times}
+            counts = dict(self._exit_counts)
+        return {method: {"count": counts[method], "mean": sum(times) / len(times),
+                         "p95": times[min(len(times) - 1, int(len(times) * 0.95))], "max": times[-1]}
+                for method, times in samples.items()}
+
+    @staticmethod
+    def _ask_to_quit(stdin, eof):
+        try:
+            if eof:
+                stdin.close()
+            else:
+                stdin.write("q" if isinstance(stdin, io.TextIOBase) else b"q") # Text-mode Popen wraps it
+                stdin.flush()
+            return True
+        except (OSError, ValueError):
+            return False # Already exited and closed its end
+
+    def _signal(self, entry, method):
+        if entry.process.poll() is not None:
+            return
+        entry.method = method
+        try:
+            if method == "terminate":
+                entry.process.terminate()
+            else:
+                entry.process.kill()
+        except OSError:
+            pass # Exited in between
+        if method == "terminate":
+            self._wheel.schedule(self.term_timeout, entry)
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                    next_tick = time.monotonic()
+            next_tick += self._wheel.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            finished = []
+            with self._cond:
+                due = self._wheel.advance()
+                now = time.monotonic()
+                while next_tick + self._wheel.tick <= now: # Woke up late: catch up on the missed ticks
+                    next_tick += self._wheel.tick
+                    due.extend(self._wheel.advance())
+                for pid, entry in list(self._pending.items()):
+                    if entry.process.poll() is not None:
+                        del self._pending[pid]
+                        finished.append(entry)
+                for entry in due:
+                    if self._pending.get(entry.process.pid) is entry:
+                        self._signal(entry, "terminate" if entry.method in ("quit", "eof") else "kill")
+                reports = []
+                for entry in finished:
+                    method = entry.method or "exited"
+                    elapsed = time.monotonic() - entry.started
+                    self._exit_times[method].append(elapsed)
+                    self._exit_counts[method] += 1
+                    reports.append(ReapedProcess(entry.process.pid, entry.label, entry.process.returncode,
+                                                 method, elapsed))
+                if finished:
+                    self._cond.notify_all() # wait_idle()
+            for entry in finished:
+                if entry.process.stdin is not None:
+                    try:
+                        entry.process.stdin.close()
+                    except OSError:
+                        pass
+            for report in reports:
+                self.reaped.append(report)
+                if self.on_reaped is not None:
+                    try:
+                        self.on_reaped(report)
+                    except Exception:
+                        pass # A failing callback must not kill the reaper
+
+
+# Allowed moves of EngineStateMachine. Stopping is reachable from every running state and
+# leads only back to idle, so a Stop can never be undone by a Switch that arrives after it.
+_ENGINE_TRANSITIONS = {
+    STATE_IDLE: (STATE_STARTING,),
+    STATE_STARTING: (STATE_PLAYING, STATE_SWITCHING, STATE_BACKOFF, STATE_STOPPING),
+    STATE_PLAYING: (STATE_STARTING, STATE_SWITCHING, STATE_BACKOFF, STATE_STOPPING),
+    STATE_SWITCHING: (STATE_PLAYING, STATE_BACKOFF, STATE_STOPPING),
+    STATE_BACKOFF: (STATE_STARTING, STATE_SWITCHING, STATE_STOPPING),
+    STATE_STOPPING: (STATE_IDLE,),
+}
+
+# One EngineStateMachine move. at is time.monotonic(), wall time.time(); latency is the
+# seconds from posting the command that caused it, None for moves the engine made itself
+Transition = collections.namedtuple("Transition", "at wall source target reason latency")
+
+
+class EngineStateMachine:
+    """Streaming state with a single owner: the stream thread.
+
+    Other threads never change the state; they post() commands to the inbox, which the
+    stream thread reads (together with ffmpeg's output events) and acts on in order, so
+    e.g. Stop while switching always ends in stopping. The one exception is start(),
+    which leaves idle before the stream thread exists. Every transition is timestamped
+    and kept in transitions; latency_stats() summarizes command-to-transition times and
+    wait_transition() lets a caller block until its command has been acted on.
+    """
+
+    def __init__(self, on_transition=None, history=ENGINE_HISTORY):
+        self.on_transition = on_transition # Called on the owning thread after each transition
+        self.inbox = queue.Queue() # (kind, value, extra): ("command", name, posted_at), or events of the owner
+        self.transitions = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._state = STATE_IDLE
+        self._entered_at = time.monotonic()
+
+    @property
+    def state(self):
+        return self._state
+
+    def running(self):
+        return self._state != STATE_IDLE
+
+    def time_in_state(self):
+        return time.monotonic() - self._entered_at
+
+    def start(self, reason="start"):
+        """Idle -> starting for a new run, with an empty inbox; False if a run is already active."""
+        with self._lock:
+            if self._state != STATE_IDLE:
+                return False
+            self.inbox = queue.Queue() # Nothing posted to the previous run carries over
+            transition = self._move(STATE_STARTING, reason, None)
+        self._notify(transition)
+        return True
+
+    def post(self, command):
+        """Queues a command for the owner; False (and dropped) when the engine is idle."""
+        if command not in ENGINE_COMMANDS:
+            raise ValueError(f"Unknown engine command: {command}")
+        with self._lock:
+            if self._state == STATE_IDLE:
+                return False
+            self.inbox.put(("command", command, time.monotonic()))
+            return True
+
+    def transition(self, target, reason=None, posted_at=None):
+        """Moves to target and returns the Transition; None if already there.
+
+        Raises ValueError for a move _ENGINE_TRANSITIONS does not allow.
+        """
+        with self._lock:
+            if target == self._state:
+                return None
+            if target not in _ENGINE_TRANSITIONS[self._state]:
+                raise ValueError(f"Engine cannot go from {self._state} to {target}")
+            transition = self._move(target, reason, posted_at)
+        self._notify(transition)
+        return transition
+
+    def wait_transition(self, since, timeout):
+        """The first transition made at or after monotonic time since, waiting up to timeout
+        seconds for one; None if there was none."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                first = None
+                for t in reversed(self.transitions):
+                    if t.at < since:
+                        break
+                    first = t
+                remaining = deadline - time.monotonic()
+                if first is not None or remaining <= 0:
+                    return first
+                self._changed.wait(remaining)
+
+    def latency_stats(self):
+        """{(source, target): {"count", "mean", "max"}} of command latencies, in seconds."""
+        with self._lock:
+            transitions = list(self.transitions)
+        stats = {}
+        for t in transitions:
+            if t.latency is None:
+                continue
+            entry = stats.setdefault((t.source, t.target), {"count": 0, "mean": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["mean"] += (t.latency - entry["mean"]) / entry["count"]
+            entry["max"] = max(entry["max"], t.latency)
+        return stats
+
+    def _move(self, target, reason, posted_at):
+        now = time.monotonic()
+        latency = now - posted_at if posted_at is not None else None
+        transition = Transition(now, time.time(), self._state, target, reason, latency)
+        self._state = target
+        self._entered_at = now
+        self.transitions.append(transition)
+        self._changed.notify_all()
+        return transition
+
+    def _notify(self, transition):
+        if self.on_transition is not None:
+            self.on_transition(transition)
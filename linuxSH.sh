@@ -21,10 +21,21 @@ FONT_RESET=$(printf '\033[0m')
 # Supported video extensions as a space-separated string for POSIX sh
 VIDEO_EXTENSIONS="mp4 mkv webm avi mov flv ts mpg mpeg wmv"
 
+# Records the PID of the running stream loop so "Stop" ends exactly that loop
+STREAM_PIDFILE="${TMPDIR:-/tmp}/$(basename "$0").$(id -u).pid"
+
 command_exists() {
     command -v "$1" >/dev/null 2>&1
 }
 
+# Prints the PIDs of all descendants of a process, one per line
+descendant_pids() {
+    for child_pid in $(pgrep -P "$1" || true); do
+        echo "$child_pid"
+        descendant_pids "$child_pid"
+    done
+}
+
 # POSIX-compliant function to ask a yes/no question
 # Usage: ask_yes_no "Prompt message" "default_answer"
 # Returns 0 for "yes", 1 for "no"
@@ -168,6 +179,7 @@ stream_start() {
     done
     
     printf "%s\n" "${BLUE}Starting infinite streaming loop. Press Ctrl+C to stop.${FONT_RESET}"
+    echo "$$" > "$STREAM_PIDFILE"
     
     while true; do
         printf "%s%s%s\n" "${GREEN}Searching and shuffling videos in '" "$video_folder" "'...${FONT_RESET}"
@@ -228,34 +240,35 @@ stream_start() {
 }
 
 stream_stop() {
-    printf "%s\n" "${YELLOW}Stopping FFmpeg processes...${FONT_RESET}"
-    killed_processes=false
-    # This pgrep pattern is a direct port from the bash script and is fully functional
-    if pgrep -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" > /dev/null; then
-        printf "%s\n" "${BLUE}Attempting graceful stop (SIGTERM)...${FONT_RESET}"
-        pkill -SIGTERM -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" && sleep 2
-        
-        if pgrep -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://" > /dev/null; then
-            printf "%s\n" "${YELLOW}Forceful stop (SIGKILL)...${FONT_RESET}"
-            pkill -SIGKILL -f "ffmpeg -hide_banner -re -nostdin.*-f flv rtmp(s)?://"
-        fi
-        
-        printf "%s\n" "${GREEN}Targeted FFmpeg processes stopped.${FONT_RESET}"
-        killed_processes=true
-    fi
-    
-    if [ "$killed_processes" = "false" ]; then
-        if pgrep ffmpeg > /dev/null; then
-            printf "%s\n" "${YELLOW}No specific stream processes found. Trying to kill all 'ffmpeg' processes...${FONT_RESET}"
-            if killall ffmpeg > /dev/null 2>&1; then
-                printf "%s\n" "${GREEN}All FFmpeg processes stopped.${FONT_RESET}"
-            else
-                printf "%s\n" "${RED}killall ffmpeg failed or no processes were found to kill.${FONT_RESET}"
-            fi
+    # Only the loop this script started (see STREAM_PIDFILE) is stopped; other channels and
+    # ffmpeg processes on the machine are not ours to kill
+    if [ -n "${AVS_CONTROL_PORT:-}" ]; then
+        # Set by the user for a streamer_cli.py channel they run with --control-port
+        control_url="http://127.0.0.1:${AVS_CONTROL_PORT}/stop"
+        if command_exists curl && curl -fsS -m 15 -X POST "$control_url" > /dev/null 2>&1; then
+            printf "%s\n" "${GREEN}streamer_cli.py stopped through the control API (${control_url}).${FONT_RESET}"
         else
-            printf "%s\n" "${GREEN}No FFmpeg processes seem to be running.${FONT_RESET}"
+            printf "%s\n" "${RED}Control API at ${control_url} did not answer.${FONT_RESET}"
         fi
     fi
+    loop_pid=$(cat "$STREAM_PIDFILE" 2>/dev/null || true)
+    if [ -z "$loop_pid" ] || ! ps -p "$loop_pid" -o args= 2>/dev/null | grep -q "$(basename "$0")"; then
+        rm -f "$STREAM_PIDFILE"
+        printf "%s\n" "${GREEN}No stream loop of this script seems to be running.${FONT_RESET}"
+        return 0
+    fi
+    printf "%s\n" "${YELLOW}Stopping the stream loop (PID ${loop_pid}) and its FFmpeg...${FONT_RESET}"
+    # The pipeline runs ffmpeg in a subshell, so the whole process tree is signalled
+    stop_pids="$loop_pid $(descendant_pids "$loop_pid")"
+    printf "%s\n" "${BLUE}Attempting graceful stop (SIGTERM)...${FONT_RESET}"
+    kill -TERM $stop_pids 2>/dev/null || true
+    sleep 2
+    if kill -0 $stop_pids 2>/dev/null; then
+        printf "%s\n" "${YELLOW}Forceful stop (SIGKILL)...${FONT_RESET}"
+        kill -KILL $stop_pids 2>/dev/null || true
+    fi
+    rm -f "$STREAM_PIDFILE"
+    printf "%s\n" "${GREEN}Stream loop stopped.${FONT_RESET}"
     printf "%s\n" "${YELLOW}If you were using screen/tmux, remember to terminate the session manually.${FONT_RESET}"
 }
 
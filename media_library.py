@@ -0,0 +1,1310 @@
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".autovideostream") # Index, cache and state live here
+INDEX_PATH = os.path.join(CONFIG_DIR, "media_index.sqlite3")
+# Matched case-insensitively; keep in sync with VIDEO_EXTENSIONS in LinuxBash.sh / linuxSH.sh
+VIDEO_EXTENSIONS = ("mp4", "mkv", "webm", "avi", "mov", "flv", "ts", "mpg", "mpeg", "wmv")
+DEFAULT_SCAN_WORKERS = 4 # ffprobe is mostly I/O bound; more helps on NAS mounts, less on one spinning disk
+DEFAULT_DISCOVERY_WORKERS = 4 # Top-level subdirectories walked in parallel
+
+# What the ingest side accepts without re-encoding. The bitrate and GOP limits match
+# the encoder presets used for re-encoding (-maxrate 4000k, -g 60) with some headroom.
+INGEST_PROFILE = {
+    "video_codecs": ("h264",),
+    "pix_fmts": ("yuv420p", "yuvj420p"),
+    "max_video_bitrate": 4500000,
+    "max_keyframe_interval": 4.0, # seconds; most platforms require <= 4 s
+    "max_fps": 60.0,
+    "audio_codecs": ("aac",),
+    "audio_sample_rates": (44100, 48000),
+    "max_audio_bitrate": 320000,
+}
+KEYFRAME_PROBE_SECONDS = 30 # How much of the file is scanned to measure the keyframe interval
+KEYFRAME_SEEK_LOOKBACK = 20 # Seconds before a resume offset searched for the keyframe to restart at
+VERIFY_SAMPLE_SECONDS = 10 # Length of each decode-checked window (start, middle, end)
+VERIFY_TIMEOUT_SECONDS = 600
+# (upper limit in kb/s, label) for the statistics histogram; 4500 is the stream-copy limit above
+STATS_BITRATE_BUCKETS = ((1000, "<1000"), (2000, "1000-2000"), (3000, "2000-3000"), (4500, "3000-4500"),
+                         (6000, "4500-6000"), (10000, "6000-10000"), (None, ">=10000"))
+WATCH_SETTLE_SECONDS = 5.0 # A new file must stop growing this long before it joins the playlist
+WATCH_POLL_SECONDS = 10.0 # Snapshot interval when inotify is not available
+WATCH_RESCAN_SECONDS = 300.0 # Safety-net rescan even with inotify (network mounts, lost events)
+
+# inotify(7) constants, used through ctypes so no extra package is needed
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_INOTIFY_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len
+# strerror texts in ffprobe's output that point at the storage (NAS hiccup), not at the file
+_TRANSIENT_READ_ERRORS = ("Input/output error", "Resource temporarily unavailable", "Connection timed out",
+                          "Stale file handle", "Host is down")
+
+
+class ProbeError(Exception):
+    pass
+
+
+class StateInUseError(OSError):
+    """Another streamer process already uses this journal or cache."""
+
+
+class ProbeUnavailable(ProbeError):
+    """ffprobe/ffmpeg could not be run or did not finish (missing binary, timeout, I/O error);
+    unlike a plain ProbeError it says nothing about the file itself."""
+
+
+def is_video_file(name, extensions=VIDEO_EXTENSIONS):
+    """Case-insensitive extension match, the same rule as `find -iname` in the shell scripts."""
+    return os.path.splitext(name)[1][1:].lower() in extensions
+
+
+def _scan_directory(directory, extensions, dirs, files, links):
+    """Sorts the entries of one directory into subdirectories, symlinked directories and videos."""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_dir():
+                        links.append(entry.path)
+                    elif entry.is_file() and is_video_file(entry.name, extensions):
+                        files.append(entry.path)
+                except OSError:
+                    pass # Broken symlink or vanished entry
+    except OSError:
+        pass # Unreadable subdirectory; skip it like find does
+
+
+def _walk_tree(top, extensions, seen, seen_lock, links):
+    """Depth-first walk below top that collects symlinked directories into links instead of
+    entering them. seen holds (st_dev, st_ino) of visited directories, so a directory is
+    never walked twice and symlink loops terminate."""
+    found = []
+    stack = [top]
+    while stack:
+        directory = stack.pop()
+        try:
+            st = os.stat(directory)
+        except OSError:
+            continue
+        with seen_lock:
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+        _scan_directory(directory, extensions, stack, found, links)
+    return found
+
+
+def find_video_files(folder, extensions=VIDEO_EXTENSIONS, recursive=True, workers=DEFAULT_DISCOVERY_WORKERS):
+    """Returns the sorted video files in folder, walking it once with os.scandir.
+
+    Subdirectories are included when recursive is set, each top-level subdirectory
+    on its own worker thread. Symlinked directories are followed only after all real
+    ones, in sorted order, so a file reachable both ways is always listed under its
+    real path. Raises OSError if folder itself cannot be read.
+    """
+    st = os.stat(folder) # Let the caller see a missing or unreadable folder
+    dirs, files, links = [], [], []
+    _scan_directory(folder, extensions, dirs, files, links)
+    if not recursive:
+        return sorted(files)
+    seen, seen_lock = {(st.st_dev, st.st_ino)}, threading.Lock()
+    walk = lambda top: _walk_tree(top, extensions, seen, seen_lock, links) # list.append is thread-safe
+    if workers > 1 and len(dirs) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(dirs))) as pool:
+            for found in pool.map(walk, dirs):
+                files.extend(found)
+    else:
+        for top in dirs:
+            files.extend(walk(top))
+    while links:
+        pending, links[:] = sorted(links), []
+        for top in pending:
+            files.extend(walk(top))
+    files.sort()
+    return files
+
+
+def lock_state_file(path):
+    """Takes an exclusive lock on path (created if missing) for as long as the returned file
+    stays open, so two streamers never write the same state. Raises StateInUseError if
+    another process holds it."""
+    f = open(path, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise StateInUseError(f"{path} is in use by another streamer; give each channel its own "
+                              f"state directory (streamer_cli.py --state-dir)")
+    return f
+
+
+def ffprobe_path_for(ffmpeg_path):
+    """Derives the ffprobe executable that ships next to the configured ffmpeg."""
+    directory, name = os.path.split(ffmpeg_path)
+    probe_name = name.replace("ffmpeg", "ffprobe") if "ffmpeg" in name else "ffprobe"
+    return os.path.join(directory, probe_name) if directory else probe_name
+
+
+def _run_ffprobe(cmd, timeout):
+    creationflags = 0
+    if os.name == 'nt':
+        creationflags = subprocess.CREATE_NO_WINDOW # Hide console window on Windows
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout,
+                                creationflags=creationflags)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ProbeUnavailable(str(e))
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', 'replace').strip() or f"ffprobe exited with {result.returncode}"
+        if any(text in message for text in _TRANSIENT_READ_ERRORS):
+            raise ProbeUnavailable(message)
+        raise ProbeError(message)
+    return result.stdout.decode('utf-8', 'replace')
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate(rate):
+    """Parses ffprobe frame rates such as '30000/1001'."""
+    if not rate or rate == "0/0":
+        return None
+    num, _, den = rate.partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _keyframe_times(ffprobe_path, path, read_intervals, timeout):
+    """Sorted pts (s) of the video keyframes ffprobe finds within read_intervals."""
+    cmd = [ffprobe_path, "-v", "error", "-select_streams", "v:0", "-read_intervals", read_intervals,
+           "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+    keyframes = []
+    for line in _run_ffprobe(cmd, timeout).splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            pts = _to_float(pts_time)
+            if pts is not None:
+                keyframes.append(pts)
+    keyframes.sort()
+    return keyframes
+
+
+def probe_keyframe_interval(ffprobe_path, path, seconds=KEYFRAME_PROBE_SECONDS, timeout=30):
+    """Returns the largest keyframe distance (s) in the first `seconds` of the video, or None."""
+    keyframes = _keyframe_times(ffprobe_path, path, f"%+{seconds}", timeout)
+    if len(keyframes) < 2:
+        return None
+    return max(b - a for a, b in zip(keyframes, keyframes[1:]))
+
+
+def keyframe_before(ffprobe_path, path, offset, lookback=KEYFRAME_SEEK_LOOKBACK, timeout=30):
+    """Returns the last video keyframe at or before offset (s), or None if there is none within lookback.
+
+    Restarting exactly on a keyframe keeps a stream-copied resume free of the
+    leading undecodable frames (and audio running ahead) a mid-GOP seek produces.
+    """
+    start = max(0.0, offset - lookback)
+    keyframes = _keyframe_times(ffprobe_path, path, f"{start:.3f}%{offset + 0.001:.3f}", timeout)
+    earlier = [pts for pts in keyframes if pts <= offset + 0.001]
+    return earlier[-1] if earlier else None
+
+
+def spawn_low_priority(cmd, **kwargs):
+    """Starts a background helper process at reduced CPU priority so it never starves the live encode."""
+    if os.name == 'nt':
+        return subprocess.Popen(cmd, creationflags=subprocess.CREATE_NO_WINDOW | subprocess.BELOW_NORMAL_PRIORITY_CLASS,
+                                **kwargs)
+    return subprocess.Popen(cmd, preexec_fn=lambda: os.nice(10), **kwargs)
+
+
+def verify_media(ffmpeg_path, path, duration=None, full=False, sample_seconds=VERIFY_SAMPLE_SECONDS,
+                 timeout=VERIFY_TIMEOUT_SECONDS, on_process=None):
+    """Decode-checks path with `-xerror -f null`; returns None if it decodes cleanly, else the error.
+
+    By default only short windows at the start, middle and end are decoded, which catches
+    truncated uploads and broken headers at a fraction of the cost of a full decode. Without
+    a duration (e.g. ffprobe could not read the file) only the start window is decoded.
+    Raises ProbeUnavailable if the check itself could not run or timed out.
+    """
+    if not full and not duration:
+        windows = [(0, sample_seconds)]
+    elif full or duration <= 3 * sample_seconds:
+        windows = [(None, None)]
+    else:
+        windows = [(0, sample_seconds), (duration / 2, sample_seconds), (max(0, duration - sample_seconds), None)]
+    for start, length in windows:
+        cmd = [ffmpeg_path, "-hide_banner", "-nostdin", "-v", "error", "-xerror"]
+        if start:
+            cmd.extend(["-ss", f"{start:.3f}"])
+        if length:
+            cmd.extend(["-t", str(length)])
+        cmd.extend(["-i", path, "-map", "0:v:0?", "-map", "0:a:0?", "-f", "null", "-"])
+        try:
+            process = spawn_low_priority(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise ProbeUnavailable(str(e))
+        if on_process is not None:
+            on_process(process)
+        try:
+            _, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise ProbeUnavailable(f"decode check timed out after {timeout} s")
+        if process.returncode != 0:
+            lines = stderr.decode('utf-8', 'replace').strip().splitlines()
+            return " | ".join(lines[-3:]) or f"ffmpeg exited with {process.returncode}"
+    return None
+
+
+def find_moov_offset(path):
+    """Walks the top-level MP4/MOV atoms and returns (moov_offset, faststart).
+
+    faststart means the moov atom precedes mdat, so playback can begin without seeking
+    to the end of the file. Returns (None, None) for files that are not ISO-BMFF.
+    """
+    moov = mdat = None
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            file_size = f.tell()
+            offset = 0
+            while offset + 8 <= file_size and (moov is None or mdat is None):
+                f.seek(offset)
+                size, kind = struct.unpack(">I4s", f.read(8))
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                elif size == 0:
+                    size = file_size - offset # Atom runs to the end of the file
+                if kind == b"moov":
+                    moov = offset
+                elif kind == b"mdat":
+                    mdat = offset
+                elif offset == 0 and kind != b"ftyp":
+                    return None, None
+                if size < 8:
+                    break # Corrupt atom header
+                offset += size
+    except (OSError, struct.error):
+        return None, None
+    if moov is None:
+        return None, None
+    return moov, mdat is None or moov < mdat
+
+
+def probe_media(ffprobe_path, path, timeout=30):
+    """Runs ffprobe on path and returns a flat dict of the properties the engine cares about."""
+    cmd = [ffprobe_path, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    try:
+        data = json.loads(_run_ffprobe(cmd, timeout))
+    except ValueError as e:
+        raise ProbeError(f"Unreadable ffprobe output: {e}")
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"
+                  and not st.get("disposition", {}).get("attached_pic")), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    info = {
+        "format_name": fmt.get("format_name"),
+        "duration": _to_float(fmt.get("duration")),
+        "bitrate": _to_int(fmt.get("bit_rate")),
+        "video_codec": None, "pix_fmt": None, "width": None, "height": None, "fps": None, "video_bitrate": None,
+        "audio_codec": None, "audio_sample_rate": None, "audio_channels": None, "audio_bitrate": None,
+        "keyframe_interval": None, "moov_offset": None, "faststart": None,
+    }
+    if video:
+        info.update({
+            "video_codec": video.get("codec_name"),
+            "pix_fmt": video.get("pix_fmt"),
+            "width": _to_int(video.get("width")),
+            "height": _to_int(video.get("height")),
+            "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+            "video_bitrate": _to_int(video.get("bit_rate")),
+        })
+        try:
+            info["keyframe_interval"] = probe_keyframe_interval(ffprobe_path, path, timeout=timeout)
+        except ProbeError:
+            pass # Leave it unknown; the file simply won't qualify for stream copy
+    if os.path.splitext(path)[1].lower() in (".mp4", ".m4v", ".mov"):
+        info["moov_offset"], info["faststart"] = find_moov_offset(path)
+    if audio:
+        info.update({
+            "audio_codec": audio.get("codec_name"),
+            "audio_sample_rate": _to_int(audio.get("sample_rate")),
+            "audio_channels": _to_int(audio.get("channels")),
+            "audio_bitrate": _to_int(audio.get("bit_rate")),
+        })
+    return info
+
+
+def check_video_compliance(info, profile=INGEST_PROFILE):
+    """Returns (ok, reason) for copying the video stream as-is."""
+    codec = info.get("video_codec")
+    if codec not in profile["video_codecs"]:
+        return False, f"video codec {codec or 'unknown'} is not {'/'.join(profile['video_codecs'])}"
+    pix_fmt = info.get("pix_fmt")
+    if pix_fmt not in profile["pix_fmts"]:
+        return False, f"pixel format {pix_fmt or 'unknown'} is not {'/'.join(profile['pix_fmts'])}"
+    # Containers such as MKV often lack a per-stream bitrate; the overall bitrate is an upper bound
+    video_bitrate = info.get("video_bitrate") or info.get("bitrate")
+    if not video_bitrate or video_bitrate > profile["max_video_bitrate"]:
+        return False, f"video bitrate {video_bitrate // 1000 if video_bitrate else '?'} kb/s exceeds {profile['max_video_bitrate'] // 1000} kb/s"
+    fps = info.get("fps")
+    if not fps or fps > profile["max_fps"]:
+        return False, f"frame rate {fps or '?'} exceeds {profile['max_fps']:g}"
+    gop = info.get("keyframe_interval")
+    if not gop or gop > profile["max_keyframe_interval"]:
+        return False, f"keyframe interval {f'{gop:.1f}' if gop else '?'} s exceeds {profile['max_keyframe_interval']:g} s"
+    return True, f"{codec} {pix_fmt} {info.get('width')}x{info.get('height')} {video_bitrate // 1000} kb/s, keyframes every {gop:.1f} s"
+
+
+def check_audio_compliance(info, profile=INGEST_PROFILE):
+    """Returns (ok, reason) for copying the audio stream as-is."""
+    codec = info.get("audio_codec")
+    if codec is None:
+        return True, "no audio stream"
+    if codec not in profile["audio_codecs"]:
+        return False, f"audio codec {codec} is not {'/'.join(profile['audio_codecs'])}"
+    sample_rate = info.get("audio_sample_rate")
+    if sample_rate not in profile["audio_sample_rates"]:
+        return False, f"audio sample rate {sample_rate or '?'} Hz not supported"
+    audio_bitrate = info.get("audio_bitrate")
+    if audio_bitrate and audio_bitrate > profile["max_audio_bitrate"]:
+        return False, f"audio bitrate {audio_bitrate // 1000} kb/s exceeds {profile['max_audio_bitrate'] // 1000} kb/s"
+    return True, f"{codec} {sample_rate} Hz"
+
+
+def choose_stream_mode(info, profile=INGEST_PROFILE, watermark=False):
+    """Decides per file whether video and audio can be stream-copied.
+
+    Returns (copy_video, copy_audio, reason). Audio copy is only chosen when the video
+    is copied too; when the video has to be re-encoded the user's audio setting applies.
+    """
+    if watermark:
+        return False, False, "watermark overlay requires re-encoding"
+    if info is None:
+        return False, False, "no stream info (ffprobe unavailable or failed)"
+    video_ok, video_reason = check_video_compliance(info, profile)
+    if not video_ok:
+        return False, False, video_reason
+    audio_ok, audio_reason = check_audio_compliance(info, profile)
+    if audio_ok:
+        return True, True, f"{video_reason}; {audio_reason}"
+    return True, False, f"{video_reason}; re-encoding audio: {audio_reason}"
+
+
+MEDIA_COLUMNS = ("format_name", "duration", "bitrate", "video_codec", "pix_fmt", "width", "height", "fps",
+                 "video_bitrate", "audio_codec", "audio_sample_rate", "audio_channels", "audio_bitrate",
+                 "keyframe_interval", "moov_offset", "faststart")
+
+
+class MediaIndex:
+    """Persistent ffprobe metadata per file, kept in SQLite next to the other app state.
+
+    A row is valid for as long as the file's mtime and size match what was probed, so a
+    rescan of an unchanged library is one stat() per file plus a single SELECT.
+    Files ffprobe rejects are stored too (with its error) so they are not re-probed until
+    they change; a probe that could not run (ProbeUnavailable) stores nothing and is simply
+    retried. verified_at/quarantine hold the result of the decode check; both
+    are cleared whenever the file is re-probed.
+    """
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                # The index is only a cache of ffprobe output, so an old layout is simply rebuilt
+                self._conn.execute("DROP TABLE IF EXISTS media")
+                self._conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+                "probed_at REAL NOT NULL, error TEXT, verified_at REAL, quarantine TEXT, "
+                + ", ".join(f"{column}" for column in MEDIA_COLUMNS) + ")")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _row_to_info(self, row):
+        if row is None or row["error"] is not None:
+            return None
+        return {column: row[column] for column in MEDIA_COLUMNS}
+
+    def get(self, path, st=None):
+        """Returns the indexed info for path, or None if it is missing, stale or failed to probe."""
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM media WHERE path = ?", (path,)).fetchone()
+        if row is None or row["mtime"] != st.st_mtime or row["size"] != st.st_size:
+            return None
+        return self._row_to_info(row)
+
+    def put(self, path, st, info=None, error=None):
+        values = [path, st.st_mtime, st.st_size, time.time(), error]
+        values.extend((info or {}).get(column) for column in MEDIA_COLUMNS)
+        placeholders = ", ".join("?" for _ in values)
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO media (path, mtime, size, probed_at, error, "
+                               f"{', '.join(MEDIA_COLUMNS)}) VALUES ({placeholders})", values)
+
+    def stale_paths(self, paths):
+        """Returns the subset of paths whose index row is missing or out of date."""
+        with self._lock:
+            known = {row[0]: (row[1], row[2]) for row in self._conn.execute("SELECT path, mtime, size FROM media")}
+        stale = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (st.st_mtime, st.st_size):
+                stale.append(path)
+        return stale
+
+    def probe_and_store(self, path, ffprobe_path):
+        """Probes path and records the result; returns the info or None on failure."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        try:
+            info = probe_media(ffprobe_path, path)
+        except ProbeUnavailable:
+            raise # Nothing was learned about the file; the next probe tries again
+        except ProbeError as e:
+            self.put(path, st, error=str(e) or "probe failed")
+            raise
+        self.put(path, st, info)
+        return info
+
+    def ensure(self, path, ffprobe_path):
+        """Returns indexed info for path, probing it first if the row is missing or stale.
+
+        Raises ProbeError only when a fresh probe fails; a known-bad unchanged file returns None.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM media WHERE path = ?", (path,)).fetchone()
+        if row is not None and row["mtime"] == st.st_mtime and row["size"] == st.st_size:
+            return self._row_to_info(row)
+        return self.probe_and_store(path, ffprobe_path)
+
+    def forget_missing(self, root, paths):
+        """Drops rows under root for files that are no longer in paths (deleted since the last scan)."""
+        keep = set(paths)
+        prefix = os.path.join(root, "")
+        with self._lock:
+            gone = [row[0] for row in self._conn.execute("SELECT path FROM media")
+                    if row[0].startswith(prefix) and row[0] not in keep]
+            with self._conn:
+                self._conn.executemany("DELETE FROM media WHERE path = ?", ((p,) for p in gone))
+        return len(gone)
+
+    def forget(self, paths):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM media WHERE path = ?", ((p,) for p in paths))
+
+    def unverified_paths(self, paths):
+        """Returns the paths without a decode-check result for their current mtime and size."""
+        with self._lock:
+            checked = {row[0]: (row[1], row[2]) for row in self._conn.execute(
+                "SELECT path, mtime, size FROM media WHERE verified_at IS NOT NULL")}
+        pending = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if checked.get(path) != (st.st_mtime, st.st_size):
+                pending.append(path)
+        return pending
+
+    def mark_verified(self, path, st, error=None):
+        """Records a decode-check result; a non-empty error quarantines the file."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE media SET verified_at = ?, quarantine = ? WHERE path = ? AND mtime = ? AND size = ?",
+                               (time.time(), error, path, st.st_mtime, st.st_size))
+
+    def flag(self, path, reason):
+        """Quarantines path for a problem found outside the decode check, e.g. it keeps failing on air."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE media SET quarantine = ? WHERE path = ? AND mtime = ? AND size = ?",
+                                      (reason, path, st.st_mtime, st.st_size)).rowcount > 0
+
+    def quarantine_reason(self, path):
+        """Why path must not be played (failed decode check, or flagged after failing on air), or None
+        if it may be. A file ffprobe could not read is still played: ffmpeg decides, and files that
+        keep failing get flagged."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT mtime, size, quarantine FROM media WHERE path = ?", (path,)).fetchone()
+        if row is None or row["mtime"] != st.st_mtime or row["size"] != st.st_size:
+            return None # Changed since it was checked; it gets re-checked
+        return row["quarantine"]
+
+    def quarantined(self):
+        """(path, reason) for every quarantined file."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, quarantine FROM media "
+                                      "WHERE quarantine IS NOT NULL ORDER BY path").fetchall()
+        return [tuple(row) for row in rows]
+
+    def release(self, path):
+        """Lifts the quarantine of path, e.g. after a false positive; it is not re-checked until it changes."""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE media SET quarantine = NULL WHERE path = ? AND quarantine IS NOT NULL",
+                                      (path,)).rowcount > 0
+
+    def version(self):
+        """Cheap fingerprint that changes whenever rows are added, removed, re-probed or re-checked."""
+        with self._lock:
+            return tuple(self._conn.execute(
+                "SELECT COUNT(*), MAX(probed_at), MAX(verified_at), COUNT(quarantine) FROM media").fetchone())
+
+    def row_versions(self, prefix=None):
+        """{path: (probed_at, verified_at)} for every row, optionally only paths under prefix."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, probed_at, verified_at FROM media").fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows if prefix is None or row[0].startswith(prefix)}
+
+    def rows(self, paths=None):
+        """Full rows (as dicts) for the given paths, or for every file when paths is None."""
+        if paths is None:
+            with self._lock:
+                return [dict(row) for row in self._conn.execute("SELECT * FROM media")]
+        paths = list(paths)
+        result = []
+        with self._lock:
+            for start in range(0, len(paths), 500): # Stay under SQLite's host parameter limit
+                chunk = paths[start:start + 500]
+                result.extend(dict(row) for row in self._conn.execute(
+                    f"SELECT * FROM media WHERE path IN ({', '.join('?' for _ in chunk)})", chunk))
+        return result
+
+
+class LibraryScanner:
+    """Probes stale files into a MediaIndex on a bounded pool of worker threads.
+
+    Each result is written to the index as soon as its probe finishes, so streaming can
+    start on the first indexed file instead of waiting for the whole scan. on_progress
+    receives (done, total, files_per_second, eta_seconds) at most every progress_interval
+    seconds and once more when the scan ends.
+    """
+
+    def __init__(self, index, ffprobe_path, workers=DEFAULT_SCAN_WORKERS, on_progress=None, progress_interval=2.0):
+        self.index = index
+        self.ffprobe_path = ffprobe_path
+        self.workers = max(1, workers)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.failed = 0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._done_event = threading.Event()
+        self._done = 0
+        self._total = 0
+        self._active_workers = 0
+        self._started = None
+        self._last_report = 0.0
+
+    def start(self, paths):
+        """Queues the stale subset of paths and starts probing in the background."""
+        stale = self.index.stale_paths(paths)
+        with self._lock:
+            self._queue.extend(stale)
+            self._total = len(stale)
+            self._started = time.monotonic()
+            self._active_workers = min(self.workers, len(stale))
+        if not stale:
+            self._finish()
+            return self
+        for _ in range(self._active_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def add(self, paths):
+        """Queues more paths (e.g. new files in a watched folder) on the same bounded pool.
+
+        Once the previous batch is finished the counters start over, so progress reports
+        cover the new batch only.
+        """
+        stale = self.index.stale_paths(paths)
+        with self._lock:
+            if self._cancelled.is_set():
+                return self
+            stale = [p for p in stale if p not in self._queue]
+            if not stale:
+                return self
+            if self._active_workers == 0:
+                self._done = self._total = self.failed = 0
+                self._started = time.monotonic()
+                self._done_event.clear()
+            self._queue.extend(stale)
+            self._total += len(stale)
+            new_workers = min(self.workers - self._active_workers, len(stale))
+            self._active_workers += new_workers
+        for _ in range(new_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        return self
+
+    def prioritize(self, path):
+        """Moves path to the front of the queue, e.g. because it is about to be played."""
+        with self._lock:
+            try:
+                self._queue.remove(path)
+            except ValueError:
+                return
+            self._queue.appendleft(path)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        return self._done_event.wait(timeout)
+
+    @property
+    def running(self):
+        return not self._done_event.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def progress(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started if self._started else 0.0
+            rate = self._done / elapsed if elapsed > 0 else 0.0
+            remaining = self._total - self._done
+            eta = remaining / rate if rate > 0 else None
+            return self._done, self._total, rate, eta
+
+    def _work(self):
+        while not self._cancelled.is_set():
+            with self._lock:
+                if not self._queue:
+                    break
+                path = self._queue.popleft()
+            try:
+                # The live loop may have probed it on demand in the meantime
+                if self.index.get(path) is None:
+                    self.index.probe_and_store(path, self.ffprobe_path)
+            except ProbeError:
+                with self._lock:
+                    self.failed += 1
+            with self._lock:
+                self._done += 1
+            self._report()
+        with self._lock:
+            self._active_workers -= 1
+            last = self._active_workers == 0
+        if last:
+            self._finish()
+
+    def _report(self, final=False):
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not final and (now - self._last_report < self.progress_interval or self._done >= self._total):
+                return # The last file is reported by _finish()
+            self._last_report = now
+        self.on_progress(*self.progress())
+
+    def _finish(self):
+        self._report(final=True)
+        with self._lock:
+            if self._active_workers == 0: # add() may have started another batch meanwhile
+                self._done_event.set()
+
+
+class IntegrityVerifier:
+    """Decode-checks indexed files one at a time on a low-priority background thread.
+
+    Files that fail are quarantined in the MediaIndex so the stream loop skips them
+    instead of finding out live. Results are stored per (mtime, size), so each file is
+    checked once until it changes. on_result receives (path, error or None).
+    """
+
+    def __init__(self, index, ffmpeg_path, ffprobe_path, full=False, on_result=None):
+        self.index = index
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        self.full = full
+        self.on_result = on_result
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._idle = True
+        self._process = None
+        self._thread = None
+
+    def start(self, paths):
+        self.add(paths)
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, paths):
+        """Queues paths that have no verification result for their current contents."""
+        pending = self.index.unverified_paths(paths)
+        with self._cond:
+            self._queue.extend(p for p in pending if p not in self._queue)
+            self._cond.notify()
+
+    def prioritize(self, path):
+        with self._cond:
+            try:
+                self._queue.remove(path)
+            except ValueError:
+                return
+            self._queue.appendleft(path)
+
+    def wait_idle(self, timeout=None):
+        """Blocks until the queue is empty and no check is running; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._stopped or (self._idle and not self._queue), timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            process = self._process
+            self._cond.notify_all()
+        if process is not None and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def _set_process(self, process):
+        with self._cond:
+            self._process = process
+        if self._stopped:
+            process.kill()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._idle = True
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._stopped or self._queue)
+                if self._stopped:
+                    return
+                path = self._queue.popleft()
+                self._idle = False
+            try:
+                st = os.stat(path)
+                info = self.index.ensure(path, self.ffprobe_path)
+            except (OSError, ProbeUnavailable):
+                continue # Gone, or ffprobe could not run; try again next run
+            except ProbeError:
+                info = None # Rejected by ffprobe, which does not keep it out of the rotation: decode-check it
+            try:
+                error = verify_media(self.ffmpeg_path, path, info and info["duration"], self.full,
+                                     on_process=self._set_process)
+            except ProbeError:
+                continue # Could not check (timeout, ffmpeg missing); try again next run
+            finally:
+                with self._cond:
+                    self._process = None
+            if self._stopped:
+                return
+            self.index.mark_verified(path, st, error)
+            if self.on_result is not None:
+                self.on_result(path, error)
+
+
+class FolderWatcher:
+    """Reports video files added to, removed from or rewritten in a folder while streaming.
+
+    Uses inotify on Linux and falls back to polling snapshots elsewhere (and on
+    filesystems where inotify cannot be set up). New or rewritten files are only
+    reported once their size and mtime have stayed unchanged for settle_seconds, so
+    a file that is still being uploaded is not played half-written. on_change
+    receives (added, removed, updated) path lists on the watcher thread.
+    """
+
+    def __init__(self, folder, on_change, extensions=VIDEO_EXTENSIONS, settle_seconds=WATCH_SETTLE_SECONDS,
+                 poll_interval=WATCH_POLL_SECONDS, rescan_interval=WATCH_RESCAN_SECONDS):
+        self.folder = folder
+        self.on_change = on_change
+        self.extensions = extensions
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.backend = None
+        self._known = {} # path -> (size, mtime) of files already reported
+        self._pending = {} # path -> (size, mtime, monotonic time the signature was last seen changing)
+        self._stop_event = threading.Event()
+        self._wake_r, self._wake_w = None, None
+        self._inotify_fd = None
+        self._add_watch = None
+        self._watch_dirs = {} # inotify watch descriptor -> directory
+        self._thread = None
+
+    def start(self, known_paths):
+        """Starts watching; known_paths are the files already in the playlist."""
+        for path in known_paths:
+            sig = self._signature(path)
+            if sig is not None:
+                self._known[path] = sig
+        self._inotify_fd = self._open_inotify()
+        self.backend = "inotify" if self._inotify_fd is not None else "polling"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def _open_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+        except (OSError, AttributeError):
+            return None
+        self._add_watch = lambda directory: libc.inotify_add_watch(fd, os.fsencode(directory), _INOTIFY_MASK)
+        if not self._watch_tree(self.folder):
+            os.close(fd)
+            return None
+        self._wake_r, self._wake_w = os.pipe()
+        return fd
+
+    def _watch_tree(self, top):
+        """Adds a watch on top and every directory below it; returns False if top itself failed."""
+        directories = [top]
+        while directories:
+            directory = directories.pop()
+            wd = self._add_watch(directory)
+            if wd < 0:
+                if directory == top:
+                    return False
+                continue # Out of watches (fs.inotify.max_user_watches); the periodic rescan covers it
+            if wd in self._watch_dirs:
+                continue # Same directory reached again, e.g. through a symlink loop
+            self._watch_dirs[wd] = directory
+            _scan_directory(directory, self.extensions, directories, [], directories)
+        return True
+
+    def _run(self):
+        try:
+            if self._inotify_fd is not None:
+                self._run_inotify()
+            else:
+                self._run_polling()
+        finally:
+            for fd in (self._inotify_fd, self._wake_r, self._wake_w):
+                if fd is not None:
+                    os.close(fd)
+
+    def _run_polling(self):
+        while not self._stop_event.is_set():
+            self._rescan()
+            self._flush_pending()
+            self._stop_event.wait(min(self.poll_interval, self._next_settle_delay()))
+
+    def _run_inotify(self):
+        last_rescan = time.monotonic()
+        while not self._stop_event.is_set():
+            timeout = min(self._next_settle_delay(), max(0.0, last_rescan + self.rescan_interval - time.monotonic()))
+            readable, _, _ = select.select([self._inotify_fd, self._wake_r], [], [], timeout)
+            if self._stop_event.is_set():
+                break
+            if self._inotify_fd in readable and self._read_inotify_events():
+                last_rescan = 0.0 # Kernel queue overflowed: events were lost
+            if time.monotonic() - last_rescan >= self.rescan_interval:
+                # Also catches changes made through network mounts, which inotify does not see
+                self._rescan()
+                last_rescan = time.monotonic()
+            self._flush_pending()
+
+    def _read_inotify_events(self):
+        """Feeds pending/removed paths from queued inotify events; returns True on queue overflow."""
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        overflow = False
+        removed = []
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _INOTIFY_EVENT.size:offset + _INOTIFY_EVENT.size + name_len].rstrip(b"\0"))
+            offset += _INOTIFY_EVENT.size + name_len
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+            if mask & _IN_IGNORED:
+                self._watch_dirs.pop(wd, None) # Directory was deleted or unmounted
+                continue
+            directory = self._watch_dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    prefix = os.path.join(path, "")
+                    for known in [p for p in self._known if p.startswith(prefix)]:
+                        del self._known[known]
+                        removed.append(known)
+                    # A moved-away directory keeps its watches; ignore them from now on
+                    for stale_wd in [w for w, d in self._watch_dirs.items() if d == path or d.startswith(prefix)]:
+                        del self._watch_dirs[stale_wd]
+                elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._watch_tree(path)
+                    for found in find_video_files(path, self.extensions, workers=1):
+                        self._touch(found)
+                continue
+            if not is_video_file(name, self.extensions):
+                continue
+            if mask & (_IN_DELETE | _IN_MOVED_FROM):
+                self._pending.pop(path, None)
+                if self._known.pop(path, None) is not None:
+                    removed.append(path)
+            else:
+                self._touch(path)
+        if removed:
+            self.on_change([], removed, [])
+        return overflow
+
+    def _touch(self, path):
+        """Records that path may have changed; it is reported once it stops changing."""
+        sig = self._signature(path)
+        if sig is None:
+            return
+        pending = self._pending.get(path)
+        if pending is None or pending[:2] != sig:
+            self._pending[path] = (sig[0], sig[1], time.monotonic())
+
+    def _rescan(self):
+        current = set()
+        try:
+            paths = find_video_files(self.folder, self.extensions)
+        except OSError:
+            return # Folder temporarily unreachable (e.g. network mount); keep the playlist as is
+        for path in paths:
+            current.add(path)
+            if self._known.get(path) != self._signature(path):
+                self._touch(path)
+        removed = [path for path in self._known if path not in current]
+        for path in removed:
+            del self._known[path]
+        for path in [p for p in self._pending if p not in current]:
+            del self._pending[path]
+        if removed:
+            self.on_change([], removed, [])
+
+    def _next_settle_delay(self):
+        if not self._pending:
+            return self.rescan_interval
+        oldest = min(changed_at for _, _, changed_at in self._pending.values())
+        return max(0.1, oldest + self.settle_seconds - time.monotonic())
+
+    def _flush_pending(self):
+        now = time.monotonic()
+        added, updated = [], []
+        for path, (size, mtime, changed_at) in list(self._pending.items()):
+            sig = self._signature(path)
+            if sig is None:
+                del self._pending[path]
+                continue
+            if sig != (size, mtime):
+                self._pending[path] = (sig[0], sig[1], now) # Still being written
+                continue
+            if now - changed_at < self.settle_seconds:
+                continue
+            del self._pending[path]
+            (updated if path in self._known else added).append(path)
+            self._known[path] = sig
+        if added or updated:
+            self.on_change(added, [], updated)
+
+
+class LibraryStats:
+    """Aggregate numbers about the indexed library under root (everything when root is None).
+
+    refresh() compares each row's probe/verify timestamps with the previous call and only
+    re-reads rows that changed, so keeping a statistics window live costs one light query.
+    """
+
+    def __init__(self, root=None, profile=INGEST_PROFILE):
+        self.prefix = os.path.join(root, "") if root else None
+        self.profile = profile
+        self._versions = {} # path -> (probed_at, verified_at) the contribution was computed from
+        self._contributions = {} # path -> per-file numbers, summed by summary()
+        self._index_version = None
+
+    def refresh(self, index):
+        """Brings the statistics up to date with index; returns True if anything changed."""
+        index_version = index.version()
+        if index_version == self._index_version:
+            return False
+        self._index_version = index_version
+        versions = index.row_versions(self.prefix)
+        gone = [path for path in self._versions if path not in versions]
+        for path in gone:
+            del self._versions[path]
+            del self._contributions[path]
+        changed = [path for path, version in versions.items() if self._versions.get(path) != version]
+        # The first refresh reads everything in one query instead of by path
+        rows = index.rows() if len(changed) == len(versions) else index.rows(changed)
+        for row in rows:
+            if row["path"] not in versions:
+                continue # Outside root
+            self._versions[row["path"]] = versions[row["path"]]
+            self._contributions[row["path"]] = self._contribution(row)
+        return bool(gone or changed)
+
+    def _contribution(self, row):
+        path = row["path"]
+        folder = os.path.dirname(path)
+        if self.prefix:
+            folder = folder[len(self.prefix):] or "." # Rows are already filtered to paths under prefix
+        quarantined = bool(row["quarantine"])
+        info = None if row["error"] else {column: row[column] for column in MEDIA_COLUMNS}
+        duration = (info or {}).get("duration") or 0.0
+        bitrate = (info or {}).get("bitrate")
+        if not bitrate and duration:
+            bitrate = row["size"] * 8 / duration
+        copy_video, copy_audio, _ = choose_stream_mode(info, self.profile)
+        return {"folder": folder, "size": row["size"], "duration": duration, "bitrate": bitrate,
+                "video_codec": (info or {}).get("video_codec"), "audio_codec": (info or {}).get("audio_codec"),
+                "copy_video": copy_video and not quarantined, "copy_all": copy_video and copy_audio and not quarantined,
+                "quarantined": quarantined}
+
+    def summary(self):
+        """Returns a dict with totals, per-folder totals, a bitrate histogram and the codec mix."""
+        files = list(self._contributions.values())
+        total_duration = sum(c["duration"] for c in files)
+        total_size = sum(c["size"] for c in files)
+        folders = {}
+        for c in files:
+            folder = folders.setdefault(c["folder"], {"files": 0, "duration": 0.0, "size": 0})
+            folder["files"] += 1
+            folder["duration"] += c["duration"]
+            folder["size"] += c["size"]
+        histogram = collections.OrderedDict((label, 0) for _, label in STATS_BITRATE_BUCKETS)
+        for c in files:
+            if c["bitrate"]:
+                kbps = c["bitrate"] / 1000
+                histogram[next(label for limit, label in STATS_BITRATE_BUCKETS if limit is None or kbps < limit)] += 1
+        return {
+            "files": len(files),
+            "duration": total_duration,
+            "size": total_size,
+            # Same definition as cmd.ps1: total size over total duration
+            "avg_bitrate_kbps": total_size * 8 / 1000 / total_duration if total_duration else None,
+            "folders": dict(sorted(folders.items())),
+            "bitrate_histogram": histogram,
+            "video_codecs": collections.Counter(c["video_codec"] or "unknown" for c in files if not c["quarantined"]),
+            "audio_codecs": collections.Counter(c["audio_codec"] or "none" for c in files if not c["quarantined"]),
+            "copy_video": sum(c["copy_video"] for c in files),
+            "copy_all": sum(c["copy_all"] for c in files),
+            "quarantined": sum(c["quarantined"] for c in files),
+        }
+
+
+def _format_duration(seconds):
+    return f"{seconds / 3600:.2f} h"
+
+
+def _format_size(size):
+    return f"{size / 1024 ** 3:.2f} GiB"
+
+
+def _print_stats(summary):
+    files = summary["files"]
+    share = lambda n: f"{n} ({n * 100 / files:.0f}%)" if files else "0"
+    avg = summary["avg_bitrate_kbps"]
+    print(f"Files:           {files} ({summary['quarantined']} quarantined)")
+    print(f"Total duration:  {summary['duration']:.0f} s ({_format_duration(summary['duration'])})")
+    print(f"Total size:      {_format_size(summary['size'])}")
+    print(f"Average bitrate: {f'{avg:.0f} kb/s' if avg else 'n/a'}")
+    print(f"Stream copy:     video {share(summary['copy_video'])}, video+audio {share(summary['copy_all'])}")
+    print("Video codecs:    " + ", ".join(f"{codec} {n}" for codec, n in summary["video_codecs"].most_common()))
+    print("Audio codecs:    " + ", ".join(f"{codec} {n}" for codec, n in summary["audio_codecs"].most_common()))
+    print("Bitrate (kb/s):")
+    for label, n in summary["bitrate_histogram"].items():
+        print(f"  {label:>11} {n:6d}")
+    print("Folders:")
+    for folder, totals in summary["folders"].items():
+        print(f"  {folder}: {totals['files']} files, {_format_duration(totals['duration'])}, {_format_size(totals['size'])}")
+
+
+def _print_progress(done, total, rate, eta):
+    eta_text = f"{eta:.0f} s" if eta is not None else "?"
+    print(f"{done}/{total} files probed, {rate:.1f} files/s, ETA {eta_text}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AutoVideoStream media library tools")
+    parser.add_argument("--index", default=INDEX_PATH, help="media index database (default: %(default)s)")
+    parser.add_argument("--ffprobe", default="ffprobe", help="ffprobe executable (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+    scan_parser = commands.add_parser("scan", help="probe new or changed files into the media index")
+    scan_parser.add_argument("folder")
+    scan_parser.add_argument("--workers", type=int, default=DEFAULT_SCAN_WORKERS,
+                             help="concurrent ffprobe processes (default: %(default)s)")
+    verify_parser = commands.add_parser("verify", help="decode-check files and quarantine the broken ones")
+    verify_parser.add_argument("folder")
+    verify_parser.add_argument("--ffmpeg", default="ffmpeg", help="ffmpeg executable (default: %(default)s)")
+    verify_parser.add_argument("--full", action="store_true", help="decode whole files instead of three samples")
+    quarantine_parser = commands.add_parser("quarantine", help="list quarantined files")
+    quarantine_parser.add_argument("--release", metavar="PATH", help="put PATH back into the rotation")
+    stats_parser = commands.add_parser("stats", help="duration, size, bitrate and codec statistics from the index")
+    stats_parser.add_argument("folder", nargs="?", help="only files under this folder (default: whole index)")
+    stats_parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    list_parser = commands.add_parser("list", help="print the video files the streamer would play")
+    list_parser.add_argument("folder")
+    list_parser.add_argument("--workers", type=int, default=DEFAULT_DISCOVERY_WORKERS,
+                             help="top-level subdirectories walked in parallel (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    if args.command == "list":
+        started = time.monotonic()
+        paths = find_video_files(args.folder, workers=args.workers)
+        for path in paths:
+            print(path)
+        print(f"{len(paths)} files found in {time.monotonic() - started:.2f} s", file=sys.stderr)
+        return 0
+
+    index = MediaIndex(args.index)
+    if args.command == "scan":
+        paths = find_video_files(args.folder)
+        index.forget_missing(args.folder, paths)
+        scanner = LibraryScanner(index, args.ffprobe, workers=args.workers, on_progress=_print_progress)
+        scanner.start(paths)
+        try:
+            while not scanner.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            scanner.cancel()
+            print("Cancelled; files probed so far are kept in the index.")
+            scanner.wait()
+        print(f"{len(paths)} files in {args.folder}, {scanner.failed} could not be probed.")
+    elif args.command == "verify":
+        paths = find_video_files(args.folder)
+        report = lambda path, error: print(f"BROKEN {path}: {error}" if error else f"ok     {path}", flush=True)
+        verifier = IntegrityVerifier(index, args.ffmpeg, args.ffprobe, full=args.full, on_result=report)
+        verifier.start(paths)
+        try:
+            while not verifier.wait_idle(0.5):
+                pass
+        except KeyboardInterrupt:
+            print("Cancelled; results so far are kept in the index.")
+        verifier.stop()
+    elif args.command == "stats":
+        if args.folder:
+            stale = index.stale_paths(find_video_files(args.folder))
+            if stale:
+                print(f"Note: {len(stale)} files are not indexed yet; run 'scan {args.folder}' first for exact numbers.",
+                      file=sys.stderr)
+        stats = LibraryStats(args.folder)
+        stats.refresh(index)
+        summary = stats.summary()
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            _print_stats(summary)
+    elif args.command == "quarantine":
+        if args.release:
+            if not index.release(args.release):
+                print(f"{args.release} is not quarantined.")
+                return 1
+            return 0
+        for path, reason in index.quarantined():
+            print(f"{path}: {reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
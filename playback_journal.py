@@ -0,0 +1,175 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from media_library import CONFIG_DIR, lock_state_file
+
+JOURNAL_NAME = "playback.journal"
+JOURNAL_PATH = os.path.join(CONFIG_DIR, JOURNAL_NAME)
+JOURNAL_SYNC_SECONDS = 1.0 # Position checkpoints are fsynced in batches at most this long after being written
+DURABLE_EVENTS = ("start", "done", "error") # fsynced as soon as they are written
+JOURNAL_COMPACT_RECORDS = 5000 # Rewritten as a single snapshot after this many appends
+
+# What the journal says was on air last. completed means path finished, so playback
+# continues with the file after it; otherwise it resumes inside path at position.
+PlaybackState = collections.namedtuple("PlaybackState", "path position completed files_played errors updated_at")
+EMPTY_STATE = PlaybackState(None, 0.0, False, 0, 0, None)
+
+
+def _apply(state, record):
+    event = record.get("e")
+    if event == "snapshot":
+        return PlaybackState(record.get("path"), record.get("pos", 0.0), record.get("completed", False),
+                             record.get("played", 0), record.get("errors", 0), record.get("t"))
+    if event in ("start", "pos"):
+        return state._replace(path=record["path"], position=record.get("pos", 0.0), completed=False,
+                              updated_at=record.get("t"))
+    if event == "done":
+        return state._replace(path=record["path"], position=0.0, completed=True,
+                              files_played=state.files_played + 1, updated_at=record.get("t"))
+    if event == "error":
+        return state._replace(errors=state.errors + 1, updated_at=record.get("t"))
+    return state # Unknown event from a newer version
+
+
+def replay(path=JOURNAL_PATH):
+    """Rebuilds the PlaybackState from a journal file; returns (state, record count).
+
+    A torn last line (crash or power loss mid-write) is ignored, as is anything else
+    that does not parse, so a damaged journal costs at most the records it lost.
+    """
+    state, count = EMPTY_STATE, 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    state = _apply(state, record)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+                count += 1
+    except FileNotFoundError:
+        pass
+    return state, count
+
+
+class PlaybackJournal:
+    """Append-only, crash-safe record of playback: files started, position checkpoints,
+    files completed and errors.
+
+    Every append is flushed to the OS at once, so a crash of the process loses nothing.
+    Files started, completed and failed are fsynced right away; position checkpoints
+    are fsynced in batches by a timer at most sync_interval seconds later (and on
+    sync()/close()), so they cost no disk flush each. Once compact_records records have accumulated the journal is rewritten as
+    one snapshot record, atomically, which keeps replay at startup in the
+    millisecond range however long the streamer has been running. A lock file next to
+    the journal keeps a second streamer from using it at the same time (StateInUseError).
+    """
+
+    def __init__(self, path=JOURNAL_PATH, sync_interval=JOURNAL_SYNC_SECONDS, compact_records=JOURNAL_COMPACT_RECORDS):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.compact_records = compact_records
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_file = lock_state_file(path + ".lock")
+        try:
+            self.state, self._records = replay(path)
+            self._file = open(path, 'ab')
+            if self._file.tell() > 0 and not self._ends_with_newline():
+                self._file.write(b"\n") # Keep the next record off a torn last line
+        except BaseException:
+            self._lock_file.close() # Nobody else can release it
+            raise
+        self._last_sync = time.monotonic()
+        self._dirty = False
+        self._timer = None
+        if self._records >= self.compact_records:
+            with self._lock:
+                self._compact()
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _append(self, record):
+        record["t"] = time.time()
+        with self._lock:
+            if self._file is None:
+                return
+            self.state = _apply(self.state, record)
+            self._file.write(json.dumps(record, separators=(",", ":")).encode('utf-8') + b"\n")
+            self._file.flush()
+            self._records += 1
+            self._dirty = True
+            if self._records >= self.compact_records:
+                self._compact()
+            elif record["e"] in DURABLE_EVENTS or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+            elif self._timer is None:
+                delay = max(0.0, self._last_sync + self.sync_interval - time.monotonic())
+                self._timer = threading.Timer(delay, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._file is not None:
+                self._sync()
+
+    def _sync(self):
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _compact(self):
+        """Replaces the journal with a single snapshot of the current state."""
+        state = self.state
+        snapshot = {"e": "snapshot", "t": state.updated_at, "path": state.path, "pos": state.position,
+                    "completed": state.completed, "played": state.files_played, "errors": state.errors}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(snapshot, separators=(",", ":")).encode('utf-8') + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close() # Windows cannot replace a file that is still open
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._records = 1
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def started(self, path, position=0.0):
+        self._append({"e": "start", "path": path, "pos": round(position, 3)})
+
+    def checkpoint(self, path, position):
+        self._append({"e": "pos", "path": path, "pos": round(position, 3)})
+
+    def completed(self, path):
+        self._append({"e": "done", "path": path})
+
+    def error(self, path, failure, detail=None):
+        self._append({"e": "error", "path": path, "failure": failure, "detail": detail})
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+                self._lock_file.close()
@@ -0,0 +1,171 @@
+"""Headless AutoVideoStream: streams a folder of videos to an RTMP server in an endless
+loop with the same engine and encoder presets as the GUI, for servers and systemd units.
+
+    python3 streamer_cli.py --rtmp rtmp://your.server/live --key KEY --video-dir /path/to/videos
+
+Signals: SIGTERM and SIGINT (Ctrl+C) stop gracefully, so ffmpeg closes the FLV stream;
+SIGHUP restarts the run, re-reading the folder and resuming where playback was; SIGUSR1
+skips to the next file. The exit status is 0 after a requested stop and 1 when the
+engine gave up on its own (no videos, folder unreadable), so Restart=on-failure works.
+
+With --control-port the same commands (and start, skip-to, status) are also served as
+JSON on http://127.0.0.1:PORT, see control_server.py. The process then stays up when
+streaming stops, waiting for /start, until it gets a signal.
+"""
+import argparse
+import os
+import queue
+import shutil
+import signal
+import sys
+
+from control_server import ControlServer
+from ffmpeg_tools import MAX_FILE_FAILURES, STALL_WINDOW_SECONDS, STATE_IDLE
+from streamer_engine import DEFAULT_LANG, FFMPEG_DEFAULT_PATH, MESSAGES, StreamSettings, StreamerEngine
+
+VIDEO_ENCODERS = ("libx264", "h264_nvenc", "h264_amf", "h264_qsv")
+AUDIO_MODES = ("aac", "copy")
+# The main thread sleeps on its event queue; signal handlers run inside that wait.
+# Windows does not interrupt lock waits for Ctrl+C, so there it wakes up once a second.
+WAIT_SLICE_SECONDS = 1.0 if os.name == 'nt' else None
+
+
+class StreamerDaemon:
+    """Runs a StreamerEngine in the foreground until a signal (or the engine itself) ends it."""
+
+    def __init__(self, settings, language=DEFAULT_LANG, control_port=None):
+        self.settings = settings
+        # Logs to stdout without an on_log callback
+        self.engine = StreamerEngine(language=language, on_transition=self._on_engine_transition)
+        self.control = ControlServer(self.engine, settings, port=control_port) if control_port else None
+        # "exit", "reload", "switch" from signal handlers and "ended" from the engine. Handlers may
+        # interrupt the main thread anywhere, even inside a lock, so all they do is a put()
+        # on this queue, which is safe there; the main thread does the rest.
+        self.events = queue.SimpleQueue()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.events.put("exit"))
+        signal.signal(signal.SIGINT, lambda signum, frame: self.events.put("exit"))
+        if hasattr(signal, "SIGHUP"): # POSIX only
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.events.put("reload"))
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.events.put("switch"))
+
+    def _on_engine_transition(self, transition):
+        if transition.target == STATE_IDLE:
+            self.events.put("ended")
+
+    def _next_event(self):
+        while True:
+            try:
+                return self.events.get(timeout=WAIT_SLICE_SECONDS)
+            except queue.Empty:
+                pass
+
+    def run(self):
+        """Streams until stopped; returns the process exit status."""
+        self.engine.start(self.settings)
+        while True:
+            event = self._next_event()
+            if event == "exit":
+                self.engine.stop()
+                self.engine.wait()
+                return 0
+            if event == "reload":
+                self.engine.restart()
+            elif event == "switch":
+                self.engine.switch()
+            elif event == "ended" and not self.engine.running() and self.control is None:
+                return 1 # Ended without being asked to; with a control API it waits for /start instead
+
+
+def settings_from_args(parser, args):
+    """StreamSettings from parsed arguments, after the checks the GUI does before starting."""
+    if not os.path.isfile(args.ffmpeg) and shutil.which(args.ffmpeg) is None:
+        parser.error(f"ffmpeg not found: {args.ffmpeg}")
+    if not args.rtmp.strip().lower().startswith(("rtmp://", "rtmps://")):
+        parser.error("--rtmp must start with rtmp:// or rtmps://")
+    if not args.key.strip():
+        parser.error("--key must not be empty")
+    if not os.path.isdir(args.video_dir):
+        parser.error(f"--video-dir is not a directory: {args.video_dir}")
+    if args.watermark and not os.path.isfile(args.watermark):
+        parser.error(f"--watermark file not found: {args.watermark}")
+    if args.cache is not None and args.cache <= 0:
+        parser.error("--cache needs a size limit above 0 GB")
+    if args.state_dir:
+        try:
+            os.makedirs(args.state_dir, exist_ok=True)
+        except OSError as e:
+            parser.error(f"--state-dir cannot be created: {e}")
+    if args.max_file_failures < 1:
+        parser.error("--max-file-failures must be at least 1")
+    if args.stall_window < 0:
+        parser.error("--stall-window must be 0 (watchdog off) or more seconds")
+    return StreamSettings(
+        ffmpeg_path=args.ffmpeg,
+        rtmp_url=args.rtmp,
+        stream_key=args.key,
+        video_folder=args.video_dir,
+        video_encoder=args.encoder,
+        audio=args.audio,
+        watermark=args.watermark,
+        persistent=args.persistent,
+        stream_copy=not args.no_stream_copy,
+        cache=args.cache is not None,
+        cache_limit_gb=args.cache or 0.0,
+        verify=not args.no_verify,
+        max_file_failures=args.max_file_failures,
+        stall_window=args.stall_window,
+        state_dir=args.state_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AutoVideoStream headless streamer")
+    parser.add_argument("--rtmp", required=True, help="RTMP server URL, without the stream key")
+    parser.add_argument("--key", required=True, help="stream key, appended to --rtmp")
+    parser.add_argument("--video-dir", required=True, help="folder streamed in a loop, subfolders included")
+    parser.add_argument("--encoder", choices=VIDEO_ENCODERS, default="libx264",
+                        help="video encoder (default: %(default)s)")
+    parser.add_argument("--audio", choices=AUDIO_MODES, default="aac",
+                        help="re-encode audio to AAC or copy it (default: %(default)s)")
+    parser.add_argument("--watermark", metavar="IMAGE", help="overlay this image in the top right corner")
+    parser.add_argument("--ffmpeg", default=FFMPEG_DEFAULT_PATH, help="ffmpeg executable (default: %(default)s)")
+    parser.add_argument("--persistent", action="store_true",
+                        help="keep one RTMP connection open across files (seamless switches)")
+    parser.add_argument("--no-stream-copy", action="store_true",
+                        help="always re-encode, even files that already meet the ingest profile")
+    parser.add_argument("--cache", type=float, metavar="GB",
+                        help="pre-transcode the folder in the background into a cache of at most GB")
+    parser.add_argument("--no-verify", action="store_true", help="skip the background corrupt-file check")
+    parser.add_argument("--max-file-failures", type=int, default=MAX_FILE_FAILURES,
+                        help="skip a file after this many failed runs in a row (default: %(default)s)")
+    parser.add_argument("--stall-window", type=float, default=STALL_WINDOW_SECONDS, metavar="SECONDS",
+                        help="restart ffmpeg after output stalls this long; 0 turns the watchdog off "
+                             "(default: %(default)s)")
+    parser.add_argument("--state-dir", metavar="DIR",
+                        help="keep this channel's resume journal and transcode cache here; needed when several "
+                             "channels run on one machine (default: ~/.autovideostream)")
+    parser.add_argument("--lang", choices=sorted(MESSAGES), default=DEFAULT_LANG,
+                        help="log language (default: %(default)s)")
+    parser.add_argument("--control-port", type=int, metavar="PORT",
+                        help="serve the JSON control API on 127.0.0.1:PORT (one port per channel)")
+    args = parser.parse_args(argv)
+
+    daemon = StreamerDaemon(settings_from_args(parser, args), language=args.lang, control_port=args.control_port)
+    if daemon.control is not None:
+        try:
+            daemon.control.start()
+        except OSError as e: # Port taken, most likely by another channel
+            print(f"Cannot serve the control API on port {args.control_port}: {e}", file=sys.stderr)
+            return 1
+    daemon.install_signal_handlers()
+    try:
+        return daemon.run()
+    finally:
+        if daemon.control is not None:
+            daemon.control.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
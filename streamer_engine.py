@@ -0,0 +1,1578 @@
+import collections
+import io
+import os
+import queue
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from media_library import (CONFIG_DIR, VIDEO_EXTENSIONS, FolderWatcher, IntegrityVerifier, LibraryScanner, MediaIndex,
+                           ProbeError, ProbeUnavailable, choose_stream_mode, ffprobe_path_for, find_video_files,
+                           keyframe_before)
+from playback_journal import JOURNAL_NAME, PlaybackJournal
+from transcode_cache import CACHE_DIR_NAME, TranscodeCache
+from ffmpeg_tools import (FAILURE_CLASSES, FAILURE_ENCODER, FAILURE_OUTPUT, FAILURE_STALL, MAX_FILE_FAILURES,
+                          PROGRESS_ARGS, STALL_WINDOW_SECONDS, STATE_BACKOFF, STATE_IDLE, STATE_PLAYING,
+                          STATE_STARTING, STATE_STOPPING, STATE_SWITCHING, EngineStateMachine, Histogram,
+                          ProcessReaper, ProgressHistory, ProgressParser, RestartPolicy, StallWatchdog,
+                          classify_failure, format_progress)
+
+FFMPEG_DEFAULT_PATH = "ffmpeg"  # Assume ffmpeg is in PATH
+DEFAULT_LANG = "zh_CN"
+TS_PACKET_SIZE = 188
+PREFETCH_LEAD_SECONDS = 5.0 # Start the next file's feeder this long before the current one ends
+
+DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+FALLBACK_ENCODER = "libx264" # Used for the rest of the session once a hardware encoder fails to start
+STALL_CHECK_SECONDS = 1.0 # How often the supervisor looks at the stall watchdog while ffmpeg is silent
+PROGRESS_LOG_SECONDS = 10.0 # One progress summary in the log this often; the status line shows every sample
+CHECKPOINT_SECONDS = 5.0 # How often the playback position is journaled while a file plays
+SHUTDOWN_TIMEOUT_SECONDS = 6.0 # How long a stopping engine waits for ffmpeg to flush and exit
+# Persistent mode concatenates every file into one RTMP session, so all feeders emit this format
+PERSISTENT_VIDEO_SIZE = (1280, 720) # Letterboxed to keep the aspect ratio
+PERSISTENT_FPS = 30
+PERSISTENT_AUDIO = "anullsrc=channel_layout=stereo:sample_rate=44100" # Silence for files without audio; matches aac args
+LOG_HISTORY = 1000 # Log lines kept for clients that attach later, as many as the GUI log shows
+
+# Everything a streaming run depends on. video_encoder and audio are ffmpeg names ("h264_nvenc",
+# "aac" or "copy"); watermark is an image path or None; cache_limit_gb only matters with cache
+StreamSettings = collections.namedtuple(
+    "StreamSettings",
+    "ffmpeg_path rtmp_url stream_key video_folder video_encoder audio watermark persistent stream_copy "
+    "cache cache_limit_gb verify max_file_failures stall_window state_dir",
+    defaults=(FFMPEG_DEFAULT_PATH, None, None, None, "libx264", "aac", None, False, True,
+              False, 50.0, True, MAX_FILE_FAILURES, STALL_WINDOW_SECONDS, None))
+
+# Log and status-line texts of the engine, per language. The GUI merges them into its own
+# translations; status_* keys are the fields passed to on_status.
+MESSAGES = {
+    "zh_CN": {
+        "starting_stream_msg": "开始启动推流循环...",
+        "stopping_stream_msg": "正在尝试停止推流...",
+        "switching_video_msg": "正在请求切换到下一个视频...",
+        "skipping_to_msg": "正在请求切换到 {filename}...",
+        "restarting_stream_msg": "正在重新启动推流 (重新读取文件夹，从当前位置继续)...",
+        "control_listening_msg": "INFO: 控制接口已启动: http://{host}:{port}/status",
+        "control_error_msg": "WARN: 控制接口请求 {method} {path} 出错: {error}",
+        "terminating_ffmpeg_msg": "正在终止当前的 FFmpeg 进程 (PID: {pid})...",
+        "terminating_ffmpeg_for_switch_msg": "为切换视频，正在终止 FFmpeg 进程 (PID: {pid})...",
+        "ffmpeg_terminated_msg": "FFmpeg 进程已正常终止。",
+        "ffmpeg_terminate_failed_msg": "FFmpeg 进程未能正常终止，强制结束...",
+        "ffmpeg_killed_msg": "FFmpeg 进程已被强制结束。",
+        "ffmpeg_terminate_exception_msg": "无法终止 FFmpeg 进程: {error}",
+        "no_videos_found_error": "在指定文件夹 '{folder}' 未找到视频文件 ({exts})。",
+        "found_videos_msg": "找到 {count} 个视频文件。开始循环播放。",
+        "loop_complete_msg": "完成一轮播放，从头开始下一轮。",
+        "starting_file_msg": "--- 开始推流: {filename} ---",
+        "copying_audio_info": "尝试直接复制音频流。如果源音频与目标不兼容可能会失败。",
+        "executing_command_msg": "执行命令: {command}",
+        "ffmpeg_output_log": "FFMPEG: {line}",
+        "stop_detected_ffmpeg_output_msg": "在 FFmpeg 输出期间检测到停止请求。",
+        "switch_detected_ffmpeg_output_msg": "在 FFmpeg 输出期间检测到切换视频请求。",
+        "stop_detected_after_file_msg": "推流 {filename} 在结束后检测到停止信号。",
+        "switch_detected_after_file_msg": "推流 {filename} 在结束后检测到切换信号，准备播放下一个。",
+        "stream_finished_success_msg": "--- 完成推流: {filename} (成功) ---",
+        "ffmpeg_error_exit_msg": "--- FFmpeg 错误退出 (代码 {code}) 对于: {filename} ---",
+        "ffmpeg_error_context_msg": "FFmpeg 可能的错误信息:\n{context}",
+        "stall_detected_msg": "WARN: {filename} 推流停滞 ({reason}，{seconds:.0f} 秒内速度 {speed:.2f}x)，从 {offset:.1f} 秒处重启",
+        "stall_recovered_msg": "INFO: 停滞已恢复，中断共 {seconds:.1f} 秒",
+        "failure_class_msg": "INFO: 失败类型: {failure} (累计: {counts})",
+        "encoder_fallback_msg": "WARN: 编码器 {failed} 无法启动，本次推流改用 {fallback}",
+        "resuming_at_msg": "INFO: 从 {offset:.1f} 秒处 (关键帧) 继续播放 {filename}",
+        "resume_saved_msg": "INFO: 接着上次的进度播放: {filename}，{offset:.1f} 秒",
+        "journal_replayed_msg": "INFO: 播放日志已恢复 ({elapsed_ms:.1f} ms，累计播完 {played} 个文件，{errors} 次错误)",
+        "journal_open_failed_warn": "WARN: 无法打开播放日志: {error}",
+        "journal_write_failed_warn": "WARN: 无法写入播放日志: {error}",
+        "restart_backoff_msg": "WARN: 连续第 {failures} 次失败 (此文件 {file_failures}/{max_failures} 次)，{delay:.1f} 秒后重试",
+        "skipping_failed_file_msg": "WARN: {filename} 已失败 {file_failures} 次，跳过并播放下一个文件",
+        "failed_file_flagged_msg": "WARN: 其他文件推流正常，已隔离反复失败的文件: {filename}",
+        "status_backoff": "{delay:.0f} 秒后重试 (连续失败 {failures} 次)",
+        "ffmpeg_command_not_found_fatal": "FATAL ERROR: '{path}' 命令未找到。请检查 FFmpeg 路径设置。",
+        "ffmpeg_unexpected_error_fatal": "FATAL ERROR: 运行 FFmpeg 时发生意外错误: {error}",
+        "exiting_loop_after_file_msg": "在文件处理完成后退出推流循环。",
+        "switching_to_next_video_msg": "--- 切换到下一个视频 ---",
+        "loop_terminated_unexpectedly_warn": "WARN: 推流循环意外终止。",
+        "stream_loop_error_fatal": "FATAL ERROR: 推流循环发生意外错误: {error}",
+        "stream_thread_finished_msg": "INFO: 推流线程结束。",
+        "shutdown_stats_msg": "INFO: FFmpeg 退出耗时 ({method}): {count} 次, 平均 {mean_ms:.0f} ms, p95 {p95_ms:.0f} ms, 最长 {max_ms:.0f} ms",
+        "shutdown_pending_warn": "WARN: 仍有 {count} 个 FFmpeg 进程未退出，它们将在后台被结束。",
+        "nvenc_driver_warning": "WARN: 检测到 NVENC 编码器。请确保您的 NVIDIA 驱动版本 >= 570.0 以获得最佳兼容性，否则可能出错。",
+        "amd_amf_warning": "WARN: 使用 h264_amf, 请确保驱动和 FFmpeg 支持良好。参数可能需调整。",
+        "intel_qsv_warning": "WARN: 使用 h264_qsv, 请确保驱动和 FFmpeg 支持良好。参数可能需调整。",
+        "search_video_error_msg": "ERROR: 搜索视频文件时出错: {error} (路径: {folder})",
+        "filename_encoding_error": "[文件名编码错误 {index}]",
+        "starting_publisher_msg": "启动常驻推流进程 (PID: {pid})，RTMP 连接将在文件之间保持。",
+        "publisher_exited_warn": "WARN: 常驻推流进程已退出 (代码 {code})，正在重新连接...",
+        "publisher_output_log": "PUBLISHER: {line}",
+        "publisher_read_error_warn": "WARN: 读取常驻推流进程输出时出错: {error}",
+        "stopping_publisher_msg": "正在关闭常驻推流进程 (PID: {pid})...",
+        "persistent_normalize_msg": "INFO: 单连接模式下所有文件统一重新编码为 {width}x{height} {fps} fps、立体声 AAC，保证推流参数一致。",
+        "persistent_cache_unused_msg": "WARN: 单连接模式下所有文件都需实时统一编码，不使用预转码缓存。",
+        "publisher_lost_msg": "WARN: 常驻推流进程已停止接收数据，将重新连接并从 {filename} 的 {offset:.1f} 秒处继续",
+        "inter_file_gap_msg": "INFO: 文件切换间隔 {gap_ms:.0f} ms",
+        "switch_latency_msg": "INFO: 切换视频耗时 {latency_ms:.0f} ms",
+        "prefetching_next_msg": "INFO: 预加载下一个视频: {filename}",
+        "prefetch_failed_warn": "WARN: 无法预加载下一个视频: {error}",
+        "status_playing": "播放: {filename}",
+        "stream_copy_decision_msg": "INFO: {filename}: {mode} ({reason})",
+        "stream_encode_decision_msg": "INFO: {filename}: 重新编码 ({reason})",
+        "mode_copy_all": "直接复制音视频流",
+        "mode_copy_video": "直接复制视频流，音频重编码为 AAC",
+        "probe_failed_msg": "WARN: ffprobe 无法读取 {filename}: {error}",
+        "probe_unavailable_msg": "WARN: 无法运行 ffprobe ({error})，文件将按重新编码推流，稍后重试",
+        "media_index_open_failed_warn": "WARN: 无法打开媒体索引，只在播放前临时分析文件: {error}",
+        "index_status_msg": "INFO: 媒体索引: {fresh} 个文件已是最新，{stale} 个待探测 (检查耗时 {elapsed_ms:.0f} ms)",
+        "scan_progress_msg": "INFO: 后台扫描媒体库: {done}/{total} ({rate:.1f} 个/秒，剩余约 {eta})",
+        "scan_complete_msg": "INFO: 媒体库扫描完成: {total} 个文件，{failed} 个无法读取",
+        "watch_started_msg": "INFO: 正在监视文件夹变化 ({backend})，新文件将自动加入播放列表",
+        "watch_failed_warn": "WARN: 无法监视视频文件夹，新文件需要重新开始推流后才会加入: {error}",
+        "playlist_added_msg": "INFO: 新文件加入播放列表: {filename}",
+        "playlist_removed_msg": "INFO: 文件已从播放列表移除: {filename}",
+        "playlist_updated_msg": "INFO: 文件已更新，将重新分析: {filename}",
+        "playlist_empty_wait_msg": "WARN: 播放列表为空，等待文件夹中出现新视频...",
+        "status_scan": "扫描 {done}/{total}",
+        "engine_transition_msg": "INFO: 状态 {source} -> {target} ({reason}，命令发出后 {latency_ms:.1f} ms)",
+        "progress_log_msg": "INFO: 进度 {progress}",
+        "status_progress": "{progress}",
+        "quarantined_msg": "WARN: 文件解码检查失败，已隔离，不再播放: {filename} ({reason})",
+        "skipping_quarantined_msg": "INFO: 跳过已隔离的文件: {filename} ({reason})",
+        "all_quarantined_msg": "WARN: 播放列表中的所有文件均已隔离，等待新文件...",
+        "cache_hit_msg": "INFO: {filename}: 使用预转码缓存，直接复制流",
+        "cache_started_msg": "INFO: 后台预转码缓存已启动 ({folder}，上限 {limit_gb:g} GB)",
+        "cache_open_failed_warn": "WARN: 无法打开预转码缓存，将不使用缓存继续推流: {error}",
+        "status_switch_latency": "上次切换: {latency_ms:.0f} ms",
+    },
+    "en_US": {
+        "starting_stream_msg": "Starting stream loop...",
+        "stopping_stream_msg": "Attempting to stop streaming...",
+        "switching_video_msg": "Requesting switch to next video...",
+        "skipping_to_msg": "Requesting switch to {filename}...",
+        "restarting_stream_msg": "Restarting the stream (folder re-read, playback continues where it was)...",
+        "control_listening_msg": "INFO: Control API listening on http://{host}:{port}/status",
+        "control_error_msg": "WARN: Control API request {method} {path} failed: {error}",
+        "terminating_ffmpeg_msg": "Terminating current FFmpeg process (PID: {pid})...",
+        "terminating_ffmpeg_for_switch_msg": "Terminating FFmpeg process for video switch (PID: {pid})...",
+        "ffmpeg_terminated_msg": "FFmpeg process terminated gracefully.",
+        "ffmpeg_terminate_failed_msg": "FFmpeg process did not terminate gracefully, killing...",
+        "ffmpeg_killed_msg": "FFmpeg process killed.",
+        "ffmpeg_terminate_exception_msg": "Could not terminate FFmpeg process: {error}",
+        "no_videos_found_error": "ERROR: No video files found in the specified folder '{folder}' ({exts}).",
+        "found_videos_msg": "INFO: Found {count} video files. Starting loop.",
+        "loop_complete_msg": "INFO: Completed one cycle, starting next loop.",
+        "starting_file_msg": "--- Starting stream for: {filename} ---",
+        "copying_audio_info": "INFO: Attempting to copy audio stream. May fail if incompatible.",
+        "executing_command_msg": "Executing: {command}",
+        "ffmpeg_output_log": "FFMPEG: {line}",
+        "stop_detected_ffmpeg_output_msg": "INFO: Stop requested detected during FFmpeg output.",
+        "switch_detected_ffmpeg_output_msg": "INFO: Switch video request detected during FFmpeg output.",
+        "stop_detected_after_file_msg": "INFO: Stop signal detected after processing {filename}.",
+        "switch_detected_after_file_msg": "INFO: Switch signal detected after processing {filename}, preparing next video.",
+        "stream_finished_success_msg": "--- Finished streaming: {filename} (Success) ---",
+        "ffmpeg_error_exit_msg": "--- FFmpeg exited with error (code {code}) for: {filename} ---",
+        "ffmpeg_error_context_msg": "FFmpeg potential error context:\n{context}",
+        "stall_detected_msg": "WARN: {filename} stalled ({reason}, {speed:.2f}x over {seconds:.0f} s), restarting at {offset:.1f} s",
+        "stall_recovered_msg": "INFO: Recovered from stall, output was interrupted for {seconds:.1f} s",
+        "failure_class_msg": "INFO: Failure classified as {failure} (so far: {counts})",
+        "encoder_fallback_msg": "WARN: Encoder {failed} failed to start, using {fallback} for the rest of this session",
+        "resuming_at_msg": "INFO: Resuming {filename} at {offset:.1f} s (keyframe)",
+        "resume_saved_msg": "INFO: Continuing where the last session stopped: {filename} at {offset:.1f} s",
+        "journal_replayed_msg": "INFO: Playback journal replayed in {elapsed_ms:.1f} ms ({played} files played, {errors} errors so far)",
+        "journal_open_failed_warn": "WARN: Could not open the playback journal: {error}",
+        "journal_write_failed_warn": "WARN: Could not write the playback journal: {error}",
+        "restart_backoff_msg": "WARN: Failure {failures} in a row ({file_failures}/{max_failures} for this file), retrying in {delay:.1f} s",
+        "skipping_failed_file_msg": "WARN: {filename} failed {file_failures} times, skipping to the next file",
+        "failed_file_flagged_msg": "WARN: Other files stream fine, quarantined the repeatedly failing file: {filename}",
+        "status_backoff": "Retry in {delay:.0f} s ({failures} failures in a row)",
+        "ffmpeg_command_not_found_fatal": "FATAL ERROR: '{path}' command not found. Check FFmpeg path setting.",
+        "ffmpeg_unexpected_error_fatal": "FATAL ERROR: An unexpected error occurred running FFmpeg: {error}",
+        "exiting_loop_after_file_msg": "INFO: Exiting stream loop after file completion due to stop request.",
+        "switching_to_next_video_msg": "--- Switching to next video ---",
+        "loop_terminated_unexpectedly_warn": "WARN: Stream loop terminated unexpectedly.",
+        "stream_loop_error_fatal": "FATAL ERROR: An unexpected error occurred in the stream loop: {error}",
+        "stream_thread_finished_msg": "INFO: Stream thread finished.",
+        "shutdown_stats_msg": "INFO: FFmpeg time-to-exit ({method}): {count} exits, mean {mean_ms:.0f} ms, p95 {p95_ms:.0f} ms, max {max_ms:.0f} ms",
+        "shutdown_pending_warn": "WARN: {count} FFmpeg process(es) have not exited yet; they will be stopped in the background.",
+        "nvenc_driver_warning": "WARN: NVENC encoder selected. Ensure your NVIDIA driver version is >= 570.0 for best compatibility, otherwise errors may occur.",
+        "amd_amf_warning": "WARN: Using h264_amf, ensure drivers and FFmpeg support are correct. Parameters might need tuning.",
+        "intel_qsv_warning": "WARN: Using h264_qsv, ensure drivers and FFmpeg support are correct. Parameters might need tuning.",
+        "search_video_error_msg": "ERROR: Error searching for video files: {error} (Path: {folder})",
+        "filename_encoding_error": "[Filename Encoding Error {index}]",
+        "starting_publisher_msg": "Started persistent publisher (PID: {pid}); the RTMP session stays open across files.",
+        "publisher_exited_warn": "WARN: Persistent publisher exited (code {code}), reconnecting...",
+        "publisher_output_log": "PUBLISHER: {line}",
+        "publisher_read_error_warn": "WARN: Error reading publisher stderr: {error}",
+        "stopping_publisher_msg": "Closing persistent publisher (PID: {pid})...",
+        "persistent_normalize_msg": "INFO: Persistent connection mode re-encodes every file to {width}x{height} at {fps} fps with stereo AAC so the session keeps one format.",
+        "persistent_cache_unused_msg": "WARN: Persistent connection mode normalises every file live, so the transcode cache is not used.",
+        "publisher_lost_msg": "WARN: The persistent publisher stopped taking data; reconnecting and resuming {filename} at {offset:.1f} s",
+        "inter_file_gap_msg": "INFO: Inter-file gap {gap_ms:.0f} ms",
+        "switch_latency_msg": "INFO: Video switch took {latency_ms:.0f} ms",
+        "prefetching_next_msg": "INFO: Pre-rolling next video: {filename}",
+        "prefetch_failed_warn": "WARN: Could not pre-roll next video: {error}",
+        "status_playing": "Playing: {filename}",
+        "stream_copy_decision_msg": "INFO: {filename}: {mode} ({reason})",
+        "stream_encode_decision_msg": "INFO: {filename}: re-encoding ({reason})",
+        "mode_copy_all": "stream copy (video + audio)",
+        "mode_copy_video": "stream copy video, re-encode audio to AAC",
+        "probe_failed_msg": "WARN: ffprobe could not read {filename}: {error}",
+        "probe_unavailable_msg": "WARN: Could not run ffprobe ({error}); files are re-encoded until it works again",
+        "media_index_open_failed_warn": "WARN: Could not open the media index, probing files on demand only: {error}",
+        "index_status_msg": "INFO: Media index: {fresh} files up to date, {stale} to probe (checked in {elapsed_ms:.0f} ms)",
+        "scan_progress_msg": "INFO: Scanning library in background: {done}/{total} ({rate:.1f} files/s, ETA {eta})",
+        "scan_complete_msg": "INFO: Library scan finished: {total} files, {failed} unreadable",
+        "watch_started_msg": "INFO: Watching the folder for changes ({backend}); new files join the playlist automatically",
+        "watch_failed_warn": "WARN: Could not watch the video folder, new files need a restart: {error}",
+        "playlist_added_msg": "INFO: Added to playlist: {filename}",
+        "playlist_removed_msg": "INFO: Removed from playlist: {filename}",
+        "playlist_updated_msg": "INFO: File changed, will be re-analysed: {filename}",
+        "playlist_empty_wait_msg": "WARN: Playlist is empty, waiting for new videos in the folder...",
+        "status_scan": "Scan {done}/{total}",
+        "engine_transition_msg": "INFO: State {source} -> {target} ({reason}, {latency_ms:.1f} ms after the command)",
+        "progress_log_msg": "INFO: Progress {progress}",
+        "status_progress": "{progress}",
+        "quarantined_msg": "WARN: Decode check failed, file quarantined and will not be played: {filename} ({reason})",
+        "skipping_quarantined_msg": "INFO: Skipping quarantined file: {filename} ({reason})",
+        "all_quarantined_msg": "WARN: Every file in the playlist is quarantined, waiting for new files...",
+        "cache_hit_msg": "INFO: {filename}: playing cached stream-ready rendition (stream copy)",
+        "cache_started_msg": "INFO: Background pre-transcode cache started ({folder}, limit {limit_gb:g} GB)",
+        "cache_open_failed_warn": "WARN: Could not open the transcode cache, continuing without it: {error}",
+        "status_switch_latency": "Last switch: {latency_ms:.0f} ms",
+    }
+}
+
+
+def video_encoder_args(v_enc):
+    """Rate-control presets per encoder, shared by live streaming and cache renditions."""
+    common_params = ["-g", "60", "-pix_fmt", "yuv420p", "-max_muxing_queue_size", "1024"]
+    if v_enc == "h264_nvenc":
+        return ["-c:v", v_enc, "-preset", "p5", "-tune", "hq", "-rc", "cbr", "-b:v", "3500k", "-maxrate", "4000k", "-bufsize", "7000k"] + common_params
+    if v_enc == "h264_amf":
+        return ["-c:v", v_enc, "-quality", "balanced", "-rc", "cbr", "-b:v", "3500k", "-maxrate", "4000k", "-bufsize", "7000k"] + common_params
+    if v_enc == "h264_qsv":
+        return ["-c:v", v_enc, "-preset", "medium", "-look_ahead", "1", "-rc_mode", "CBR", "-b:v", "3500k", "-max_bitrate", "4000k", "-bufsize", "7000k"] + common_params
+    # libx264, also the fallback for anything unknown
+    return ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-maxrate", "3500k", "-bufsize", "7000k"] + common_params
+
+
+def audio_encoder_args(a_enc):
+    if a_enc == "aac":
+        return ["-c:a", "aac", "-b:a", "128k", "-ar", "44100", "-strict", "-2"]
+    return ["-c:a", a_enc]
+
+
+def persistent_video_filter(width, height, fps):
+    """Scales and pads any input to width x height at a constant fps, as the persistent publisher needs."""
+    return (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p")
+
+
+def _hms_to_seconds(match):
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+
+class FeederProcess:
+    """A per-file ffmpeg that encodes to MPEG-TS for the persistent publisher.
+
+    Its stdout is read into a small bounded queue of whole TS packets. A feeder started
+    ahead of time therefore pre-rolls (opens the input, primes the encoder, fills the
+    queue) and then blocks on its pipe, ready to emit the moment it is handed over.
+    """
+    QUEUE_CHUNKS = 32
+    CHUNK_SIZE = TS_PACKET_SIZE * 64
+
+    def __init__(self, path, process):
+        self.path = path
+        self.process = process
+        self.stderr = io.TextIOWrapper(process.stderr, encoding='utf-8', errors='replace')
+        self.packets = queue.Queue(maxsize=self.QUEUE_CHUNKS)
+        self.cancelled = threading.Event()
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+
+    def _read_stdout(self):
+        pending = b''
+        try:
+            while not self.cancelled.is_set():
+                data = self.process.stdout.read1(self.CHUNK_SIZE)
+                if not data:
+                    break
+                pending += data
+                whole = len(pending) - len(pending) % TS_PACKET_SIZE
+                if whole:
+                    self._put(pending[:whole])
+                    pending = pending[whole:]
+        except (OSError, ValueError):
+            pass
+        self._put(None) # End of this feeder's output
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.packets.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class PublisherPump:
+    """Forwards TS packets from the active feeder into the publisher's stdin.
+
+    Natural transitions queue the next feeder behind the active one, so it takes over
+    as soon as the active one drains. A manual switch cuts over immediately and drops
+    the old feeder's buffered packets. Only whole packets are ever written, so the
+    publisher's demuxer never sees a torn packet at a handover.
+    """
+
+    def __init__(self, sink, on_handover):
+        self.sink = sink
+        self.on_handover = on_handover # called with (latency_ms, was_switch)
+        self.failed = False
+        self._cond = threading.Condition()
+        self._active = None
+        self._pending = None
+        self._handover_since = None
+        self._handover_is_switch = False
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def queue_next(self, feeder):
+        with self._cond:
+            if self._active is None:
+                self._active = feeder
+            else:
+                self._pending = feeder
+            self._cond.notify()
+
+    def switch_to(self, feeder, requested_at):
+        with self._cond:
+            old = self._active
+            self._active = feeder
+            self._pending = None
+            self._handover_since = requested_at
+            self._handover_is_switch = True
+            self._cond.notify()
+        if old is not None and old is not feeder:
+            old.cancel()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._active is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                feeder = self._active
+            try:
+                chunk = feeder.packets.get(timeout=0.2)
+            except queue.Empty:
+                continue # Re-check in case of an immediate switch
+            with self._cond:
+                if feeder is not self._active:
+                    continue # Switched away while waiting; drop stale data
+                if chunk is None:
+                    self._active, self._pending = self._pending, None
+                    self._handover_since = time.monotonic()
+                    self._handover_is_switch = False
+                    continue
+                since, was_switch = self._handover_since, self._handover_is_switch
+                self._handover_since = None
+            if since is not None:
+                self.on_handover((time.monotonic() - since) * 1000, was_switch)
+            try:
+                self.sink.write(chunk)
+                self.sink.flush()
+            except (OSError, ValueError):
+                self.failed = True # Publisher went away; stream_loop restarts it
+                return
+
+
+# --- Streaming Engine ---
+
+class StreamerEngine:
+    """Streams a folder of videos to an RTMP server in an endless loop, without any GUI.
+
+    start(settings), switch(), skip_to(path), stop() and restart() may be called from any
+    thread; all the work happens on one stream thread, which owns the EngineStateMachine. Output goes to
+    callbacks, called on engine threads: on_log(message) for log lines, on_status(fields)
+    for status-line fields (translation key -> format kwargs, None removing the field)
+    and on_transition(transition) for every state change.
+    """
+
+    def __init__(self, language=DEFAULT_LANG, on_log=None, on_status=None, on_transition=None):
+        self.language = language
+        self.on_log = on_log
+        self.on_status = on_status
+        self.on_transition = on_transition
+        self.settings = None # StreamSettings of the current (or last) run
+        # Owned by the stream thread; callers only post "stop"/"switch" commands to it
+        self.state_machine = EngineStateMachine(on_transition=self._on_engine_transition)
+        self.stop_reason = None # Why the engine last went to stopping; "stop" is the user's Stop
+        self.stream_thread = None
+        self.current_ffmpeg_process = None
+        self.reaper = ProcessReaper(on_reaped=self._on_process_reaped) # Stops every ffmpeg we give up on
+        self.publisher_process = None # Long-lived RTMP publisher (persistent mode only)
+        self.publisher_pump = None
+        self.standby_feeder = None # Pre-rolled feeder for the next file (persistent mode only)
+        self._switch_requested_at = None
+        self._switch_targets = collections.deque() # One entry per posted switch: a skip_to() path or None
+        self._switch_target = None # Target of the switch the stream thread last acted on
+        self._command_lock = threading.Lock() # Keeps _switch_targets in the order of the inbox
+        self.playlist = [] # Files of the current run, in play order; changed by the stream thread only
+        self.current_file = None # Playing (or about to play) file and the position in it, in seconds
+        self.position = 0.0
+        self.media_index = None # Opened on first start; persists probe results across runs
+        self.library_scanner = None
+        self._probe_unavailable = None # Last reason ffprobe could not run, reported once
+        self.folder_watcher = None
+        self.integrity_verifier = None
+        self.restart_policy = None # Backoff after failed runs; created per streaming session
+        self.failure_counts = collections.Counter() # Failed runs per ffmpeg_tools.FAILURE_CLASSES entry
+        self._encoder_fallback = None # Replaces the selected video encoder after it failed to start
+        self.stall_seconds = 0.0 # Total time lost to stalls, from detection window start to resumed progress
+        self.telemetry = ProgressHistory() # Parsed -progress samples: "stream" (current file) and "publisher"
+        self.frame_totals = collections.Counter() # (channel, "dropped"/"duplicated") -> frames, over all processes
+        self._frame_marks = {} # channel -> (process, its last sample), to count only new frames
+        self.switch_latency = Histogram() # Seconds from a switch command until the next file's media flows
+        self.file_gap = Histogram() # Seconds without media between two files
+        self._playlist_changes = queue.Queue() # (added, removed, updated) from the folder watcher
+        self.transcode_cache = None
+        self.playback_journal = None # Opened per streaming session; where playback continues after a restart
+        self.status_fields = {} # Current status-line fields, as last sent to on_status
+        self._status_lock = threading.Lock()
+        # Bumped by every log line, status change and transition, so a remote client can wait for
+        # "anything new" (changes_since); log lines are kept with the revision they got
+        self.revision = 0
+        self.log_history = collections.deque(maxlen=LOG_HISTORY) # (revision, wall time, message)
+        self._changed = threading.Condition()
+        self._last_file_end_time = None # monotonic time the previous file stopped emitting
+
+    @property
+    def state(self):
+        return self.state_machine.state
+
+    def running(self):
+        return self.state_machine.running()
+
+    def get_translation(self, key, **kwargs):
+        base_string = MESSAGES.get(self.language, {}).get(key) or MESSAGES[DEFAULT_LANG].get(key, f"<{key}>")
+        try:
+            return base_string.format(**kwargs)
+        except Exception as e:
+            print(f"Warning: Error formatting translation key '{key}': {e}")
+            return f"<{key}> (Format Error)"
+
+    def log(self, message):
+        self._bump(message)
+        if self.on_log is not None:
+            self.on_log(message)
+        else:
+            print(f"{time.strftime('%H:%M:%S')} - {message}", flush=True)
+
+    def _update_status(self, **fields):
+        """Merges status fields (None removes one) and passes the change on to on_status."""
+        with self._status_lock:
+            for key, value in fields.items():
+                if value is None:
+                    self.status_fields.pop(key, None)
+                else:
+                    self.status_fields[key] = value
+        self._bump()
+        if self.on_status is not None:
+            self.on_status(fields)
+
+    def status_snapshot(self):
+        with self._status_lock:
+            return dict(self.status_fields)
+
+    def _bump(self, message=None):
+        with self._changed:
+            self.revision += 1
+            if message is not None:
+                self.log_history.append((self.revision, time.time(), message))
+            self._changed.notify_all()
+
+    def changes_since(self, revision, timeout=0):
+        """Waits up to timeout seconds for a change after revision; returns (current revision,
+        log lines after revision). A revision from before a restart of the process counts as 0."""
+        with self._changed:
+            if revision > self.revision:
+                revision = 0
+            self._changed.wait_for(lambda: self.revision > revision, timeout)
+            return self.revision, [entry for entry in self.log_history if entry[0] > revision]
+
+    def start(self, settings):
+        """Starts streaming with settings on a new stream thread; False if a run is already active."""
+        if not self.state_machine.start():
+            return False
+        self.settings = settings
+        self.stop_reason = None
+        self._last_file_end_time = None
+        self._switch_requested_at = None
+        self._switch_targets.clear()
+        self._switch_target = None
+        self.log(self.get_translation('starting_stream_msg'))
+        self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+        self.stream_thread.start()
+        return True
+
+    def stop(self):
+        """Asks the stream thread to stop; False if nothing is streaming. Use wait() to block until it has."""
+        if not self.state_machine.post("stop"): # The stream loop terminates ffmpeg
+            return False
+        self.log(self.get_translation('stopping_stream_msg'))
+        return True
+
+    def switch(self):
+        """Skips to the next file; False if nothing is streaming."""
+        if not self._post_switch(None): # The stream loop pre-rolls the next file and terminates ffmpeg
+            return False
+        self.log(self.get_translation('switching_video_msg'))
+        return True
+
+    def skip_to(self, path):
+        """Switches to path, which should be in playlist, and continues from there; False if nothing is
+        streaming. A path that has left the playlist by the time the switch happens acts as switch()."""
+        if not self._post_switch(path):
+            return False
+        self.log(self.get_translation('skipping_to_msg', filename=os.path.basename(path)))
+        return True
+
+    def _post_switch(self, target):
+        with self._command_lock:
+            self._switch_targets.append(target)
+            if self.state_machine.post("switch"):
+                return True
+            self._switch_targets.pop()
+            return False
+
+    def restart(self, settings=None, timeout=None):
+        """Stops the current run, waits for it to end and starts a new one with settings (default: the
+        current ones), so the folder is read again and playback continues from the journal. False if the
+        old run did not end within timeout or another caller started one first."""
+        self.log(self.get_translation('restarting_stream_msg'))
+        self.stop()
+        if not self.wait(timeout):
+            return False
+        return self.start(settings or self.settings)
+
+    def wait(self, timeout=None):
+        """Blocks until the stream thread has finished; False on timeout."""
+        thread = self.stream_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def _on_engine_transition(self, transition):
+        """Called on the thread that made the transition, the stream thread for all but the start."""
+        self._bump()
+        if transition.latency is not None:
+            self.log(self.get_translation('engine_transition_msg', source=transition.source, target=transition.target,
+                                          reason=transition.reason, latency_ms=transition.latency * 1000))
+        if self.on_transition is not None:
+            self.on_transition(transition)
+
+    def _publisher_lost(self):
+        """True once the persistent publisher has exited or its pump could not write to it."""
+        process, pump = self.publisher_process, self.publisher_pump
+        return process is not None and (process.poll() is not None or (pump is not None and pump.failed))
+
+    def _request_ffmpeg_termination(self, reason="stop"):
+        """Requests termination of the current ffmpeg process without waiting."""
+        # Renamed from _terminate_ffmpeg_process to clarify it only sends signals
+        process_to_terminate = self.current_ffmpeg_process # Capture current process locally
+        if process_to_terminate and process_to_terminate.poll() is None:
+            pid = process_to_terminate.pid
+            log_msg_key = 'terminating_ffmpeg_for_switch_msg' if reason == "switch" else 'terminating_ffmpeg_msg'
+            self.log(self.get_translation(log_msg_key, pid=pid))
+            try:
+                # The reaper escalates to a kill if needed, without blocking the stream_loop
+                self.reaper.reap(process_to_terminate, label=reason)
+            except Exception as e:
+                # Log error if initial terminate call fails
+                self.log(self.get_translation('ffmpeg_terminate_exception_msg', error=e))
+        # DO NOT set self.current_ffmpeg_process = None here. Let the main loop handle it.
+
+    def _read_process_output(self, stream, process, events):
+        """Feeds stderr lines, then the exit of process, into the engine inbox, tagged with process."""
+        try:
+            for line in stream: # Universal newlines: ffmpeg's \r-terminated progress lines arrive one by one
+                line = line.strip()
+                if line:
+                    events.put(("line", line, process))
+        except (OSError, ValueError):
+            pass # Pipe closed underneath us (process killed)
+        try:
+            process.wait()
+        except Exception:
+            pass
+        if process.stdin is not None:
+            try:
+                process.stdin.close() # Only kept open so the reaper can send "q"
+            except OSError:
+                pass
+        events.put(("exit", process.poll(), process))
+
+    def _on_progress_sample(self, sample, remaining, persistent, next_file, full_rtmp_url):
+        """Per-sample decisions of stream_loop: standby pre-roll (persistent) or gap measurement (classic)."""
+        if persistent:
+            # The publisher pump measures handovers; here we only decide when to pre-roll
+            if (sample.out_time is not None and remaining and self.standby_feeder is None
+                    and remaining - sample.out_time <= PREFETCH_LEAD_SECONDS):
+                self._prefetch_standby(next_file, full_rtmp_url)
+        elif self._last_file_end_time is not None:
+            # First progress sample of the new file: media is flowing again
+            now = time.monotonic()
+            gap_ms = (now - self._last_file_end_time) * 1000
+            self._last_file_end_time = None
+            self.file_gap.observe(gap_ms / 1000)
+            self.log(self.get_translation('inter_file_gap_msg', gap_ms=gap_ms))
+            switch_requested_at, self._switch_requested_at = self._switch_requested_at, None
+            if switch_requested_at is not None:
+                self._on_handover((now - switch_requested_at) * 1000, True)
+
+    def _record_progress(self, channel, sample, process):
+        """Keeps sample in telemetry and adds the frames process dropped or duplicated since its last one."""
+        self.telemetry.record(channel, sample)
+        mark = self._frame_marks.get(channel)
+        previous = mark[1] if mark is not None and mark[0] is process else None # ffmpeg counts per process
+        self._frame_marks[channel] = (process, sample)
+        for kind, value, before in (("dropped", sample.drop_frames, previous and previous.drop_frames),
+                                    ("duplicated", sample.dup_frames, previous and previous.dup_frames)):
+            if value is not None:
+                self.frame_totals[channel, kind] += value - (before or 0) if value >= (before or 0) else value
+
+    def _wait_restart_delay(self, decision):
+        """Waits out the restart delay in the backoff state; returns the state a Stop or Switch moved to, if any."""
+        self.state_machine.transition(STATE_BACKOFF, "restart")
+        self._update_status(status_backoff={'delay': decision.delay, 'failures': decision.failures})
+        deadline = time.monotonic() + decision.delay
+        while True:
+            woke = self._wait_engine(deadline - time.monotonic())
+            if woke != "playlist": # Folder changes are applied at the top of the loop, after the wait
+                return woke
+
+    def _wait_engine(self, timeout):
+        """Blocks on the engine inbox for up to timeout seconds, acting on commands.
+
+        Returns the state a command moved to, "playlist" after a folder change, or None on
+        timeout. Output of ffmpeg processes that are no longer supervised is dropped.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                kind, value, extra = self.state_machine.inbox.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return None
+            if kind == "command":
+                state = self._apply_command(value, extra)
+                if state is not None:
+                    return state
+            elif kind == "playlist":
+                return kind
+
+    def _drain_engine(self):
+        """Acts on commands queued while no ffmpeg was supervised."""
+        while self._wait_engine(0) not in (None, STATE_STOPPING):
+            pass
+
+    def _apply_command(self, command, posted_at):
+        """Runs on the stream thread: moves the engine for a user command; returns the new state or None.
+
+        Stop wins over everything; once stopping, further commands are ignored.
+        """
+        if self.state_machine.state == STATE_STOPPING:
+            return None
+        if command == "stop":
+            self._halt("stop", posted_at)
+            return STATE_STOPPING
+        with self._command_lock:
+            self._switch_target = self._switch_targets.popleft() if self._switch_targets else None
+        self._switch_requested_at = posted_at # Start of the handover latency measurement
+        self.state_machine.transition(STATE_SWITCHING, "switch", posted_at)
+        return STATE_SWITCHING
+
+    def _halt(self, reason, posted_at=None):
+        """Moves the engine to stopping (stream thread only); the stream loop then winds down."""
+        if self.state_machine.state != STATE_STOPPING:
+            self.stop_reason = reason
+            self.state_machine.transition(STATE_STOPPING, reason, posted_at)
+
+    def _flag_failed_file(self, path, reason):
+        """Quarantines a file the restart policy skipped once another file proved the output is fine."""
+        self.log(self.get_translation('failed_file_flagged_msg', filename=os.path.basename(path)))
+        if self.media_index is not None:
+            reason = f"failed while streaming: {reason or 'unknown error'}"
+            self.media_index.flag(path, reason)
+
+    def _on_process_reaped(self, reaped):
+        """Called on the reaper thread once a process handed to it has exited."""
+        details = (f" (PID: {reaped.pid}, {reaped.label}, {reaped.method}, exit {reaped.returncode}, "
+                   f"{reaped.elapsed * 1000:.0f} ms)")
+        if reaped.method == "kill":
+            self.log(self.get_translation('ffmpeg_terminate_failed_msg') + details)
+            self.log(self.get_translation('ffmpeg_killed_msg') + details)
+        else:
+            self.log(self.get_translation('ffmpeg_terminated_msg') + details)
+
+    def _build_ffmpeg_command(self, current_file, full_rtmp_url, persistent=False, start_at=0.0):
+        """Builds the per-file ffmpeg command, starting start_at seconds into the file.
+
+        In persistent mode the file is encoded to MPEG-TS on stdout for the long-lived
+        publisher, which paces it with -re, instead of being pushed to RTMP directly.
+        Feeders are therefore not paced themselves and can pre-roll ahead of time. They
+        are always re-encoded to one resolution, frame rate and audio layout: the
+        publisher copies them into a single FLV session, which cannot change format.
+        """
+        silent = False
+        if persistent:
+            rendition = None # Renditions keep the source's resolution and frame rate
+            copy_video = copy_audio = False
+            info = self._probe_file(current_file)
+            silent = info is not None and not info["audio_codec"] # Without stream info, assume it has audio
+        else:
+            rendition = self._cached_rendition(current_file)
+            if rendition:
+                copy_video, copy_audio = True, True # Already encoded with the current profile
+            else:
+                copy_video, copy_audio = self._choose_stream_mode(current_file)
+        cmd = [self.settings.ffmpeg_path] + PROGRESS_ARGS
+        if not persistent:
+            cmd.append("-re")
+        if start_at:
+            cmd.extend(["-ss", f"{start_at:.3f}"])
+        cmd.extend(["-i", rendition or current_file])
+        watermark = not copy_video and self.settings.watermark
+        if watermark:
+            cmd.extend(["-i", self.settings.watermark])
+        if persistent:
+            if silent:
+                cmd.extend(["-f", "lavfi", "-i", PERSISTENT_AUDIO])
+            video_filter = "[0:v:0]" + persistent_video_filter(*PERSISTENT_VIDEO_SIZE, PERSISTENT_FPS)
+            if watermark: # Overlaid after scaling, so it has the same size on every file
+                video_filter += "[base];[base][1:v]overlay=main_w-overlay_w-10:10"
+            cmd.extend(["-filter_complex", video_filter + "[v]", "-map", "[v]",
+                        "-map", f"{2 if watermark else 1}:a" if silent else "0:a:0?"])
+            if silent:
+                cmd.append("-shortest") # The silence source never ends
+        elif watermark:
+            cmd.extend(["-filter_complex", "[0:v][1:v]overlay=main_w-overlay_w-10:10"])
+
+        v_enc = "copy" if copy_video else self._video_encoder()
+        if v_enc == "copy":
+            cmd.extend(["-c:v", "copy", "-max_muxing_queue_size", "1024"])
+        else:
+            if v_enc == "h264_nvenc":
+                self.log(self.get_translation('nvenc_driver_warning'))
+            elif v_enc == "h264_amf":
+                self.log(self.get_translation('amd_amf_warning'))
+            elif v_enc == "h264_qsv":
+                self.log(self.get_translation('intel_qsv_warning'))
+            cmd.extend(video_encoder_args(v_enc))
+        a_enc = self.settings.audio
+        if copy_video:
+            a_enc = "copy" if copy_audio else "aac" # Audio was checked against the ingest profile too
+        elif persistent:
+            a_enc = "aac" # Every file must reach the publisher with identical audio parameters
+        elif a_enc == "copy":
+            self.log(self.get_translation('copying_audio_info'))
+        cmd.extend(audio_encoder_args(a_enc))
+        if persistent:
+            cmd.extend(["-ac", "2", "-f", "mpegts", "pipe:1"])
+        else:
+            cmd.extend(["-f", "flv", full_rtmp_url])
+        return cmd
+
+    def _popen_ffmpeg(self, cmd, **kwargs):
+        creationflags = 0
+        if os.name == 'nt':
+            creationflags = subprocess.CREATE_NO_WINDOW # Hide console window on Windows
+        return subprocess.Popen(cmd, creationflags=creationflags, **kwargs)
+
+    def _start_feeder(self, path, full_rtmp_url, start_at=0.0):
+        cmd = self._build_ffmpeg_command(path, full_rtmp_url, persistent=True, start_at=start_at)
+        self.log(self.get_translation('executing_command_msg', command=' '.join(cmd)))
+        process = self._popen_ffmpeg(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return FeederProcess(path, process)
+
+    def _prefetch_standby(self, path, full_rtmp_url):
+        """Pre-rolls the feeder for the next file so the handover does not wait for ffmpeg startup."""
+        if self.standby_feeder is not None:
+            if self.standby_feeder.path == path and self.standby_feeder.process.poll() is None:
+                return
+            self._discard_standby()
+        try:
+            base_name = os.path.basename(path)
+        except Exception:
+            base_name = path
+        self.log(self.get_translation('prefetching_next_msg', filename=base_name))
+        try:
+            self.standby_feeder = self._start_feeder(path, full_rtmp_url)
+        except Exception as e:
+            self.log(self.get_translation('prefetch_failed_warn', error=e))
+
+    def _take_standby(self, path):
+        """Returns the pre-rolled feeder for path if one is ready, discarding a stale one."""
+        feeder = self.standby_feeder
+        if feeder is None:
+            return None
+        self.standby_feeder = None
+        if feeder.path == path and not feeder.cancelled.is_set():
+            return feeder # Even if it already exited, its packets are still queued
+        self._discard_feeder(feeder)
+        return None
+
+    def _discard_standby(self):
+        feeder, self.standby_feeder = self.standby_feeder, None
+        if feeder is not None:
+            self._discard_feeder(feeder)
+
+    def _discard_feeder(self, feeder):
+        feeder.cancel()
+        if feeder.process.poll() is None:
+            try:
+                self.reaper.reap(feeder.process, label="feeder")
+            except Exception as e:
+                self.log(self.get_translation('ffmpeg_terminate_exception_msg', error=e))
+
+    def _on_handover(self, latency_ms, was_switch):
+        if was_switch:
+            self.switch_latency.observe(latency_ms / 1000)
+            self.log(self.get_translation('switch_latency_msg', latency_ms=latency_ms))
+        else:
+            self.file_gap.observe(latency_ms / 1000)
+            self.log(self.get_translation('inter_file_gap_msg', gap_ms=latency_ms))
+        self._update_status(status_switch_latency={'latency_ms': latency_ms})
+
+    def _cache_profile(self):
+        """Every setting a cached rendition depends on; changing any of them invalidates the cache."""
+        return {"video_encoder": self._video_encoder(),
+                "audio": self.settings.audio,
+                "watermark": self.settings.watermark or ""}
+
+    def _keyframe_before(self, path, offset):
+        """Snaps a resume offset back to the keyframe ffmpeg can start cleanly at."""
+        try:
+            keyframe = keyframe_before(ffprobe_path_for(self.settings.ffmpeg_path), path, offset)
+        except ProbeError:
+            keyframe = None
+        return keyframe if keyframe is not None else offset # No keyframe found: let ffmpeg's seek decide
+
+    def _state_path(self, name):
+        """Where this channel keeps its journal and cache: settings.state_dir, by default the
+        shared config folder (the media index is always shared, it only caches ffprobe output)."""
+        return os.path.join(self.settings.state_dir or CONFIG_DIR, name)
+
+    def _open_journal(self):
+        """Opens the playback journal and returns its replayed state, or None if it is unusable."""
+        started = time.perf_counter()
+        try:
+            self.playback_journal = PlaybackJournal(self._state_path(JOURNAL_NAME))
+        except OSError as e:
+            self.log(self.get_translation('journal_open_failed_warn', error=e))
+            return None
+        state = self.playback_journal.state
+        self.log(self.get_translation('journal_replayed_msg', elapsed_ms=(time.perf_counter() - started) * 1000,
+                                      played=state.files_played, errors=state.errors))
+        return state
+
+    def _journal(self, event, *args):
+        """Appends to the playback journal; a full or failing disk must not take the stream down."""
+        journal = self.playback_journal
+        if journal is None:
+            return
+        try:
+            getattr(journal, event)(*args)
+        except OSError as e:
+            self.log(self.get_translation('journal_write_failed_warn', error=e))
+
+    def _video_encoder(self):
+        return self._encoder_fallback or self.settings.video_encoder
+
+    def _fall_back_encoder(self):
+        """Moves live and cache encodes to FALLBACK_ENCODER; False if that is already the one failing."""
+        failed = self._video_encoder()
+        if failed == FALLBACK_ENCODER:
+            return False
+        self._encoder_fallback = FALLBACK_ENCODER
+        self.log(self.get_translation('encoder_fallback_msg', failed=failed, fallback=FALLBACK_ENCODER))
+        return True
+
+    def _build_rendition_command(self, source, output_path, profile):
+        """Same encode as live streaming, but unpaced and into a Matroska file for later stream copy."""
+        cmd = [self.settings.ffmpeg_path, "-hide_banner", "-nostdin", "-y", "-i", source]
+        if profile["watermark"]:
+            cmd.extend(["-i", profile["watermark"], "-filter_complex", "[0:v][1:v]overlay=main_w-overlay_w-10:10"])
+        cmd.extend(video_encoder_args(profile["video_encoder"]))
+        cmd.extend(audio_encoder_args(profile["audio"]))
+        cmd.extend(["-f", "matroska", output_path])
+        return cmd
+
+    def _start_transcode_cache(self, video_files):
+        limit_gb = self.settings.cache_limit_gb
+        try:
+            self.transcode_cache = TranscodeCache(self.settings.ffmpeg_path, int(limit_gb * 1024 ** 3),
+                                                  cache_dir=self._state_path(CACHE_DIR_NAME), log=self.log)
+        except OSError as e:
+            self.log(self.get_translation('cache_open_failed_warn', error=e))
+            return
+        self.log(self.get_translation('cache_started_msg', folder=self.transcode_cache.cache_dir, limit_gb=limit_gb))
+        for path in video_files:
+            self._schedule_rendition(path)
+
+    def _schedule_rendition(self, path):
+        profile = self._cache_profile()
+        self.transcode_cache.schedule(
+            path, profile,
+            build_command=lambda source, output_path: self._build_rendition_command(source, output_path, profile),
+            # Files that already stream-copy need no rendition
+            should_cache=lambda source: profile["watermark"] or not self._stream_mode(source)[0])
+
+    def _cached_rendition(self, path):
+        if self.transcode_cache is None:
+            return None
+        rendition = self.transcode_cache.lookup(path, self._cache_profile())
+        if rendition:
+            self.log(self.get_translation('cache_hit_msg', filename=os.path.basename(path)))
+        else:
+            self._schedule_rendition(path) # In case it was evicted or the source changed
+        return rendition
+
+    def _start_library_scan(self, folder, video_files):
+        """Opens the persistent index and probes stale files in the background.
+
+        Streaming does not wait for the scan: the file about to play is probed on
+        demand if the scanner has not reached it yet.
+        """
+        if self.media_index is None:
+            try:
+                self.media_index = MediaIndex()
+            except (OSError, sqlite3.Error) as e:
+                self.log(self.get_translation('media_index_open_failed_warn', error=e))
+                return
+        started = time.monotonic()
+        self.media_index.forget_missing(folder, video_files)
+        self.library_scanner = LibraryScanner(self.media_index, ffprobe_path_for(self.settings.ffmpeg_path),
+                                              on_progress=self._on_scan_progress, progress_interval=5.0)
+        self.library_scanner.start(video_files)
+        _, stale, _, _ = self.library_scanner.progress()
+        self.log(self.get_translation('index_status_msg', fresh=len(video_files) - stale, stale=stale,
+                                      elapsed_ms=(time.monotonic() - started) * 1000))
+
+    def _start_integrity_verifier(self, video_files):
+        if self.media_index is None:
+            return
+        self.integrity_verifier = IntegrityVerifier(self.media_index, self.settings.ffmpeg_path,
+                                                    ffprobe_path_for(self.settings.ffmpeg_path),
+                                                    on_result=self._on_verify_result).start(video_files)
+
+    def _on_verify_result(self, path, error):
+        if error:
+            self.log(self.get_translation('quarantined_msg', filename=os.path.basename(path), reason=error))
+
+    def _on_scan_progress(self, done, total, rate, eta):
+        scanner = self.library_scanner
+        if scanner is None or scanner.cancelled or done >= total: # Finished or cancelled
+            if total and done >= total:
+                self.log(self.get_translation('scan_complete_msg', total=total, failed=scanner.failed if scanner else 0))
+            self._update_status(status_scan=None)
+            return
+        eta_text = f"{eta:.0f} s" if eta is not None else "?"
+        self.log(self.get_translation('scan_progress_msg', done=done, total=total, rate=rate, eta=eta_text))
+        self._update_status(status_scan={'done': done, 'total': total})
+
+    def _start_folder_watcher(self, folder, video_files):
+        while not self._playlist_changes.empty(): # Leftovers from the previous run
+            self._playlist_changes.get_nowait()
+        try:
+            self.folder_watcher = FolderWatcher(folder, on_change=self._on_folder_change).start(video_files)
+        except OSError as e:
+            self.log(self.get_translation('watch_failed_warn', error=e))
+            return
+        self.log(self.get_translation('watch_started_msg', backend=self.folder_watcher.backend))
+
+    def _on_folder_change(self, added, removed, updated):
+        """Runs on the watcher thread; the stream loop applies the change between files."""
+        if self.media_index is not None:
+            if removed:
+                self.media_index.forget(removed)
+            if added or updated:
+                # Probe ahead so the copy decision is ready when the file comes up; stop() cancels the scanner
+                scanner = self.library_scanner
+                if scanner is not None:
+                    scanner.add(added + updated)
+                if self.integrity_verifier is not None:
+                    self.integrity_verifier.add(added + updated)
+        self._playlist_changes.put((added, removed, updated))
+        self.state_machine.inbox.put(("playlist", None, None)) # Wakes the stream loop if it waits for files
+
+    def _apply_playlist_changes(self, video_files, file_index):
+        """Applies queued folder changes to video_files in place and returns the adjusted file_index.
+
+        file_index keeps pointing at the same upcoming file; removed files before it shift it back.
+        """
+        changes = []
+        try:
+            while True:
+                changes.append(self._playlist_changes.get_nowait())
+        except queue.Empty:
+            pass
+        for added, removed, updated in changes:
+            for path in removed:
+                if path not in video_files:
+                    continue
+                if video_files.index(path) < file_index:
+                    file_index -= 1
+                video_files.remove(path)
+                if self.standby_feeder is not None and self.standby_feeder.path == path:
+                    self._discard_standby()
+                self.log(self.get_translation('playlist_removed_msg', filename=os.path.basename(path)))
+            for path in added:
+                if path not in video_files:
+                    video_files.append(path) # Joins at the end of the current rotation
+                    self.log(self.get_translation('playlist_added_msg', filename=os.path.basename(path)))
+                if self.transcode_cache is not None:
+                    self._schedule_rendition(path)
+            for path in updated:
+                if self.standby_feeder is not None and self.standby_feeder.path == path:
+                    self._discard_standby() # Pre-rolled from the old contents
+                self.log(self.get_translation('playlist_updated_msg', filename=os.path.basename(path)))
+                if self.transcode_cache is not None:
+                    self._schedule_rendition(path)
+        return file_index
+
+    def _probe_file(self, path):
+        """Returns stream info for path from the media index, probing it if the entry is missing or stale."""
+        if self.media_index is None:
+            return None
+        try:
+            return self.media_index.ensure(path, ffprobe_path_for(self.settings.ffmpeg_path))
+        except ProbeUnavailable as e:
+            if str(e) != self._probe_unavailable: # A missing ffprobe would otherwise be reported for every file
+                self._probe_unavailable = str(e)
+                self.log(self.get_translation('probe_unavailable_msg', error=e))
+            return None
+        except ProbeError as e:
+            self.log(self.get_translation('probe_failed_msg', filename=os.path.basename(path), error=e))
+            return None
+
+    def _stream_mode(self, path):
+        """Decides from the probed stream info whether this file can skip re-encoding (classic mode only)."""
+        if not self.settings.stream_copy:
+            return False, False, None
+        watermark = bool(self.settings.watermark)
+        info = None if watermark else self._probe_file(path)
+        return choose_stream_mode(info, watermark=watermark)
+
+    def _choose_stream_mode(self, path):
+        copy_video, copy_audio, reason = self._stream_mode(path)
+        if reason is None:
+            return False, False
+        base_name = os.path.basename(path)
+        if copy_video:
+            mode = self.get_translation('mode_copy_all' if copy_audio else 'mode_copy_video')
+            self.log(self.get_translation('stream_copy_decision_msg', filename=base_name, mode=mode, reason=reason))
+        else:
+            self.log(self.get_translation('stream_encode_decision_msg', filename=base_name, reason=reason))
+        return copy_video, copy_audio
+
+    def _ensure_publisher(self, full_rtmp_url):
+        """Starts (or restarts) the long-lived publisher that owns the RTMP session.
+
+        The publisher reads concatenated MPEG-TS from its stdin and copies it to FLV.
+        Each file restarts its timestamps near zero; ffmpeg's MPEG-TS discontinuity
+        handling folds those jumps into one continuous timeline, so the RTMP server
+        sees a single uninterrupted broadcast.
+        """
+        if self.publisher_process and self.publisher_process.poll() is None and not self.publisher_pump.failed:
+            return True
+        if self.publisher_process:
+            self.log(self.get_translation('publisher_exited_warn', code=self.publisher_process.poll()))
+            self._stop_publisher()
+        cmd = [self.settings.ffmpeg_path, "-hide_banner", "-loglevel", "warning"] + PROGRESS_ARGS + [
+               "-re", "-f", "mpegts", "-i", "pipe:0",
+               "-map", "0", "-c", "copy", "-f", "flv", "-flvflags", "no_duration_filesize", full_rtmp_url]
+        self.log(self.get_translation('executing_command_msg', command=' '.join(cmd)))
+        try:
+            self.publisher_process = self._popen_ffmpeg(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            self.log(self.get_translation('ffmpeg_command_not_found_fatal', path=self.settings.ffmpeg_path))
+            self._halt("ffmpeg not found")
+            return False
+        except Exception as e:
+            self.log(self.get_translation('ffmpeg_unexpected_error_fatal', error=e))
+            self._halt("error")
+            return False
+        self.log(self.get_translation('starting_publisher_msg', pid=self.publisher_process.pid))
+        self.publisher_pump = PublisherPump(self.publisher_process.stdin, self._on_handover)
+        threading.Thread(target=self._drain_publisher_output, args=(self.publisher_process,), daemon=True).start()
+        return True
+
+    def _drain_publisher_output(self, process):
+        """Logs publisher warnings/errors and records its progress; also keeps its stderr pipe from filling up."""
+        parser = ProgressParser()
+        try:
+            for raw_line in iter(process.stderr.readline, b''):
+                line = raw_line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                is_progress, sample = parser.feed(line)
+                if sample is not None:
+                    self._record_progress("publisher", sample, process)
+                elif not is_progress:
+                    self.log(self.get_translation('publisher_output_log', line=line))
+        except Exception as e:
+            self.log(self.get_translation('publisher_read_error_warn', error=e))
+
+    def _stop_publisher(self):
+        """Closes the publisher's input so it flushes the FLV stream, then makes sure it exits."""
+        self._discard_standby()
+        if self.publisher_pump:
+            self.publisher_pump.close()
+            self.publisher_pump = None
+        process = self.publisher_process
+        self.publisher_process = None
+        if not process:
+            return
+        if process.poll() is None:
+            self.log(self.get_translation('stopping_publisher_msg', pid=process.pid))
+        # EOF on its input lets ffmpeg finish the FLV stream cleanly; "q" would not be read
+        # from a pipe that carries the media itself
+        self.reaper.reap(process, label="publisher", eof=True)
+
+    def stream_loop(self):
+        try:
+            self._stream_loop()
+        except Exception as e:
+            self.log(self.get_translation('stream_loop_error_fatal', error=e))
+            import traceback
+            self.log(traceback.format_exc())
+            self._halt("error")
+        finally:
+            # Also after an error outside the per-file handling, or the next Start finds the state locked
+            self._teardown_run()
+            self._halt("loop ended") # No-op after a Stop or fatal error, which got there first
+            self.state_machine.transition(STATE_IDLE, "stopped")
+
+    def _stream_loop(self):
+        folder = self.settings.video_folder
+        video_files = []
+        try:
+            safe_folder = folder
+            # Attempt to handle potential encoding issues on Windows more robustly
+            if os.name == 'nt':
+                 try:
+                      # Try decoding from filesystem encoding, re-encoding to UTF-8
+                      safe_folder_bytes = safe_folder.encode(sys.getfilesystemencoding(), 'surrogateescape')
+                      safe_folder = safe_folder_bytes.decode('utf-8', 'replace')
+                 except Exception as enc_err:
+                      self.log(f"WARN: Could not fully normalize folder path encoding: {folder}. Error: {enc_err}")
+            video_files = find_video_files(safe_folder)
+        except Exception as e:
+            self.log(self.get_translation('search_video_error_msg', error=e, folder=folder))
+            self._halt("error")
+            return
+
+        video_files = list(video_files) # Ensure it's a list
+        self.playlist = video_files
+        if not video_files:
+            self.log(self.get_translation('no_videos_found_error', folder=folder, exts=', '.join(VIDEO_EXTENSIONS)))
+            self._halt("no videos")
+            return
+
+        self.log(self.get_translation('found_videos_msg', count=len(video_files)))
+        self._start_library_scan(folder, video_files)
+        self._start_folder_watcher(safe_folder, video_files)
+        if self.settings.verify:
+            self._start_integrity_verifier(video_files)
+        if self.settings.persistent:
+            width, height = PERSISTENT_VIDEO_SIZE
+            self.log(self.get_translation('persistent_normalize_msg', width=width, height=height, fps=PERSISTENT_FPS))
+        if self.settings.cache and self.settings.persistent:
+            self.log(self.get_translation('persistent_cache_unused_msg'))
+        elif self.settings.cache:
+            self._start_transcode_cache(video_files)
+        self.restart_policy = RestartPolicy(max_file_failures=self.settings.max_file_failures)
+        self._encoder_fallback = None
+        resume_path, resume_offset = None, 0.0 # Set after an output failure: reconnect at the same spot
+        stall_window = self.settings.stall_window
+        stalled_since = None # Set while recovering from a stall, to time the interruption
+        failure_reasons = {} # Last ffmpeg error per failing file, kept in case it gets quarantined
+        file_index = 0
+        quarantined_in_row = 0 # Consecutive quarantined files skipped; a full lap means nothing is playable
+        skipped_files = set()
+        base_rtmp_url = self.settings.rtmp_url.strip().rstrip('/')
+        stream_key = self.settings.stream_key.strip()
+        full_rtmp_url = f"{base_rtmp_url}/{stream_key}"
+        saved = self._open_journal()
+        if saved and saved.path in video_files:
+            file_index = video_files.index(saved.path)
+            if saved.completed:
+                file_index += 1 # Wrapped around at the top of the loop if it was the last one
+            elif saved.position > 0:
+                resume_path, resume_offset = saved.path, saved.position
+                self.log(self.get_translation('resume_saved_msg', filename=os.path.basename(saved.path),
+                                              offset=saved.position))
+
+        # Main loop: continues until the engine is stopping (Stop, or a fatal error)
+        while self.state_machine.state != STATE_STOPPING:
+            # --- Loop/Index Management ---
+            self._drain_engine() # Commands that arrived between files
+            if self.state_machine.state == STATE_STOPPING:
+                break
+            file_index = self._apply_playlist_changes(video_files, file_index)
+            target, self._switch_target = self._switch_target, None
+            if target is not None and target in video_files:
+                file_index = video_files.index(target) # skip_to(); a plain switch already moved on by one
+            if not video_files:
+                self.log(self.get_translation('playlist_empty_wait_msg'))
+                self._update_status(status_playing=None)
+                while not video_files and self.state_machine.state != STATE_STOPPING:
+                    self._wait_engine(60) # Woken by the folder watcher or a command
+                    file_index = self._apply_playlist_changes(video_files, 0)
+                continue
+            if file_index >= len(video_files):
+                file_index = 0 # Wrap around
+                self.log(self.get_translation('loop_complete_msg'))
+
+            current_file = video_files[file_index]
+            reason = self.media_index.quarantine_reason(current_file) if self.media_index is not None else None
+            if reason:
+                if current_file not in skipped_files: # Once per run, not every lap
+                    skipped_files.add(current_file)
+                    self.log(self.get_translation('skipping_quarantined_msg', filename=os.path.basename(current_file), reason=reason))
+                quarantined_in_row += 1
+                if quarantined_in_row >= len(video_files):
+                    self.log(self.get_translation('all_quarantined_msg'))
+                    self._update_status(status_playing=None)
+                    self._wait_engine(10) # Re-check every 10 s, sooner if the folder changes or streaming stops
+                    file_index = self._apply_playlist_changes(video_files, file_index)
+                    quarantined_in_row = 0
+                else:
+                    file_index += 1
+                continue
+            quarantined_in_row = 0
+            try:
+                # Use safer basename handling
+                base_name = os.path.basename(current_file)
+            except Exception:
+                 # Provide a more informative error message
+                base_name = self.get_translation('filename_encoding_error', index=file_index+1)
+            self.log(self.get_translation('starting_file_msg', filename=base_name))
+            if self.state_machine.state in (STATE_PLAYING, STATE_BACKOFF):
+                self.state_machine.transition(STATE_STARTING, base_name) # After a switch it stays switching until media flows
+
+            self._update_status(status_playing={'filename': base_name})
+
+            persistent = self.settings.persistent
+            if persistent and not self._ensure_publisher(full_rtmp_url):
+                break
+            next_file = video_files[(file_index + 1) % len(video_files)]
+            if self.library_scanner is not None:
+                self.library_scanner.prioritize(next_file) # Needed soon for the copy decision and pre-roll
+            if self.integrity_verifier is not None:
+                self.integrity_verifier.prioritize(next_file)
+            indexed = self._probe_file(current_file)
+            file_duration = indexed["duration"] if indexed else None # Falls back to ffmpeg's "Duration:" line
+
+            start_at = resume_offset if resume_path == current_file else 0.0
+            resume_path = None
+            if start_at:
+                start_at = self._keyframe_before(current_file, start_at)
+                self.log(self.get_translation('resuming_at_msg', filename=base_name, offset=start_at))
+            position = start_at # Seconds into the file, from the progress samples
+            self.current_file, self.position = current_file, position
+            self._journal("started", current_file, position)
+            last_checkpoint = time.monotonic()
+
+            # --- Execute FFmpeg and Handle Output/Signals ---
+            process_finished_normally = False
+            ended_by = None # "stop" or "switch" when a command ended this file
+            stall = None
+            publisher_lost = False
+            ffmpeg_process_started = False # Flag to track if Popen was successful
+            stderr_lines = [] # Store recent stderr lines for error context
+            try:
+                # *** Critical: Set self.current_ffmpeg_process *only* after Popen succeeds ***
+                if persistent:
+                    if start_at:
+                        self._discard_standby() # Pre-rolled from the start of the file
+                        feeder = self._start_feeder(current_file, full_rtmp_url, start_at)
+                    else:
+                        feeder = self._take_standby(current_file) or self._start_feeder(current_file, full_rtmp_url)
+                    local_process = feeder.process
+                    stderr_stream = feeder.stderr
+                    switch_requested_at, self._switch_requested_at = self._switch_requested_at, None
+                    if switch_requested_at is not None:
+                        self.publisher_pump.switch_to(feeder, switch_requested_at)
+                    else:
+                        self.publisher_pump.queue_next(feeder)
+                else:
+                    cmd = self._build_ffmpeg_command(current_file, full_rtmp_url, start_at=start_at)
+                    self.log(self.get_translation('executing_command_msg', command=' '.join(cmd)))
+                    # stdin stays a pipe so the reaper can ask ffmpeg to quit ("q") and flush the FLV stream
+                    local_process = self._popen_ffmpeg(
+                        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        universal_newlines=True, encoding='utf-8', errors='replace'
+                    )
+                    stderr_stream = local_process.stderr
+                self.current_ffmpeg_process = local_process # Assign to instance variable
+                ffmpeg_process_started = True
+
+                # Supervise the process: output lines, its exit and user commands all arrive on the
+                # engine inbox, so Stop/Switch are handled immediately even while ffmpeg prints nothing
+                events = self.state_machine.inbox
+                threading.Thread(target=self._read_process_output, args=(stderr_stream, local_process, events),
+                                 daemon=True).start()
+
+                progress_parser = ProgressParser()
+                last_progress_log = time.monotonic()
+                watchdog = StallWatchdog(window=stall_window)
+                while True:
+                    try:
+                        kind, value, extra = events.get(timeout=STALL_CHECK_SECONDS)
+                    except queue.Empty:
+                        kind = None # Quiet ffmpeg: only the watchdog has something to say
+                    if kind in ("line", "exit") and extra is not local_process:
+                        continue # A feeder we switched away from, still draining into the publisher
+                    if persistent and ended_by is None and self._publisher_lost():
+                        # Without this the feeder just blocks on a full pipe until the stall watchdog fires
+                        publisher_lost = True
+                        self.log(self.get_translation('publisher_lost_msg', filename=base_name, offset=position))
+                        self._request_ffmpeg_termination("publisher")
+                        break
+                    if kind == "exit":
+                        break # Output closed and the process has exited
+
+                    stall = watchdog.check() if ended_by is None else None # Already on its way out otherwise
+                    if stall is not None:
+                        self.log(self.get_translation('stall_detected_msg', filename=base_name, reason=stall.reason,
+                                                      speed=stall.speed, seconds=time.monotonic() - stall.since,
+                                                      offset=position))
+                        if stalled_since is None: # Not yet recovered from an earlier stall: keep timing that one
+                            stalled_since = stall.since
+                        self._request_ffmpeg_termination("stall")
+                        break
+                    if kind not in ("line", "command"):
+                        continue
+
+                    if kind == "command":
+                        state = self._apply_command(value, extra)
+                        if state is None:
+                            continue
+                        terminating = ended_by is not None
+                        ended_by = "stop" if state == STATE_STOPPING else "switch"
+                        if terminating:
+                            continue # Already asked to exit; a Stop now just ends the run after this file
+                        if ended_by == "stop":
+                            self.log(self.get_translation('stop_detected_ffmpeg_output_msg'))
+                            self._request_ffmpeg_termination("stop")
+                            continue # Keep taking commands until it has exited
+                        self.log(self.get_translation('switch_detected_ffmpeg_output_msg'))
+                        if persistent and self.standby_feeder is None:
+                            # Pre-roll while the old feeder winds down
+                            self._prefetch_standby(self._switch_target or next_file, full_rtmp_url)
+                        self._request_ffmpeg_termination("switch")
+                        if persistent:
+                            break # The old feeder keeps the publisher fed until the next one takes over
+                        continue
+
+                    line = value
+                    is_progress, sample = progress_parser.feed(line)
+                    if is_progress:
+                        if sample is not None:
+                            self._record_progress("stream", sample, local_process)
+                            self._update_status(status_progress={'progress': format_progress(sample)})
+                            if sample.at - last_progress_log >= PROGRESS_LOG_SECONDS:
+                                last_progress_log = sample.at
+                                self.log(self.get_translation('progress_log_msg', progress=format_progress(sample)))
+                            watchdog.observe(sample)
+                            if sample.out_time is not None:
+                                position = start_at + sample.out_time
+                                self.position = position
+                                if ended_by is None and self.state_machine.state in (STATE_STARTING, STATE_SWITCHING):
+                                    self.state_machine.transition(STATE_PLAYING, base_name) # Media is flowing
+                            if sample.at - last_checkpoint >= CHECKPOINT_SECONDS:
+                                last_checkpoint = sample.at
+                                self._journal("checkpoint", current_file, position)
+                            if stalled_since is not None and sample.out_time:
+                                self.stall_seconds += sample.at - stalled_since
+                                self.log(self.get_translation('stall_recovered_msg', seconds=sample.at - stalled_since))
+                                stalled_since = None
+                            remaining = file_duration - start_at if file_duration else None
+                            self._on_progress_sample(sample, remaining, persistent, next_file, full_rtmp_url)
+                        continue
+
+                    if file_duration is None:
+                        duration_match = DURATION_RE.search(line)
+                        if duration_match:
+                            file_duration = _hms_to_seconds(duration_match)
+                    self.log(self.get_translation('ffmpeg_output_log', line=line))
+                    stderr_lines.append(line)
+                    if len(stderr_lines) > 20: # Keep only last 20 lines
+                        stderr_lines.pop(0)
+
+                # --- Post-Process Handling (after stderr loop) ---
+                # Ensure cleanup happens even if stderr loop breaks early
+                return_code = None
+                if persistent and ended_by == "switch":
+                    # The old feeder keeps the publisher fed until the next one takes over,
+                    # so hand over first and leave the reaping to the kill thread
+                    pass
+                elif self.current_ffmpeg_process:
+                    # Wait for the process to finish if it hasn't already (e.g., due to signal break)
+                    try:
+                         # Use a timeout to avoid blocking indefinitely if termination fails unexpectedly
+                        self.current_ffmpeg_process.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                         self.log(f"WARN: Timeout waiting for FFmpeg process (PID: {self.current_ffmpeg_process.pid}) to exit after loop.")
+                    except Exception as wait_err:
+                         self.log(f"WARN: Error during final FFmpeg process wait: {wait_err}")
+                    # Get final return code
+                    return_code = self.current_ffmpeg_process.poll()
+                    self._last_file_end_time = time.monotonic()
+
+
+                # Check signals *again* after process finished/was terminated/waited upon
+                if ended_by == "stop":
+                    self.log(self.get_translation('stop_detected_after_file_msg', filename=base_name))
+                    self._journal("checkpoint", current_file, position) # Exact, not up to CHECKPOINT_SECONDS old
+                    break # Exit the main loop
+
+                if ended_by == "switch":
+                    self.log(self.get_translation('switch_detected_after_file_msg', filename=base_name))
+                    # Don't break the main loop, just continue to the next video
+                    file_index += 1
+                    self.log(self.get_translation('switching_to_next_video_msg'))
+                    continue # Go to the next iteration of the main while loop
+
+                # --- Handle Normal Exit / Errors ---
+                if return_code == 0:
+                    self.log(self.get_translation('stream_finished_success_msg', filename=base_name))
+                    process_finished_normally = True
+                    self._journal("completed", current_file)
+                    self._update_status(status_backoff=None)
+                    for broken in self.restart_policy.record_success(current_file):
+                        self._flag_failed_file(broken, failure_reasons.pop(broken, None))
+                    failure_reasons.pop(current_file, None)
+                # Check if process actually started before logging errors
+                elif ffmpeg_process_started:
+                     # Handle potential negative exit codes on Windows more gracefully
+                    effective_code = return_code if return_code is not None else "N/A"
+                    if os.name == 'nt' and return_code is not None and return_code < 0:
+                         effective_code = return_code & 0xFFFFFFFF # Treat as unsigned 32-bit
+                         self.log(f"WARN: FFmpeg exited with negative code {return_code}, interpreted as {effective_code}")
+
+                    # Log error only if it wasn't due to a user stop/switch signal detected *before* the error
+                    # (return_code might be non-zero due to termination signal)
+                    if ended_by is None:
+                         if stall is not None:
+                             failure = FAILURE_STALL # Terminated by the watchdog; its exit code says nothing
+                             if persistent:
+                                 self._stop_publisher() # The blocked socket may well be the publisher's
+                         elif publisher_lost:
+                             failure = FAILURE_OUTPUT # The feeder was fine; the next file restarts the publisher
+                         else:
+                             self.log(self.get_translation('ffmpeg_error_exit_msg', code=f"{return_code} ({effective_code})", filename=base_name))
+                             error_context = "\n".join(stderr_lines) # Use captured stderr
+                             self.log(self.get_translation('ffmpeg_error_context_msg', context=error_context))
+                             failure = classify_failure(return_code, stderr_lines, current_file,
+                                                        "pipe:1" if persistent else full_rtmp_url)
+                         self.failure_counts[failure] += 1
+                         self._journal("error", current_file, failure, stderr_lines[-1] if stderr_lines else None)
+                         counts = ", ".join(f"{name} {self.failure_counts[name]}" for name in FAILURE_CLASSES)
+                         self.log(self.get_translation('failure_class_msg', failure=failure, counts=counts))
+                         if failure in (FAILURE_OUTPUT, FAILURE_ENCODER, FAILURE_STALL):
+                             resume_path, resume_offset = current_file, position
+                         if failure == FAILURE_ENCODER and self._fall_back_encoder():
+                             continue # Retry at once with the fallback encoder; not the file's fault
+                         failure_reasons[current_file] = stderr_lines[-1] if stderr_lines else f"exit code {return_code}"
+                         decision = self.restart_policy.record_failure(current_file, failure)
+                         self.log(self.get_translation('restart_backoff_msg', failures=decision.failures,
+                                                       file_failures=decision.file_failures,
+                                                       max_failures=self.restart_policy.max_file_failures,
+                                                       delay=decision.delay))
+                         if decision.skip_file:
+                             self.log(self.get_translation('skipping_failed_file_msg', filename=base_name,
+                                                           file_failures=decision.file_failures))
+                             file_index += 1
+                         woke = self._wait_restart_delay(decision)
+                         if decision.skip_file or failure == FAILURE_ENCODER:
+                             resume_path = None
+                         if woke == STATE_SWITCHING and not decision.skip_file:
+                             file_index += 1 # Switch pressed during the wait: move on instead of retrying
+                             resume_path = None
+                    else:
+                         # Logged as stopped/switched, non-zero exit code is expected/acceptable
+                         self.log(f"INFO: FFmpeg exited with code {return_code} after stop/switch request for {base_name}.")
+
+
+            except FileNotFoundError:
+                self.log(self.get_translation('ffmpeg_command_not_found_fatal', path=self.settings.ffmpeg_path))
+                self._halt("ffmpeg not found") # Stop loop on fatal error
+            except Exception as e:
+                self.log(self.get_translation('ffmpeg_unexpected_error_fatal', error=e))
+                import traceback
+                self.log(traceback.format_exc())
+                self._halt("error") # Stop loop on fatal error
+            finally:
+                 # *** This is the primary place to set process handle to None ***
+                 # Ensure it's cleared after wait()/poll() and error handling
+                 self.current_ffmpeg_process = None
+
+            # --- Loop Increment / Exit Check ---
+            if self.state_machine.state == STATE_STOPPING:
+                 # Check again in case a command arrived during error handling/backoff
+                 break
+            elif process_finished_normally:
+                 # Increment index only if the process finished without stop/switch/error request interrupting it mid-stream
+                 file_index += 1
+            # else: If process failed or was switched, loop continues without incrementing index (unless switched, then 'continue' was used)
+
+    def _teardown_run(self):
+        """Stops the publisher and every helper of the run, and releases the journal and cache locks."""
+        self._stop_publisher()
+        if not self.reaper.wait_idle(SHUTDOWN_TIMEOUT_SECONDS):
+            self.log(self.get_translation('shutdown_pending_warn', count=self.reaper.pending()))
+        for method, stats in sorted(self.reaper.exit_time_stats().items()):
+            self.log(self.get_translation('shutdown_stats_msg', method=method, count=stats["count"],
+                                          mean_ms=stats["mean"] * 1000, p95_ms=stats["p95"] * 1000,
+                                          max_ms=stats["max"] * 1000))
+        if self.library_scanner is not None:
+            self.library_scanner.cancel()
+            self.library_scanner = None
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+        if self.integrity_verifier is not None:
+            self.integrity_verifier.stop()
+            self.integrity_verifier = None
+        if self.transcode_cache is not None:
+            self.transcode_cache.shutdown()
+            self.transcode_cache = None
+        if self.playback_journal is not None:
+            self.playback_journal.close()
+            self.playback_journal = None
+        self._update_status(status_playing=None, status_progress=None, status_backoff=None)
+        self.current_file = None
+
+        # --- Loop Exit Logging ---
+        if self.stop_reason == "stop":
+            self.log(self.get_translation('exiting_loop_after_file_msg'))
+        else:
+            # The loop stopped without the user asking for it (fatal error)
+            self.log(self.get_translation('loop_terminated_unexpectedly_warn'))
+
+        self.log(self.get_translation('stream_thread_finished_msg'))
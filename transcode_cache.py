@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from media_library import CONFIG_DIR, lock_state_file, spawn_low_priority
+
+CACHE_DIR_NAME = "cache"
+DEFAULT_CACHE_DIR = os.path.join(CONFIG_DIR, CACHE_DIR_NAME)
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024 # Hashed from the start, middle and end of each source
+
+
+def file_fingerprint(path, size):
+    """Hashes the size and three 1 MiB samples of the file.
+
+    Reading whole multi-GB sources would make every cache check as slow as a copy;
+    sampled content still changes whenever the file is re-encoded or replaced.
+    """
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - FINGERPRINT_SAMPLE_BYTES // 2), max(0, size - FINGERPRINT_SAMPLE_BYTES)):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class TranscodeCache:
+    """On-disk store of stream-ready renditions, keyed by source content plus encoder profile.
+
+    A bounded pool of background ffmpeg encodes fills the cache; the live loop asks
+    lookup() for each file and stream-copies the rendition when one exists. Entries
+    for a source are dropped as soon as its mtime/size or the profile changes, and
+    the least recently used renditions are evicted to stay under max_bytes. One process
+    at a time owns a cache directory (manifest.lock); another gets StateInUseError.
+    """
+
+    def __init__(self, ffmpeg_path, max_bytes, cache_dir=DEFAULT_CACHE_DIR, workers=1, log=print):
+        self.ffmpeg_path = ffmpeg_path
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.log = log
+        self._manifest_path = os.path.join(cache_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._processes = set()
+        self._closed = False
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_file = lock_state_file(os.path.join(cache_dir, "manifest.lock")) # Before .part files are cleaned up
+        self._entries, self._sources = self._load_manifest()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, encoding='utf-8') as f:
+                data = json.load(f)
+            entries, sources = data.get("entries", {}), data.get("sources", {})
+        except (OSError, ValueError):
+            entries, sources = {}, {}
+        # Forget entries whose rendition disappeared, and remove half-written ones
+        entries = {key: e for key, e in entries.items() if os.path.isfile(self._entry_path(key))}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+        return entries, sources
+
+    def _save_manifest(self):
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self._entries, "sources": self._sources}, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".mkv")
+
+    def _source_digest(self, path):
+        """Content fingerprint of path, recomputed only when its mtime or size changed.
+
+        The sampled reads happen outside the cache lock, so a slow disk never blocks lookup().
+        """
+        st = os.stat(path)
+        with self._lock:
+            known = self._sources.get(path)
+        if known and known["mtime"] == st.st_mtime and known["size"] == st.st_size:
+            return known["digest"]
+        digest = file_fingerprint(path, st.st_size)
+        with self._lock:
+            self._sources[path] = {"mtime": st.st_mtime, "size": st.st_size, "digest": digest}
+        return digest
+
+    def key_for(self, source, profile):
+        """profile is a JSON-serialisable dict of every setting the rendition depends on.
+
+        Must be called without holding the cache lock.
+        """
+        parts = {"source": self._source_digest(source), "profile": profile}
+        watermark = profile.get("watermark")
+        if watermark:
+            parts["watermark"] = self._source_digest(watermark)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _invalidate_source(self, source, keep_key):
+        stale = [key for key, e in self._entries.items() if e["source"] == source and key != keep_key]
+        for key in stale:
+            self._remove_entry(key)
+        return bool(stale)
+
+    def _remove_entry(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return # Probably still open by a live ffmpeg (Windows); retry at the next eviction
+        self._entries.pop(key, None)
+
+    def lookup(self, source, profile):
+        """Returns the rendition path for source under profile, or None if not cached yet."""
+        try:
+            key = self.key_for(source, profile)
+        except OSError:
+            return None
+        with self._lock:
+            changed = self._invalidate_source(source, key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                changed = True
+            if changed:
+                self._save_manifest()
+            return self._entry_path(key) if entry is not None else None
+
+    def schedule(self, source, profile, build_command, should_cache=None):
+        """Queues a background encode of source unless it is already queued.
+
+        Cheap enough to call for a whole library before streaming starts: the cache key,
+        which reads samples of the file, is computed by the worker, which also skips
+        sources that are cached already. build_command(source, output_path) returns the
+        ffmpeg argument list; should_cache(source), evaluated in the worker, can veto
+        files that need no rendition (e.g. already stream-copyable).
+        """
+        with self._lock:
+            if self._closed or source in self._pending:
+                return
+            self._pending.add(source)
+        self._executor.submit(self._build_entry, source, profile, build_command, should_cache)
+
+    def _build_entry(self, source, profile, build_command, should_cache):
+        try:
+            if self._closed:
+                return
+            try:
+                key = self.key_for(source, profile)
+            except OSError:
+                return # Gone or unreadable; lookup() falls back to the source
+            with self._lock:
+                if key in self._entries:
+                    return
+            if should_cache is not None and not should_cache(source):
+                return
+            part_path = self._entry_path(key) + ".part"
+            cmd = build_command(source, part_path)
+            started = time.monotonic()
+            process = spawn_low_priority(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            with self._lock:
+                self._processes.add(process)
+            try:
+                _, stderr = process.communicate()
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+            if process.returncode != 0 or self._closed:
+                if not self._closed:
+                    tail = stderr.decode('utf-8', 'replace').strip().splitlines()[-3:]
+                    self.log(f"WARN: Cache encode failed for {os.path.basename(source)}: {' | '.join(tail)}")
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+                return
+            os.replace(part_path, self._entry_path(key))
+            with self._lock:
+                self._invalidate_source(source, key)
+                self._entries[key] = {"source": source, "size": os.path.getsize(self._entry_path(key)),
+                                      "last_used": time.time()}
+                self._evict()
+                self._save_manifest()
+            self.log(f"INFO: Cached stream-ready rendition of {os.path.basename(source)} "
+                     f"in {time.monotonic() - started:.0f} s")
+        except Exception as e:
+            self.log(f"WARN: Cache encode error for {source}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(source)
+
+    def _evict(self):
+        """Drops least recently used renditions until the cache fits in max_bytes."""
+        total = sum(e["size"] for e in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            self._remove_entry(key)
+            if key not in self._entries:
+                total -= entry["size"]
+
+    def shutdown(self):
+        """Cancels queued encodes and stops the running ones."""
+        with self._lock:
+            self._closed = True
+            processes = list(self._processes)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        self._lock_file.close()